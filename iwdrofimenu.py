@@ -18,9 +18,11 @@
 # along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys
+import json
 import logging
 import argparse
-from settings import DEVICE, print_full_config
+from datetime import datetime
+from settings import DEVICE, RUNTIME_DIR, print_full_config
 import iwdrofimenu
 
 DESCRIPTION = """A minimalistic wifi chooser for iwd using rofi.
@@ -71,6 +73,54 @@ if __name__ == "__main__":
                            optimized for rofi's combi mode)")
     argparser.add_argument("--config", action="store_true",
                            help="dump default configuration file")
+    argparser.add_argument("--status", action="store_true",
+                           help="print the connection state and exit \
+                           (for status bars, answered from the cache if \
+                           it's fresh)")
+    argparser.add_argument("--watch", action="store_true",
+                           help="keep running and print the status whenever \
+                           it changes")
+    argparser.add_argument("--roam", action="store_true",
+                           help="keep running and switch to a better known \
+                           network when the connection gets poor")
+    argparser.add_argument("--dmenu", action="store_true",
+                           help="run rofi in dmenu mode and show the \
+                           entries as soon as they are known (instead of \
+                           running as rofi script)")
+    argparser.add_argument("--prewarm", action="store_true",
+                           help="scan, wait for the results and fill the \
+                           cache, then exit (to be run after resume or \
+                           when an adapter is plugged in, see contrib/)")
+    argparser.add_argument("--survey", action="store_true",
+                           help="keep scanning every survey_interval \
+                           seconds and log the networks seen to the \
+                           survey_file database (for site surveys)")
+    argparser.add_argument("--survey-report", action="store_true",
+                           help="print coverage statistics per network \
+                           from the survey_file database and exit")
+    argparser.add_argument("--since", metavar="TIME",
+                           type=datetime.fromisoformat,
+                           help="start of the time range for \
+                           --survey-report (e.g. 2023-05-01T09:00)")
+    argparser.add_argument("--until", metavar="TIME",
+                           type=datetime.fromisoformat,
+                           help="end of the time range for --survey-report")
+    argparser.add_argument("--record", metavar="FILE",
+                           help="record all iwctl and rfkill calls with their \
+                           results and timings to FILE (e.g. to attach it to \
+                           a bug report)")
+    argparser.add_argument("--replay", metavar="FILE",
+                           help="don't run iwctl or rfkill, serve the calls \
+                           from a recording instead")
+    argparser.add_argument("--replay-speed", metavar="FACTOR", type=float,
+                           default=1.0,
+                           help="speedup factor for --replay (0 answers \
+                           immediately)")
+    argparser.add_argument("--format", choices=["text", "json", "i3bar"],
+                           default=None,
+                           help="output format of --status and \
+                           --survey-report (text, json) and --watch (text, \
+                           json, i3bar)")
     args = argparser.parse_args()
 
 #    if args.help:
@@ -81,6 +131,62 @@ if __name__ == "__main__":
         sys.exit(0)
     if args.verbose:
         logging.basicConfig(level=logging.DEBUG)
+    elif args.roam or args.survey:
+        # the decisions of the roaming assistant and the progress of the
+        # survey are always logged
+        logging.basicConfig(level=logging.INFO)
+    backend = iwdrofimenu.SubprocessBackend()
+    if args.replay:
+        backend = iwdrofimenu.ReplayBackend(args.replay, args.replay_speed)
+    if args.record:
+        backend = iwdrofimenu.RecordingBackend(backend, args.record)
+    iwdrofimenu.set_default_backend(backend)
+    if args.record or args.replay:
+        # replayed results must not be served to other processes, and a
+        # recording has to contain the queries answered from the cache of
+        # other processes, so the session gets a cache of its own
+        iwdrofimenu.set_default_directory(
+                RUNTIME_DIR + ("-replay" if args.replay else "-record"))
+    if args.status:
+        if args.format == "i3bar":
+            argparser.error("--status doesn't support the i3bar format")
+        iwdrofimenu.print_status(DEVICE, args.format or "text")
+        sys.exit(0)
+    if args.watch:
+        try:
+            iwdrofimenu.Watcher(DEVICE, args.format or "json").run()
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+    if args.survey_report:
+        if args.format == "i3bar":
+            argparser.error("--survey-report doesn't support the i3bar "
+                            "format")
+        stats = iwdrofimenu.report(
+                since=args.since.timestamp() if args.since else None,
+                until=args.until.timestamp() if args.until else None)
+        if args.format == "json":
+            print(json.dumps(stats))
+        else:
+            print(iwdrofimenu.format_report(stats))
+        sys.exit(0)
+    if args.survey:
+        try:
+            iwdrofimenu.Survey(DEVICE).run()
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+    if args.prewarm:
+        sys.exit(0 if iwdrofimenu.prewarm(DEVICE) else 1)
+    if args.dmenu:
+        iwdrofimenu.DmenuFrontend(DEVICE, combi_mode=args.combi_mode).run()
+        sys.exit(0)
+    if args.roam:
+        try:
+            iwdrofimenu.RoamingAssistant(DEVICE).run()
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
     try:
         iwdrofimenu.Main(DEVICE, args)
     except IOError as error:
@@ -16,3 +16,13 @@
 # along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
 
 from .main import Main
+from .status import print_status
+from .watch import Watcher
+from .roaming import RoamingAssistant
+from .asynciwd import AsyncIWD
+from .dmenu import DmenuFrontend
+from .prewarm import prewarm
+from .survey import Survey, report, format_report
+from .backends import SubprocessBackend, RecordingBackend, ReplayBackend,\
+                      set_default_backend
+from .cache import set_default_directory
@@ -0,0 +1,77 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Find out if a network interface has an address traffic can flow with.
+
+iwd reports "connected" as soon as the link is up, but the address comes
+later (from iwd's own DHCP client or an external one). The addresses are
+read directly from the kernel, no program is run for it.
+"""
+import socket
+import struct
+import fcntl
+
+SIOCGIFADDR = 0x8915
+
+IF_INET6_PATH = "/proc/net/if_inet6"
+
+# scope and flags as found in /proc/net/if_inet6
+IPV6_SCOPE_LINK = 0x20
+IPV6_SCOPE_HOST = 0x10
+IFA_F_TENTATIVE = 0x40
+IFA_F_DADFAILED = 0x08
+
+
+def ipv4_address(ifname):
+    """Return the IPv4 address of the interface ifname or None"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            request = struct.pack("256s", ifname[:15].encode("utf-8"))
+            response = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, request)
+        except OSError:  # no address or no such interface
+            return None
+    return socket.inet_ntoa(response[20:24])
+
+
+def ipv6_address(ifname, path=IF_INET6_PATH):
+    """Return a usable IPv6 address of the interface ifname or None.
+
+    Link local addresses and addresses still checked for duplicates don't
+    count.
+    """
+    try:
+        with open(path, encoding="ascii") as file:
+            lines = file.readlines()
+    except OSError:  # IPv6 disabled
+        return None
+    for line in lines:
+        fields = line.split()
+        if len(fields) != 6 or fields[5] != ifname:
+            continue
+        scope = int(fields[3], 16)
+        flags = int(fields[4], 16)
+        if scope in (IPV6_SCOPE_LINK, IPV6_SCOPE_HOST) \
+                or flags & (IFA_F_TENTATIVE | IFA_F_DADFAILED):
+            continue
+        return socket.inet_ntop(socket.AF_INET6, bytes.fromhex(fields[0]))
+    return None
+
+
+def interface_address(ifname):
+    """Return an IPv4 or a usable IPv6 address of ifname or None"""
+    return ipv4_address(ifname) or ipv6_address(ifname)
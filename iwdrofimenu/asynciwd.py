@@ -0,0 +1,302 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+"""asyncio version of the iwctl wrapper.
+
+AsyncIWD runs iwctl with asyncio subprocesses, so it can be used inside an
+event loop without blocking it. It keeps no state between calls: every
+method returns an immutable Result holding the output and the parsed value,
+so concurrent calls don't interfere. The output is parsed by the same
+functions IWD uses.
+
+Cancelling a call (or reaching its timeout) kills the iwctl process.
+
+Example:
+========
+
+    iwd = AsyncIWD("wlan0")
+    await iwd.scan()
+    networks, known = await asyncio.gather(iwd.get_networks(),
+                                           iwd.update_known_networks())
+    for nw in networks.value:
+        print(nw["ssid"], nw["ssid"] in known.value)
+"""
+import os
+import asyncio
+import termios
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from .cache import RuntimeCache
+from .iwdwrapper import IWD, parse_table, parse_networks,\
+        parse_known_networks, needs_passphrase, freeze
+from .spawn import BASE_ENV, which
+
+
+@dataclass(frozen=True)
+class Result:
+    """Result of an AsyncIWD call.
+
+    Attributes:
+        returncode (int): Exit code of (the last) iwctl call
+        stdout (str): Its output
+        stderr (str): Its error output
+        value: The parsed result (read-only mappings and tuples instead of
+            dicts and lists), None on failure
+    """
+    returncode: int
+    stdout: str = ""
+    stderr: str = ""
+    value: object = None
+
+    @property
+    def success(self):
+        """True if iwctl finished without errors"""
+        return self.returncode == 0
+
+
+class AsyncIWD:
+    """Control iwd from asyncio code.
+
+    All methods are coroutines. timeout is in seconds, on timeout
+    asyncio.TimeoutError (TimeoutError) is raised, except for connect()
+    which returns ConnectionResult.TIMEOUT like IWD.connect().
+    """
+    def __init__(self, device="wlan0", timeout=5, cache=None):
+        """Constructor.
+
+        Args:
+            device (str): device as used in iwctl (default: "wlan0")
+            timeout (float): Default timeout for iwctl calls in seconds
+            cache (RuntimeCache): Its "mutation" lock serializes connect(),
+                disconnect() and forget() with the other processes
+                changing the state of iwd (default: a new RuntimeCache)
+        """
+        self.device = device
+        self.timeout = timeout
+        self.cache = RuntimeCache() if cache is None else cache
+
+    @asynccontextmanager
+    async def mutex(self):
+        """Hold the lock of IWD.mutex() without blocking the event loop"""
+        lock = self.cache.lock("mutation")
+        acquired = asyncio.get_running_loop().run_in_executor(
+                None, lock.__enter__)
+        try:
+            await asyncio.shield(acquired)
+        except BaseException:
+            # cancelled while waiting, release the lock once it's taken
+            acquired.add_done_callback(
+                    lambda future: future.exception() is None
+                    and lock.__exit__(None, None, None))
+            raise
+        try:
+            yield
+        finally:
+            lock.__exit__(None, None, None)
+
+    async def run(self, cmd, timeout=None, parse=None):
+        """Run cmd and return its Result.
+
+        Args:
+            cmd (list[str]): The command and its arguments
+            timeout (float): Timeout in seconds (default: self.timeout)
+            parse (callable): Called with the output to get the value of
+                the result (if the command succeeded)
+        """
+        proc = await asyncio.create_subprocess_exec(
+                which(cmd[0]) or cmd[0], *cmd[1:],
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                env=BASE_ENV)
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                    proc.communicate(),
+                    self.timeout if timeout is None else timeout)
+        except BaseException:  # timeout or cancelled
+            await self.kill(proc)
+            raise
+        stdout = stdout.decode("utf-8", "replace")
+        value = None
+        if proc.returncode == 0 and parse is not None:
+            value = freeze(parse(stdout))
+        return Result(proc.returncode, stdout,
+                      stderr.decode("utf-8", "replace"), value)
+
+    @staticmethod
+    async def kill(proc):
+        """Kill proc if it's still running and wait for it"""
+        if proc.returncode is None:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+
+    async def update_connection_state(self, timeout=None):
+        """Return the state of the station (value like IWD.state)"""
+        return await self.run(["iwctl", "station", self.device, "show"],
+                              timeout, parse_table)
+
+    async def get_networks(self, timeout=None):
+        """Return the available networks (value like IWD.get_networks())"""
+        return await self.run(["iwctl", "station", self.device,
+                               "get-networks"], timeout, parse_networks)
+
+    async def update_known_networks(self, timeout=None):
+        """Return the known networks (value like IWD.known_networks)"""
+        return await self.run(["iwctl", "known-networks", "list"],
+                              timeout, parse_known_networks)
+
+    async def scan(self, timeout=None):
+        """Start a scan.
+
+        A scan that is already in progress counts as success (value True).
+        """
+        result = await self.run(["iwctl", "station", self.device, "scan"],
+                                timeout)
+        in_progress = "already in progress" in result.stdout + result.stderr
+        return Result(result.returncode, result.stdout, result.stderr,
+                      result.success or in_progress)
+
+    async def disconnect(self, timeout=None):
+        """Disconnect from the current network (value True on success)"""
+        async with self.mutex():
+            result = await self.run(["iwctl", "station", self.device,
+                                     "disconnect"], timeout)
+        return Result(result.returncode, result.stdout, result.stderr,
+                      result.success)
+
+    async def forget(self, ssid, timeout=None):
+        """Forget a known network (value True on success)"""
+        async with self.mutex():
+            result = await self.run(["iwctl", "known-networks", ssid,
+                                     "forget"], timeout)
+        return Result(result.returncode, result.stdout, result.stderr,
+                      result.success)
+
+    async def connect(self, ssid, passphrase=None, timeout=None):
+        """Connect to a network, like IWD.connect().
+
+        Without passphrase the known and available networks are queried
+        (concurrently) to find out if one is needed. If that can't be told,
+        iwctl is run and NEED_PASSPHRASE is returned if it asks for one. A
+        passphrase is sent to the prompt of iwctl, not passed on its
+        command line.
+
+        Returns:
+            A Result with an IWD.ConnectionResult as value.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        cmd = ["iwctl", "station", self.device, "connect", ssid]
+        try:
+            if passphrase is None:
+                known, networks = await asyncio.gather(
+                        self.update_known_networks(timeout),
+                        self.get_networks(timeout))
+                if needs_passphrase(ssid, known.value or {}, networks.value):
+                    return Result(0,
+                                  value=IWD.ConnectionResult.NEED_PASSPHRASE)
+            async with self.mutex():
+                result = await self.probe(cmd, "Passphrase:", timeout,
+                                          passphrase)
+        except asyncio.TimeoutError:
+            return Result(-1, value=IWD.ConnectionResult.TIMEOUT)
+        if result is None:
+            if passphrase is None:
+                return Result(0, value=IWD.ConnectionResult.NEED_PASSPHRASE)
+            # asked again, the passphrase was not accepted
+            return Result(1, value=IWD.ConnectionResult.NOT_SUCCESSFUL)
+        return Result(result.returncode, result.stdout, result.stderr,
+                      IWD.ConnectionResult.SUCCESS if result.success
+                      else IWD.ConnectionResult.NOT_SUCCESSFUL)
+
+    async def probe(self, cmd, prompt, timeout, response=None):
+        """Run cmd in a pty until it finishes or shows prompt.
+
+        iwctl only asks for a passphrase on a terminal, so cmd gets a pty
+        (with echo turned off) as stdin, stdout and stderr. stdout of the
+        Result holds all output.
+
+        Args:
+            response (str): If given, it's sent once to the prompt and cmd
+                keeps running.
+
+        Returns:
+            The Result if cmd finished, None if it asked for input (again)
+            (it's killed then).
+
+        Raises:
+            asyncio.TimeoutError if none of it happened in time.
+        """
+        loop = asyncio.get_running_loop()
+        master, slave = os.openpty()
+        attrs = termios.tcgetattr(slave)
+        attrs[3] &= ~termios.ECHO
+        termios.tcsetattr(slave, termios.TCSANOW, attrs)
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                    which(cmd[0]) or cmd[0], *cmd[1:],
+                    stdin=slave, stdout=slave, stderr=slave,
+                    start_new_session=True, env=BASE_ENV)
+        except BaseException:
+            os.close(master)
+            raise
+        finally:
+            os.close(slave)
+
+        async def read():
+            readable = loop.create_future()
+            loop.add_reader(master, lambda: readable.done()
+                            or readable.set_result(None))
+            try:
+                await readable
+            finally:
+                loop.remove_reader(master)
+            try:
+                return os.read(master, 4096)
+            except OSError:  # EIO after the last writer closed the pty
+                return b""
+
+        async def read_until_prompt():
+            output = b""
+            while True:
+                chunk = await read()
+                if not chunk:
+                    return output, False
+                output += chunk
+                if prompt.encode("utf-8") in output:
+                    return output, True
+
+        try:
+            stdout, prompted = await asyncio.wait_for(read_until_prompt(),
+                                                      timeout)
+            if prompted and response is not None:
+                os.write(master, response.encode("utf-8") + b"\n")
+                more, prompted = await asyncio.wait_for(read_until_prompt(),
+                                                        timeout)
+                stdout += more
+            if prompted:
+                await self.kill(proc)
+                return None
+            await asyncio.wait_for(proc.wait(), timeout)
+        except BaseException:
+            await self.kill(proc)
+            raise
+        finally:
+            os.close(master)
+        return Result(proc.returncode, stdout.decode("utf-8", "replace"))
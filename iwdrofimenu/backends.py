@@ -0,0 +1,295 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Backends running the commands of IWD and rfkill.
+
+The SubprocessBackend runs the real programs. The RecordingBackend wraps
+another backend and writes every command with its result and timing to a
+fixture file (one JSON object per line), the ReplayBackend serves such a
+recording back without running anything, at the recorded speed or faster.
+
+Example:
+========
+
+    backend = RecordingBackend(SubprocessBackend(), "slow-menu.jsonl")
+    iwd = IWD("wlan0", backend=backend)
+    ...
+    iwd = IWD("wlan0", backend=ReplayBackend("slow-menu.jsonl", speed=0))
+"""
+import json
+import time
+import logging
+import subprocess
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+import pexpect
+from .spawn import spawn, spawn_many
+
+
+class Backend(ABC):
+    """Interface of the backends."""
+
+    @abstractmethod
+    def run(self, cmd, timeout=5, env=None):
+        """Run a non-interactive command.
+
+        Args:
+            cmd (list[str]): The command and its arguments
+            timeout (float): Timeout in seconds
+            env (dict): Environment for the command (default: inherited)
+
+        Returns:
+            (subprocess.CompletedProcess) The result with text output.
+
+        Raises:
+            subprocess.TimeoutExpired if the timeout was reached.
+        """
+
+    def run_many(self, cmds, timeout=5):
+        """Run several non-interactive commands.
+
+        Backends that can, run them at the same time. By default they are
+        run one after the other with run().
+
+        Returns:
+            (list[subprocess.CompletedProcess]) The results in the order of
+            cmds. A command that timed out gets a failed result (return
+            code -9), the results of the others are kept.
+        """
+        results = []
+        for cmd in cmds:
+            try:
+                results.append(self.run(cmd, timeout))
+            except subprocess.TimeoutExpired:
+                result = subprocess.CompletedProcess(cmd, -9, "", "timed out")
+                result.timed_out = True
+                results.append(result)
+        return results
+
+    @abstractmethod
+    def probe(self, cmd, prompt, timeout=5):
+        """Run an interactive command until it asks for input.
+
+        The command is killed if it shows the prompt.
+
+        Args:
+            cmd (list[str]): The command and its arguments
+            prompt (str): The prompt to wait for
+            timeout (float): Timeout in seconds
+
+        Returns:
+            A tuple (outcome, exitstatus). outcome is "prompt" if the prompt
+            showed up, "eof" if the command ended without it and "timeout"
+            if none of it happened in time. exitstatus is only set for "eof".
+        """
+
+    @abstractmethod
+    def respond(self, cmd, prompt, response, timeout=5):
+        """Run an interactive command and answer its prompt.
+
+        Unlike arguments, which every user can read from /proc, the
+        response is only written to the terminal of the command (e.g. a
+        passphrase). It's sent once, the command is killed if it asks
+        again.
+
+        Args:
+            cmd (list[str]): The command and its arguments
+            prompt (str): The prompt to answer
+            response (str): The line to send when the prompt shows up
+            timeout (float): Timeout in seconds for the whole command
+
+        Returns:
+            A tuple (outcome, exitstatus) like probe(). outcome is "eof" if
+            the command ended (with or without asking), "prompt" if it asked
+            again and "timeout" if it didn't end in time.
+        """
+
+
+class SubprocessBackend(Backend):
+    """Run the commands with spawn() and pexpect.
+
+    Note that the commands get a minimal environment (see the spawn
+    module), env only adds to it.
+    """
+
+    def run(self, cmd, timeout=5, env=None):
+        return spawn(cmd, timeout, env)
+
+    def run_many(self, cmds, timeout=5):
+        return spawn_many(cmds, timeout)
+
+    def probe(self, cmd, prompt, timeout=5):
+        proc = pexpect.spawn(cmd[0], cmd[1:])
+        i = proc.expect([prompt, pexpect.EOF, pexpect.TIMEOUT],
+                        timeout=timeout)
+        if i == 1:
+            proc.close()
+            return "eof", proc.exitstatus
+        proc.kill(0)
+        return ("prompt" if i == 0 else "timeout"), None
+
+    def respond(self, cmd, prompt, response, timeout=5):
+        deadline = time.monotonic() + timeout
+        proc = pexpect.spawn(cmd[0], cmd[1:])
+        patterns = [prompt, pexpect.EOF, pexpect.TIMEOUT]
+        i = proc.expect(patterns, timeout=timeout)
+        if i == 0:
+            proc.sendline(response)
+            i = proc.expect(patterns,
+                            timeout=max(deadline - time.monotonic(), 0))
+        if i == 1:
+            proc.close()
+            return "eof", proc.exitstatus
+        proc.terminate(force=True)
+        return ("prompt" if i == 0 else "timeout"), None
+
+
+def redact(cmd):
+    """Return cmd with the value of --passphrase replaced"""
+    cmd = list(cmd)
+    for i, arg in enumerate(cmd[:-1]):
+        if arg == "--passphrase":
+            cmd[i + 1] = "***"
+    return cmd
+
+
+class RecordingBackend(Backend):
+    """Record everything another backend does to a fixture file.
+
+    Passphrases are not written to the file.
+    """
+    def __init__(self, backend, path):
+        """Constructor.
+
+        Args:
+            backend (Backend): The backend actually running the commands
+            path (str): The file to append the recording to
+        """
+        self.backend = backend
+        self.path = path
+
+    def record(self, entry, started):
+        """Append an entry to the recording"""
+        entry["time"] = started
+        entry["duration"] = time.time() - started
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(entry) + "\n")
+
+    def run(self, cmd, timeout=5, env=None):
+        started = time.time()
+        entry = {"kind": "run", "cmd": redact(cmd)}
+        try:
+            result = self.backend.run(cmd, timeout, env)
+        except subprocess.TimeoutExpired:
+            entry["timeout"] = True
+            self.record(entry, started)
+            raise
+        entry.update(returncode=result.returncode,
+                     stdout=result.stdout,
+                     stderr=result.stderr)
+        self.record(entry, started)
+        return result
+
+    def probe(self, cmd, prompt, timeout=5):
+        started = time.time()
+        outcome, exitstatus = self.backend.probe(cmd, prompt, timeout)
+        self.record({"kind": "probe", "cmd": redact(cmd),
+                     "outcome": outcome, "exitstatus": exitstatus}, started)
+        return outcome, exitstatus
+
+    def respond(self, cmd, prompt, response, timeout=5):
+        started = time.time()
+        outcome, exitstatus = self.backend.respond(cmd, prompt, response,
+                                                   timeout)
+        # the response is not recorded, it's a passphrase
+        self.record({"kind": "respond", "cmd": redact(cmd),
+                     "outcome": outcome, "exitstatus": exitstatus}, started)
+        return outcome, exitstatus
+
+
+class ReplayBackend(Backend):
+    """Serve a recording made with RecordingBackend.
+
+    The entries for a command are served in the recorded order, when they
+    are used up the last one is repeated. Commands that are not in the
+    recording fail with exit code 127.
+    """
+    def __init__(self, path, speed=1.0):
+        """Constructor.
+
+        Args:
+            path (str): The recording
+            speed (float): Speedup factor for the recorded durations. 0
+                answers immediately.
+        """
+        self.speed = speed
+        self.entries = defaultdict(deque)
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.entries[(entry["kind"],) + tuple(entry["cmd"])]\
+                        .append(entry)
+
+    def next_entry(self, kind, cmd):
+        """Return the next entry for cmd after waiting its duration"""
+        entries = self.entries.get((kind,) + tuple(redact(cmd)))
+        if not entries:
+            logging.warning("Not in recording: %s", " ".join(redact(cmd)))
+            return None
+        entry = entries.popleft() if len(entries) > 1 else entries[0]
+        if self.speed:
+            time.sleep(entry["duration"] / self.speed)
+        return entry
+
+    def run(self, cmd, timeout=5, env=None):
+        entry = self.next_entry("run", cmd)
+        if entry is None:
+            return subprocess.CompletedProcess(cmd, 127, "", "not recorded")
+        if entry.get("timeout"):
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        return subprocess.CompletedProcess(cmd,
+                                           entry["returncode"],
+                                           entry["stdout"],
+                                           entry["stderr"])
+
+    def probe(self, cmd, prompt, timeout=5):
+        entry = self.next_entry("probe", cmd)
+        if entry is None:
+            return "eof", 127
+        return entry["outcome"], entry["exitstatus"]
+
+    def respond(self, cmd, prompt, response, timeout=5):
+        entry = self.next_entry("respond", cmd)
+        if entry is None:
+            return "eof", 127
+        return entry["outcome"], entry["exitstatus"]
+
+
+_default_backend = SubprocessBackend()
+
+
+def default_backend():
+    """Return the backend used if none is given explicitly"""
+    return _default_backend
+
+
+def set_default_backend(backend):
+    """Set the backend used if none is given explicitly (e.g. to record or
+    replay a whole session)"""
+    global _default_backend
+    _default_backend = backend
@@ -0,0 +1,219 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Share the results of queries between invocations.
+
+Every invocation of the script (by rofi, a status bar widget, ...) is a new
+process. To avoid running the same iwctl or rfkill query over and over again
+the raw results are stored in the runtime directory and can be reused as long
+as they are fresh enough.
+
+Lock files in the same directory make sure the same query is not run by
+several processes at once. A process that finds a query already running
+waits for it and takes its result.
+"""
+import os
+import re
+import json
+import stat
+import time
+import fcntl
+import hashlib
+import subprocess
+from contextlib import contextmanager
+from settings import RUNTIME_DIR, CACHE_TTL
+
+
+class RuntimeCache:
+    """Store the results of commands in the runtime directory.
+
+    Each command gets its own file holding the time it was run, the exit code
+    and the output. Files are replaced atomically, so readers always see a
+    complete entry.
+
+    Example:
+    ========
+
+        cache = RuntimeCache()
+        result = cache.run(["iwctl", "station", "wlan0", "show"],
+                           subprocess.run, max_age=10)
+    """
+    def __init__(self, directory=None, ttl=CACHE_TTL):
+        """Constructor.
+
+        Args:
+            directory (str): Where to store the entries (default: the
+                default directory). It's created with mode 0700 if it does
+                not exist.
+            ttl (float): Default for max_age in seconds.
+
+        Raises:
+            IOError if the directory is not a directory owned by the user
+            with mode 0700 (e.g. another user created it in /tmp first).
+        """
+        self.directory = directory or _default_directory
+        self.ttl = ttl
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        # the results are trusted, nobody else may be able to change them
+        info = os.lstat(self.directory)
+        if (not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid()
+                or stat.S_IMODE(info.st_mode) != 0o700):
+            raise IOError(f"Refusing to use {self.directory} as runtime "
+                          "directory, it has to be a directory owned by you "
+                          "with mode 0700.")
+
+    def path(self, key):
+        """Return the filepath of the entry for key.
+
+        The name starts with the key made readable, a hash of the key
+        keeps apart keys that only differ in other characters (e.g. the
+        SSIDs "My Net" and "My!Net").
+
+        Args:
+            key (str | list[str]): A string or a command as passed to
+                subprocess.run()
+        """
+        if not isinstance(key, str):
+            key = " ".join(key)
+        readable = re.sub(r'[^A-Za-z0-9.-]+', '_', key)[:64]
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        return f"{self.directory}/{readable}-{digest}.json"
+
+    def load(self, key):
+        """Return the data stored for key or None if there is nothing."""
+        try:
+            with open(self.path(key), encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, key, data):
+        """Store data (anything JSON serializable) for key."""
+        path = self.path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+        os.replace(tmp_path, path)
+
+    def get(self, key, max_age=None):
+        """Return the entry for key if it is not older than max_age.
+
+        Args:
+            key (str | list[str]): Key of the entry.
+            max_age (float): Maximum age in seconds (default: ttl)
+
+        Returns:
+            A dictionary with the entries "time", "returncode", "stdout" and
+            "stderr" or None if there is no fresh entry.
+        """
+        if max_age is None:
+            max_age = self.ttl
+        entry = self.load(key)
+        if entry is None or time.time() - entry.get("time", 0) > max_age:
+            return None
+        return entry
+
+    def store(self, key, result, timestamp=None):
+        """Store the result of a command.
+
+        Args:
+            key (str | list[str]): Key of the entry.
+            result (subprocess.CompletedProcess): The result to store.
+            timestamp (float): Time the command was run (default: now)
+        """
+        self.save(key, {"time": time.time() if timestamp is None
+                        else timestamp,
+                        "returncode": result.returncode,
+                        "stdout": result.stdout,
+                        "stderr": result.stderr})
+
+    def invalidate(self, *keys):
+        """Remove the entries for keys, so they are queried again."""
+        for key in keys:
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def lock(self, key):
+        """Hold an exclusive lock for key while in the with block.
+
+        Example:
+        ========
+
+            with cache.lock("mutation"):
+                ...  # no other process is in a block locking "mutation"
+        """
+        with open(self.path(key)[:-len(".json")] + ".lock", "w",
+                  encoding="utf-8") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def run(self, cmd, run, max_age=None):
+        """Return the result of cmd from the cache or by calling run(cmd).
+
+        If another process is running cmd at the moment, wait for it to finish
+        and return its result instead of running cmd a second time.
+
+        Args:
+            cmd (list[str]): The command, also used as key.
+            run (callable): Called with cmd if no fresh entry is found. It
+                has to return a subprocess.CompletedProcess (with text
+                output), that is stored afterwards.
+            max_age (float): Maximum age in seconds of an entry to be used
+                (default: ttl). If it is 0, only the result of a run that
+                finished while waiting for the lock is used.
+
+        Returns:
+            (subprocess.CompletedProcess) The cached or new result.
+        """
+        if max_age is None:
+            max_age = self.ttl
+        started = time.time()
+        entry = self.get(cmd, max_age) if max_age != 0 else None
+        if entry is None:
+            with self.lock(cmd):
+                # a result finished while waiting for the lock is as good
+                # as running cmd now
+                entry = self.get(cmd, max(max_age, time.time() - started))
+                if entry is None:
+                    result = run(cmd)
+                    self.store(cmd, result)
+                    return result
+        return subprocess.CompletedProcess(cmd,
+                                           entry["returncode"],
+                                           entry["stdout"],
+                                           entry["stderr"])
+
+
+_default_directory = RUNTIME_DIR
+
+
+def default_directory():
+    """Return the directory used if none is given explicitly"""
+    return _default_directory
+
+
+def set_default_directory(directory):
+    """Set the directory used if none is given explicitly (e.g. to keep
+    the results of a recorded or replayed session apart)"""
+    global _default_directory
+    _default_directory = directory
@@ -0,0 +1,278 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Frontend for rofi's dmenu mode, showing entries as soon as they are known.
+
+In script mode rofi waits until the script has finished, so the menu only
+shows up after all queries are done. In dmenu mode with -async-pre-read 0
+rofi shows every entry as it arrives. The network list is streamed: the
+static entries come first, then the networks from the cache, then the
+networks found by a fresh query.
+
+Selecting an entry runs the script like rofi would in script mode (with
+ROFI_INFO, ROFI_DATA and ROFI_RETV set) and shows the dialog it prints in
+dmenu mode again, so all actions are handled by Main.
+"""
+import os
+import sys
+import shlex
+import logging
+import subprocess
+from settings import DMENU_CMD, CACHE_TTL, TEMPLATES, ICONS
+from .iwd_rofi_dialogs import RofiNetworkList
+from .iwdwrapper import IWD, PARSERS, query_commands
+from .cache import RuntimeCache
+from .scheduler import ScanScheduler
+from . import rfkill
+
+
+class StreamingNetworkList(RofiNetworkList):
+    """The rows of the network list, written to a stream as they are added.
+
+    Unlike the RofiNetworkList it's built step by step, so the entries
+    that don't need any query can be shown before iwd is asked anything.
+    Active and known networks are not marked, since rofi needs the indices
+    of those before the first entry.
+    """
+    def __init__(self, stream, infos, combi_mode=False):
+        """Constructor.
+
+        Args:
+            stream (file): Where to write the rows (stdin of the launcher)
+            infos (list): The info of every row is appended to it
+            combi_mode (bool): Show only known networks
+        """
+        # no options can be passed in dmenu mode, so the constructor of
+        # RofiDialog is not called
+        self.stream = stream
+        self.snapshot = None
+        self.combi_mode = combi_mode
+        self.prepare_templates()
+        self.infos = infos
+        self.shown = set()
+        """The SSIDs of the networks already written"""
+
+    def out(self, entry, *args, **kwargs):
+        self.stream.write(entry)
+        self.stream.flush()
+
+    def add_row_dict(self, text, options):
+        self.infos.append(options.get("info"))
+        super().add_row_dict(text, options)
+
+    def add_networks(self, networks):
+        """Add the networks that are not shown yet"""
+        for nw in networks or []:
+            if nw["ssid"] in self.shown:
+                continue
+            if self.combi_mode \
+                    and nw["ssid"] not in self.snapshot.known_networks:
+                continue
+            self.shown.add(nw["ssid"])
+            self.add_network_to_dialog(nw)
+
+
+def parse_payload(payload):
+    """Split the output of the script in rofi's script mode syntax.
+
+    Returns:
+        A tuple (options, rows). options is a dictionary of the global
+        options (prompt, message, data, ...), rows is a list of tuples
+        (line, info) with the lines to pass to the launcher unchanged and
+        the info of the entry (or None).
+    """
+    options = {}
+    rows = []
+    for line in payload.split("\n"):
+        if not line:
+            continue
+        if line.startswith("\0"):
+            name, _, value = line[1:].partition("\x1f")
+            options[name] = value
+            continue
+        info = None
+        _, _, row_options = line.partition("\0")
+        fields = row_options.split("\x1f")
+        for name, value in zip(fields[::2], fields[1::2]):
+            if name == "info":
+                info = value
+        rows.append((line, info))
+    return options, rows
+
+
+class DmenuFrontend:
+    """Drive a dmenu-style launcher.
+
+    Example:
+    ========
+
+        DmenuFrontend("wlan0", script="/usr/bin/iwdrofimenu").run()
+    """
+    def __init__(self, device="wlan0", script=None, combi_mode=False,
+                 launcher=DMENU_CMD):
+        """Constructor.
+
+        Args:
+            device (str): device as used in iwctl
+            script (str): The iwdrofimenu script handling the selections
+                (default: the running script)
+            combi_mode (bool): Run the script in combi mode
+            launcher (str): The launcher command line
+        """
+        self.device = device
+        self.script = script or os.path.abspath(sys.argv[0])
+        self.combi_mode = combi_mode
+        self.launcher = shlex.split(launcher) + ["-format", "i s"]
+
+    def start_launcher(self, options=None):
+        """Start the launcher with the options of a dialog"""
+        options = options or {}
+        cmd = list(self.launcher)
+        cmd += ["-p", options.get("prompt", TEMPLATES["prompt_ssid"])]
+        if options.get("message"):
+            cmd += ["-mesg", options["message"]]
+        for name, flag in (("active", "-a"), ("urgent", "-u")):
+            if options.get(name):
+                cmd += [flag, options[name]]
+        if options.get("no-custom") == "true":
+            cmd.append("-no-custom")
+        elif options.get("no-custom") == "false":
+            # only the passphrase dialog asks for input
+            cmd.append("-password")
+        return subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, text=True)
+
+    def stream_network_list(self, stream, infos):
+        """Write the network list to stream, as fast as possible.
+
+        Args:
+            stream (file): Where to write the entries
+            infos (list): The info of every entry is appended to it
+        """
+        rows = StreamingNetworkList(stream, infos, self.combi_mode)
+        if not self.combi_mode:
+            rows.add_menu_items()
+        rows.add_disable_item()
+        rows.add_separator()
+
+        cache = RuntimeCache()
+        # whatever is in the cache, no matter how old, is shown before iwd
+        # or rfkill are asked anything
+        stale = {}
+        for name, parse in PARSERS.items():
+            entry = cache.get(query_commands(self.device)[name],
+                              max_age=float("inf"))
+            if entry is not None and entry["returncode"] == 0:
+                stale[name] = parse(entry["stdout"])
+        iwd = IWD(self.device, cache=cache, max_age=CACHE_TTL, memo=stale)
+        if all(name in stale
+               for name in ("state", "known_networks", "networks")):
+            rows.snapshot = iwd.snapshot(("state", "known_networks"))
+            rows.add_networks(stale["networks"])
+
+        # from here on only fresh enough results
+        iwd.clear_memo()
+        iwd.snapshot(("state", "device_info", "known_networks"))
+        adapter = iwd.adapter()
+        if adapter is not None \
+                and rfkill.is_blocked(adapter, cache, CACHE_TTL):
+            rows.add_row(TEMPLATES["enable_wifi"],
+                         icon=ICONS["enable"],
+                         info="cmd#unblockwifi",
+                         meta=TEMPLATES["meta_enable"])
+            return
+        rows.snapshot = iwd.snapshot(("state", "known_networks"))
+
+        scheduler = ScanScheduler(iwd, cache)
+        scheduler.request()
+        rows.add_networks(iwd.get_networks(max_age=0))
+        scheduler.observe(iwd.networks)
+
+    def select(self, launcher, feed):
+        """Feed the launcher and wait for the selection.
+
+        Args:
+            launcher (subprocess.Popen): The launcher process
+            feed (callable): Called with the stdin of the launcher and a list,
+                writes the entries and appends their infos to the list
+
+        Returns:
+            A tuple (returncode, index, text, infos)
+        """
+        infos = []
+        try:
+            feed(launcher.stdin, infos)
+            launcher.stdin.close()
+        except BrokenPipeError:
+            pass  # an entry was selected before all of them were written
+        output = launcher.stdout.read()
+        returncode = launcher.wait()
+        index, _, text = output.rstrip("\n").partition(" ")
+        try:
+            index = int(index)
+        except ValueError:
+            index = -1
+        return returncode, index, text, infos
+
+    def run_script(self, info=None, data=None, retv=1, arg=""):
+        """Run the script like rofi does in script mode.
+
+        Returns:
+            (str) The output of the script.
+        """
+        env = dict(os.environ, ROFI_RETV=str(retv))
+        env.pop("ROFI_INFO", None)
+        env.pop("ROFI_DATA", None)
+        if info is not None:
+            env["ROFI_INFO"] = info
+        if data:
+            env["ROFI_DATA"] = data
+        cmd = [sys.executable, self.script]
+        if self.combi_mode:
+            cmd.append("--combi-mode")
+        if arg:
+            cmd.append(arg)
+        result = subprocess.run(cmd, env=env, capture_output=True,
+                                text=True, check=False)
+        return result.stdout
+
+    def run(self):
+        """Show the menu until the user closes it."""
+        launcher = self.start_launcher()
+        returncode, index, text, infos = self.select(
+                launcher, self.stream_network_list)
+        options = {}
+        while returncode == 0 or returncode >= 10:
+            info = infos[index] if 0 <= index < len(infos) else None
+            retv = returncode if returncode >= 10 else 1
+            arg = ""
+            if index < 0:  # custom input
+                retv = 2
+                arg = text
+            logging.info("Selected %d (%s), RETV %d", index, info, retv)
+            payload = self.run_script(info, options.get("data"), retv, arg)
+            options, rows = parse_payload(payload)
+            if not rows:
+                return
+
+            def feed(stream, infos, rows=rows):
+                for line, info in rows:
+                    infos.append(info)
+                    stream.write(line + "\n")
+
+            launcher = self.start_launcher(options)
+            returncode, index, text, infos = self.select(launcher, feed)
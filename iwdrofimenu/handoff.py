@@ -0,0 +1,134 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Hand the query results of one invocation over to the next one.
+
+rofi starts the script again for every selection and only passes ROFI_INFO
+and ROFI_DATA back. When a dialog is shown, the parsed query results it was
+built from are written to a snapshot in the runtime directory, and a short
+token pointing to it is put in front of the dialog's data:
+
+    state1:<snapshot id>:<checksum>;cmd#iwd#connectSSID
+
+The next invocation strips the token from ROFI_DATA and, if the snapshot is
+still there, unchanged and fresh enough, starts with its results instead of
+querying iwd again. Otherwise everything is queried as usual.
+"""
+import re
+import json
+import time
+import zlib
+import logging
+import secrets
+from settings import CACHE_TTL
+
+TOKEN_VERSION = "state1"
+TOKEN_REGEX = re.compile(r"^state1:(?P<id>[0-9a-f]+):(?P<crc>[0-9a-f]{8});")
+
+
+def checksum(memo):
+    """Return the checksum of the parsed results memo as hex string"""
+    content = json.dumps(memo, sort_keys=True).encode("utf-8")
+    return f"{zlib.crc32(content):08x}"
+
+
+def snapshot_key(device):
+    """Return the cache key of the snapshot for device.
+
+    There is only one snapshot per device, so tokens of older dialogs just
+    become invalid.
+    """
+    return f"handoff-{device}"
+
+
+def split_token(data):
+    """Split a token from the beginning of data.
+
+    Args:
+        data (str): The content of ROFI_DATA (or None)
+
+    Returns:
+        A tuple (match, data), match is the re.Match of the token or None
+        if there is no token, data is the rest.
+    """
+    if not data:
+        return None, data
+    match = TOKEN_REGEX.match(data)
+    if match is None:
+        return None, data
+    return match, data[match.end():]
+
+
+def save(cache, device, memo):
+    """Write a snapshot of memo and return the token pointing to it.
+
+    Args:
+        cache (RuntimeCache): Where to store the snapshot
+        device (str): The device the results belong to
+        memo (dict): Parsed query results by query name (see IWD.memo)
+
+    Returns:
+        (str) The token to put in front of the dialog's data.
+    """
+    memo = {name: value for name, value in memo.items() if value is not None}
+    snapshot_id = secrets.token_hex(4)
+    crc = checksum(memo)
+    cache.save(snapshot_key(device), {"version": TOKEN_VERSION,
+                                      "id": snapshot_id,
+                                      "device": device,
+                                      "time": time.time(),
+                                      "crc": crc,
+                                      "memo": memo})
+    return f"{TOKEN_VERSION}:{snapshot_id}:{crc};"
+
+
+def discard(cache, device):
+    """Remove the snapshot of device, so no token points to it anymore
+    (e.g. if it turned out to be wrong)."""
+    cache.invalidate(snapshot_key(device))
+
+
+def restore(cache, device, match, max_age=CACHE_TTL):
+    """Return the results of the snapshot a token points to.
+
+    Args:
+        cache (RuntimeCache): Where the snapshot is stored
+        device (str): The device the results have to belong to
+        match (re.Match): The token as returned by split_token()
+        max_age (float): Maximum age of the snapshot in seconds
+
+    Returns:
+        (dict) The parsed query results by query name or None if the
+        snapshot is gone, outdated or doesn't match the token.
+    """
+    snapshot = cache.load(snapshot_key(device))
+    if snapshot is None:
+        reason = "no snapshot"
+    elif snapshot.get("id") != match.group("id")\
+            or snapshot.get("version") != TOKEN_VERSION:
+        reason = "replaced by a newer snapshot"
+    elif snapshot.get("device") != device:
+        reason = "other device"
+    elif time.time() - snapshot.get("time", 0) > max_age:
+        reason = "too old"
+    elif checksum(snapshot.get("memo")) != match.group("crc"):
+        reason = "checksum mismatch"
+    else:
+        logging.debug("Using snapshot %s", match.group("id"))
+        return snapshot["memo"]
+    logging.debug("Snapshot %s not usable (%s)", match.group("id"), reason)
+    return None
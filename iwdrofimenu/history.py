@@ -0,0 +1,145 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Remember how connecting to each network went.
+
+For every network the durations of the last successful connection attempts
+and the number of successes and failures are kept in a JSON file. From the
+durations a timeout is derived and stored with them whenever an attempt is
+recorded, so looking it up is just a dictionary access.
+"""
+import os
+import json
+import time
+import fcntl
+import logging
+from settings import HISTORY_FILE, HISTORY_SIZE, CONNECT_TIMEOUT,\
+        CONNECT_TIMEOUT_MIN, CONNECT_TIMEOUT_MAX, CONNECT_TIMEOUT_MARGIN
+from .iwdwrapper import IWD
+
+
+def percentile(values, fraction):
+    """Return the value below which fraction (0-1) of values lie"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class ConnectHistory:
+    """Connection history of all networks.
+
+    Example:
+    ========
+
+        history = ConnectHistory()
+        timeout = history.timeout("HomeNet")
+        started = time.monotonic()
+        result = iwd.connect("HomeNet", timeout=timeout)
+        history.record("HomeNet", time.monotonic() - started, result)
+    """
+    def __init__(self, path=HISTORY_FILE, size=HISTORY_SIZE,
+                 default=CONNECT_TIMEOUT, minimum=CONNECT_TIMEOUT_MIN,
+                 maximum=CONNECT_TIMEOUT_MAX, margin=CONNECT_TIMEOUT_MARGIN):
+        """Constructor. Load the history from path.
+
+        Args:
+            path (str): The JSON file holding the history
+            size (int): Number of durations kept per network
+            default (float): Timeout for networks without history
+            minimum (float): Lower limit for the timeouts
+            maximum (float): Upper limit for the timeouts
+            margin (float): Factor applied to the 95th percentile
+        """
+        self.path = os.path.expanduser(path)
+        self.size = size
+        self.default = default
+        self.minimum = minimum
+        self.maximum = maximum
+        self.margin = margin
+        self.networks = self.load()
+
+    def load(self):
+        """Return the history as stored in the file"""
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def timeout(self, ssid):
+        """Return the timeout in seconds for connecting to ssid"""
+        entry = self.networks.get(ssid)
+        return self.default if entry is None else entry["timeout"]
+
+    def known_good(self, ssid):
+        """Check if the last connection attempt to ssid was successful"""
+        entry = self.networks.get(ssid)
+        return entry is not None and entry["last_success"]
+
+    def derive_timeout(self, entry, timed_out):
+        """Return the timeout for a history entry.
+
+        After a timeout the last timeout is doubled, as the durations of
+        successful attempts obviously weren't enough.
+        """
+        if timed_out:
+            timeout = entry.get("timeout", self.default) * 2
+        elif entry["durations"]:
+            timeout = percentile(entry["durations"], 0.95) * self.margin
+        else:
+            timeout = self.default
+        return min(self.maximum, max(self.minimum, timeout))
+
+    def record(self, ssid, duration, result):
+        """Record a connection attempt and write the history.
+
+        Attempts ending with NEED_PASSPHRASE are not recorded, there wasn't
+        really an attempt.
+
+        Args:
+            ssid (str): The network
+            duration (float): Duration of the attempt in seconds
+            result (IWD.ConnectionResult): Result of the attempt
+        """
+        if result == IWD.ConnectionResult.NEED_PASSPHRASE:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "w", encoding="utf-8") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # other processes might have changed it meanwhile
+            self.networks = self.load()
+            entry = self.networks.setdefault(
+                    ssid, {"durations": [], "successes": 0, "failures": 0})
+            # connecting worked, even if it wasn't usable in time
+            success = result in (IWD.ConnectionResult.SUCCESS,
+                                 IWD.ConnectionResult.NO_ADDRESS,
+                                 IWD.ConnectionResult.NOT_USABLE)
+            if success:
+                entry["durations"] = (entry["durations"]
+                                      + [round(duration, 3)])[-self.size:]
+                entry["successes"] += 1
+            else:
+                entry["failures"] += 1
+            entry["last_success"] = success
+            entry["last_attempt"] = time.time()
+            entry["timeout"] = self.derive_timeout(
+                    entry, result == IWD.ConnectionResult.TIMEOUT)
+            logging.info("Connecting to %s: %s after %.2fs, timeout now %.1fs",
+                         ssid, result.name, duration, entry["timeout"])
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(self.networks, file)
+            os.replace(tmp_path, self.path)
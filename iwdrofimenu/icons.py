@@ -0,0 +1,159 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Prepare the icons used in the dialogs.
+
+Depending on the icon_mode setting the ICONS dictionary is left as it is
+(PNG files from img_dir), pointed to PNG files rendered from the SVG sources
+in the size rofi actually displays them, or replaced by icon theme names.
+"""
+import os
+import json
+import hashlib
+import logging
+import subprocess
+from settings import ICONS, ICON_MODE, ICON_SIZE, ICON_VARIANT, ICON_COLOR,\
+        ICON_CACHE_DIR, ICON_NAMES, SVG_DIR, SVG_RENDER_CMD
+
+# colors of the shipped icon variants
+VARIANT_COLORS = {"dark": "#000000", "bright": "#ffffff"}
+
+# icons whose SVG source is named differently than the PNG file
+SVG_NAMES = {"confirm.png": "checkmark"}
+
+# written after all icons of a cache directory were rendered successfully
+STAMP_FILE = ".complete"
+
+# written if rendering failed, holding the digest of the render settings
+FAILED_FILE = ".failed"
+
+
+def svg_name(png_filename):
+    """Return the name of the SVG source (without extension) of a PNG icon."""
+    filename = os.path.basename(png_filename)
+    if filename in SVG_NAMES:
+        return SVG_NAMES[filename]
+    return os.path.splitext(filename)[0]
+
+
+def icon_cache_dir(variant=ICON_VARIANT, size=ICON_SIZE, color=ICON_COLOR):
+    """Return the directory holding the icons rendered for variant and size.
+
+    A custom color replaces the variant in the directory name.
+    """
+    theme = color.lstrip("#") if color else (variant or "default")
+    return f"{ICON_CACHE_DIR}/{theme}-{size}"
+
+
+def render_digest(size, color):
+    """Return a hash of everything rendering the icons depends on"""
+    return hashlib.sha1(json.dumps([SVG_RENDER_CMD, SVG_DIR, size, color])
+                        .encode("utf-8")).hexdigest()
+
+
+def render_svg(source, target, size, color):
+    """Render a single SVG file to a PNG file of size x size pixels.
+
+    The SVG sources don't specify a fill color, so it's set on the root
+    element before passing the file to the renderer.
+
+    Returns:
+        True on success, False otherwise.
+    """
+    with open(source, encoding="utf-8") as file:
+        svg = file.read().replace("<svg ", f"<svg fill=\"{color}\" ", 1)
+    try:
+        result = subprocess.run([SVG_RENDER_CMD,
+                                 "-w", str(size), "-h", str(size),
+                                 "-f", "png",
+                                 "-o", target],
+                                input=svg.encode("utf-8"),
+                                capture_output=True,
+                                check=False)
+    except OSError as error:
+        logging.warning("Could not run %s: %s", SVG_RENDER_CMD, error)
+        return False
+    if result.returncode != 0:
+        logging.warning("Could not render %s: %s", source,
+                        result.stderr.decode(errors="replace"))
+        return False
+    return True
+
+
+def render_icons(icons, directory, size, color):
+    """Render all icons in icons (a dict key -> PNG path) to directory.
+
+    Every SVG is rendered only once, even if it is used by several keys.
+
+    Returns:
+        A dictionary key -> path of the rendered file or None if something
+        went wrong.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rendered = {}
+    for key, path in icons.items():
+        name = svg_name(path)
+        target = f"{directory}/{name}.png"
+        if not os.path.exists(target):
+            if not render_svg(f"{SVG_DIR}/{name}.svg", target + ".tmp",
+                              size, color):
+                return None
+            os.replace(target + ".tmp", target)
+        rendered[key] = target
+    with open(f"{directory}/{STAMP_FILE}", "w", encoding="utf-8"):
+        pass
+    return rendered
+
+
+def prepare_icons(icons=ICONS, mode=ICON_MODE):
+    """Update icons (the ICONS dictionary from settings) in place.
+
+    In "svg" mode the icons are rendered once to the cache directory, keyed by
+    variant and size. Later calls only check for the stamp file in that
+    directory, so nothing needs to be decoded or scaled while rofi is waiting.
+    If rendering fails the PNG files are used, and rendering isn't tried
+    again before the render settings change.
+    """
+    if mode == "theme":
+        icons.update({key: ICON_NAMES.get(key, svg_name(path))
+                      for key, path in icons.items()})
+        return
+    if mode != "svg":
+        return
+
+    directory = icon_cache_dir()
+    if os.path.exists(f"{directory}/{STAMP_FILE}"):
+        icons.update({key: f"{directory}/{svg_name(path)}.png"
+                      for key, path in icons.items()})
+        return
+
+    color = ICON_COLOR or VARIANT_COLORS.get(ICON_VARIANT, "#000000")
+    digest = render_digest(ICON_SIZE, color)
+    try:
+        with open(f"{directory}/{FAILED_FILE}", encoding="utf-8") as file:
+            if file.read() == digest:
+                return
+    except OSError:
+        pass
+    logging.info("Rendering icons to %s", directory)
+    rendered = render_icons(icons, directory, ICON_SIZE, color)
+    if rendered is not None:
+        icons.update(rendered)
+        return
+    logging.warning("Using the PNG icons until the render settings change")
+    with open(f"{directory}/{FAILED_FILE}", "w", encoding="utf-8") as file:
+        file.write(digest)
@@ -22,6 +22,14 @@ from settings import ICONS, TEMPLATES, SIGNAL_QUALITY_TEXT,\
 from .rofidialog import RofiDialog, RofiSimpleDialog
 
 
+def signal_icon(nw):
+    """Return the icon showing the signal quality and security of a network
+    in range (as returned by IWD.get_networks())"""
+    if nw["security"] != "open":
+        return ICONS[f"wifi-encrypted-signal-{nw['quality']}"]
+    return ICONS[f"wifi-signal-{nw['quality']}"]
+
+
 class RofiBasicDialog(RofiDialog):
     """Baseclass for the dialogs used.
 
@@ -61,7 +69,7 @@ class RofiPasswordInput(RofiSimpleDialog):
 
     Add a cancel "button" and message. Set no_custom to false.
     """
-    def __init__(self, ssid, prompt="Passphrase", message=None):
+    def __init__(self, ssid, prompt="Passphrase", message=None, data=None):
         entries = [{"caption": TEMPLATES["cancel"],
                     "info": "cmd#abort",
                     "icon": ICONS["back"]
@@ -71,7 +79,7 @@ class RofiPasswordInput(RofiSimpleDialog):
         super().__init__(prompt,
                          message=message,
                          entries=entries,
-                         data=f"cmd#iwd#connect{ssid}",
+                         data=data or f"cmd#iwd#connect{ssid}",
                          no_custom="false"
                          )
 
@@ -119,15 +127,18 @@ class RofiNoWifiDialog(RofiBasicDialog):
 class RofiIWDDialog(RofiBasicDialog):
     """Another baseclass-like class for future cases.
 
-    Just add an iwd property to hold an IWD object (the iwctl wrapper).
+    Just add a snapshot property holding the information about the device
+    the dialog is built from (see IWD.snapshot()). The dialogs don't query
+    anything themselves.
     """
-    def __init__(self, prompt, iwd, message=None, data=None, theme_snippet=""):
+    def __init__(self, prompt, snapshot, message=None, data=None,
+                 theme_snippet=""):
         super().__init__(prompt,
                          message=message,
                          data=data,
                          theme_snippet=theme_snippet
                          )
-        self.iwd = iwd
+        self.snapshot = snapshot
 
 
 class RofiShowActiveConnection(RofiIWDDialog):
@@ -138,16 +149,14 @@ class RofiShowActiveConnection(RofiIWDDialog):
     """
     row_template = Template(TEMPLATES["connection-details-entry"])
 
-    def __init__(self, iwd, message="", data=None):
+    def __init__(self, snapshot, message="", data=None):
         super().__init__(TEMPLATES["prompt_ssid"],
-                         iwd,
+                         snapshot,
                          message=message,
                          theme_snippet="",
                          data=data
                          )
 
-        self.iwd.update_connection_state()
-
         # add menu items
         self.add_row(TEMPLATES["back"],
                      icon=ICONS["back"]
@@ -159,7 +168,7 @@ class RofiShowActiveConnection(RofiIWDDialog):
         self.add_separator()
 
         # add connection infos
-        for name, value in self.iwd.state.items():
+        for name, value in (self.snapshot.state or {}).items():
             self.add_row(
                     self.row_template.substitute(
                         property=name,
@@ -190,51 +199,40 @@ class RofiNetworkList(RofiIWDDialog):
     """
     row_template = Template(TEMPLATES["network_list_entry"])
 
-    def __init__(self, iwd, message=None, data=None, combi_mode=False):
+    def __init__(self, snapshot, message=None, data=None, combi_mode=False,
+                 preferred=None):
+        """Initialize the dialog.
+
+        Args:
+            snapshot (Snapshot): Needs the state, known_networks and networks
+                sections
+            preferred (set[str]): SSIDs of networks shown first in combi
+                mode
+        """
         super().__init__(TEMPLATES["prompt_ssid"],
-                         iwd,
+                         snapshot,
                          message=message,
                          data=data)
         self.combi_mode = combi_mode
-
-        # if "network_list_entry_active" is not empty prepare template
-        active_entry_template = TEMPLATES["network_list_entry_active"]
-        self.row_template_active = self.row_template
-        if active_entry_template:
-            self.row_template_active = Template(active_entry_template)
-
-        # if "network_list_entry_known" is not empty prepare template
-        known_entry_template = TEMPLATES["network_list_entry_known"]
-        self.row_template_known = self.row_template
-        if known_entry_template:
-            self.row_template_known = Template(known_entry_template)
-
-        self.iwd.update_known_networks()
+        self.prepare_templates()
 
         # add menu items
         if not self.combi_mode:
-            self.add_row(TEMPLATES["scan"],
-                         info="cmd#iwd#scan",
-                         icon=ICONS["scan"],
-                         meta=TEMPLATES["meta_scan"]
-                         )
-            self.add_row(TEMPLATES["refresh"],
-                         info="cmd#refresh",
-                         icon=ICONS["refresh"],
-                         meta=TEMPLATES["meta_refresh"]
-                         )
+            self.add_menu_items()
             self.add_separator()
 
         # add wifi networks
         # if in combi-mode only add known networks
         if self.combi_mode:
-            self.networks = [nw for nw in self.iwd.get_networks()
-                             if nw["ssid"] in self.iwd.known_networks
+            self.networks = [nw for nw in self.snapshot.networks or []
+                             if nw["ssid"] in self.snapshot.known_networks
                              ]
+            if preferred:
+                self.networks.sort(key=lambda nw: nw["ssid"] not in preferred)
         else:
-            self.networks = self.iwd.get_networks()
+            self.networks = list(self.snapshot.networks or [])
 
-        offset = 3 if (SHOW_SEPARATOR and TEMPLATES["separator"]) else 2
+        offset = 4 if (SHOW_SEPARATOR and TEMPLATES["separator"]) else 3
         if self.combi_mode:
             offset = 0
         self.mark_known_or_active_networks(offset=offset)
@@ -242,6 +240,44 @@ class RofiNetworkList(RofiIWDDialog):
 
         # add disable menu item
         self.add_separator()
+        self.add_disable_item()
+
+    def prepare_templates(self):
+        """Prepare the templates for active and known networks.
+
+        If "network_list_entry_active" or "network_list_entry_known" is
+        empty, the default template is used.
+        """
+        active_entry_template = TEMPLATES["network_list_entry_active"]
+        self.row_template_active = self.row_template
+        if active_entry_template:
+            self.row_template_active = Template(active_entry_template)
+
+        known_entry_template = TEMPLATES["network_list_entry_known"]
+        self.row_template_known = self.row_template
+        if known_entry_template:
+            self.row_template_known = Template(known_entry_template)
+
+    def add_menu_items(self):
+        """Add the entries for scan, refresh and known networks"""
+        self.add_row(TEMPLATES["scan"],
+                     info="cmd#iwd#scan",
+                     icon=ICONS["scan"],
+                     meta=TEMPLATES["meta_scan"]
+                     )
+        self.add_row(TEMPLATES["refresh"],
+                     info="cmd#refresh",
+                     icon=ICONS["refresh"],
+                     meta=TEMPLATES["meta_refresh"]
+                     )
+        self.add_row(TEMPLATES["known_networks"],
+                     info="cmd#iwd#knownnetworks",
+                     icon=ICONS["trash"],
+                     meta=TEMPLATES["meta_known_networks"]
+                     )
+
+    def add_disable_item(self):
+        """Add the entry to disable wifi"""
         self.add_row(TEMPLATES["disable_wifi"],
                      info="cmd#blockwifi",
                      icon=ICONS["disable"],
@@ -257,9 +293,10 @@ class RofiNetworkList(RofiIWDDialog):
         active = None
         known = []
         for idx, nw in enumerate(self.networks):
-            if nw["ssid"] == self.iwd.ssid():
+            if nw["ssid"] == self.snapshot.ssid():
                 active = idx + offset
-            elif nw["ssid"] in self.iwd.known_networks and not self.combi_mode:
+            elif nw["ssid"] in self.snapshot.known_networks\
+                    and not self.combi_mode:
                 known.append(idx + offset)
         if active is not None:
             self.set_option("active", f"{active}")
@@ -269,20 +306,13 @@ class RofiNetworkList(RofiIWDDialog):
         for nw in self.networks:
             self.add_network_to_dialog(nw)
 
-    def choose_icon(self, nw):
-        if nw["security"] != "open":
-            filename = ICONS[f"wifi-signal-{nw['quality']}"]
-        else:
-            filename = ICONS[f"wifi-encrypted-signal-{nw['quality']}"]
-        return filename
-
     def add_network_to_dialog(self, nw):
         text = ""
         cmd = f"cmd#iwd#connect{nw['ssid']}"
         meta = TEMPLATES["meta_connect"]
-        nw['quality_str'] = SIGNAL_QUALITY_TEXT[nw['quality']]
+        nw = dict(nw, quality_str=SIGNAL_QUALITY_TEXT[nw['quality']])
         # choose the correct template
-        if nw["ssid"] == self.iwd.ssid():
+        if nw["ssid"] == self.snapshot.ssid():
             text = self.row_template_active.substitute(nw)
             if self.combi_mode:
                 cmd = "cmd#iwd#disconnect"
@@ -290,7 +320,7 @@ class RofiNetworkList(RofiIWDDialog):
             else:
                 cmd = "cmd#iwd#showactiveconnection"
                 meta = TEMPLATES["meta_showactive"]
-        elif nw["ssid"] in self.iwd.known_networks:
+        elif nw["ssid"] in self.snapshot.known_networks:
             text = self.row_template_known.substitute(nw)
         else:
             text = self.row_template.substitute(nw)
@@ -298,7 +328,92 @@ class RofiNetworkList(RofiIWDDialog):
         #    meta = meta + " " + TEMPLATES["meta_combi_mode"]
         self.add_row(text,
                      info=cmd,
-                     icon=self.choose_icon(nw),
+                     icon=signal_icon(nw),
                      meta=meta
                      )
 
+
+class RofiKnownNetworks(RofiIWDDialog):
+    """Dialog to manage the known networks.
+
+    List all known networks (also those out of range). Selecting a network
+    marks or unmarks it, kb-custom-1 shows its details. The marked networks
+    can be forgotten at once with the "Forget selected" entry.
+    """
+    row_template = Template(TEMPLATES["known_network_entry"])
+    details_template = Template(TEMPLATES["connection-details-entry"])
+
+    def __init__(self, snapshot, marked, details_for=None, details=None,
+                 message=None, data=None):
+        """Initialize the dialog.
+
+        Args:
+            snapshot (Snapshot): Needs the known_networks and networks
+                sections
+            marked (list[str]): SSIDs of the marked networks
+            details_for (str): SSID of the network to show the details for
+            details (dict): The details of that network (see
+                IWD.known_network_details())
+            message (str): Message to show, default is a short help
+            data (str): Passed to rofi's data option
+        """
+        super().__init__(TEMPLATES["prompt_ssid"],
+                         snapshot,
+                         message=(TEMPLATES["msg_known_networks"]
+                                  if message is None else message),
+                         data=data)
+        self.set_option("no-custom", "true")
+        self.set_option("use-hot-keys", "true")
+
+        self.row_template_marked = self.row_template
+        if TEMPLATES["known_network_entry_marked"]:
+            self.row_template_marked = \
+                Template(TEMPLATES["known_network_entry_marked"])
+
+        in_range = {nw["ssid"]: nw for nw in self.snapshot.networks or []}
+
+        self.add_row(TEMPLATES["back"],
+                     info="cmd#known#back",
+                     icon=ICONS["back"]
+                     )
+        rows = 1
+        if marked:
+            self.add_row(Template(TEMPLATES["forget_selected"])
+                         .substitute(count=len(marked)),
+                         info="cmd#known#forget",
+                         icon=ICONS["trash"]
+                         )
+            rows += 1
+        if SHOW_SEPARATOR and TEMPLATES["separator"]:
+            rows += 1
+        self.add_separator()
+
+        active = []
+        for ssid, known in self.snapshot.known_networks.items():
+            values = dict(known, ssid=ssid)
+            icon = None
+            if ssid in in_range:
+                icon = signal_icon(in_range[ssid])
+            if ssid in marked:
+                text = self.row_template_marked.substitute(values)
+                active.append(rows)
+                icon = ICONS["confirm"]
+            else:
+                text = self.row_template.substitute(values)
+            self.add_row(text, icon=icon, info=f"cmd#known#toggle{ssid}")
+            rows += 1
+            if ssid == details_for:
+                rows += self.add_details(details or {})
+        self.set_option("active", ",".join(map(str, active)))
+
+    def add_details(self, details):
+        """Add the details of a known network below its row.
+
+        Returns:
+            (int) The number of rows added.
+        """
+        for name, value in details.items():
+            self.add_row(self.details_template.substitute(property=name,
+                                                          value=value),
+                         nonselectable="true")
+        return len(details)
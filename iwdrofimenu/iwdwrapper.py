@@ -19,12 +19,231 @@
 
 import subprocess
 import re
+import time
+import logging
 from enum import Enum
-import pexpect
+from dataclasses import dataclass
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext, ExitStack
+from .backends import default_backend
+from .address import interface_address
 
 # this might depend on the os or configuration, language, whatever
 REGEX_DATE = r"\S+\s+\d+,\s+\d+:\d+\s+(?:PM|AM)"
 
+# RSSI thresholds (in dBm) iwctl uses for the number of stars
+RSSI_STARS = [(-60, 4), (-67, 3), (-75, 2)]
+
+
+# whether a passphrase is needed to connect to a new network, by security type
+# as listed by iwctl (8021x networks need to be provisioned in a file)
+SECURITY_NEEDS_PASSPHRASE = {"open": False, "psk": True, "wep": True}
+
+
+def rssi_to_quality(rssi):
+    """Convert an RSSI value in dBm to the number of stars iwctl would show.
+
+    Returns:
+        (int) A value between 1 and 4.
+    """
+    for threshold, stars in RSSI_STARS:
+        if rssi >= threshold:
+            return stars
+    return 1
+
+
+# The parsers are shared by IWD and AsyncIWD.
+
+def clean_output_line(line):
+    """Remove all colorcodes and formatting spaces from line and return it.
+
+    The output of iwctl is full of colorcodes and formatting stuff that is
+    not good to parse. This function is meant to clean this mess up, before
+    trying to retrieve information out of it.
+
+    Args:
+        line (str): A line of text usually read from the iwctl output.
+
+    Returns:
+        (str) The string without colorcodes, etc.
+    """
+    line = line.strip() \
+        .replace("[1;30m]", "") \
+        .replace("[0m", "")
+    line = re.sub(r"\*\x1b.*", "*", line)
+    line = line.replace("\x1b", "") \
+        .replace("[1;90m>", " ")
+    return line.strip()
+
+
+def parse_table(output):
+    """Parse a property table (like "iwctl station wlan0 show" prints it)
+    into a dictionary.
+
+    The "*" iwctl shows in the Settable column of some properties is not
+    part of their names.
+    """
+    regex = re.compile(r"^\s*(?:\*\s+)?(\S+(?:\s\S+)?)\s+(.*?)\s*$")
+    lines = map(clean_output_line, output.split("\n")[4:])
+    table = {m.group(1): m.group(2)
+             for m in (regex.match(line) for line in lines if line)
+             if m is not None}
+    return table
+
+
+def parse_networks(output):
+    """Parse the output of "iwctl station <device> get-networks" into a list
+    of dictionaries (see IWD.get_networks())."""
+    raw_list = map(clean_output_line, output.split("\n")[4:-1])
+    regex = re.compile(r'^(?P<ssid>.*?)\s+(?P<security>\w+)\s+(?P<quality>\*+)\s*$')
+    return [
+        {"ssid": m.group("ssid"),
+         "security": m.group("security"),
+         "quality": len(m.group("quality"))}
+        for m in (regex.match(line) for line in raw_list)
+        if m is not None
+    ]
+
+
+def parse_networks_rssi(output):
+    """Parse the output of "iwctl station <device> get-networks rssi-dbms"
+    into a list of dictionaries like parse_networks(), with the additional
+    entry "rssi" (in dBm)."""
+    raw_list = map(clean_output_line, output.split("\n")[4:-1])
+    regex = re.compile(r'^(?P<ssid>.*?)\s+(?P<security>\w+)\s+(?P<rssi>-\d+)\s*$')
+    networks = []
+    for m in (regex.match(line) for line in raw_list):
+        if m is None:
+            continue
+        rssi = int(m.group("rssi"))
+        if rssi < -1000:  # some versions print 100 * dBm
+            rssi //= 100
+        networks.append({"ssid": m.group("ssid"),
+                         "security": m.group("security"),
+                         "rssi": rssi,
+                         "quality": rssi_to_quality(rssi)})
+    return networks
+
+
+def parse_known_networks(output):
+    """Parse the output of "iwctl known-networks list" into a dictionary
+    (see IWD.update_known_networks())."""
+    raw_list = map(clean_output_line, output.split("\n")[4:-1])
+    regex = re.compile(r"^(.*?)\s+(\S+)\s+("+REGEX_DATE+r")\s*$")
+    matches = [regex.match(line) for line in raw_list if line]
+    return {m.group(1): {"security": m.group(2),
+                         "last_connected": m.group(3)
+                         }
+            for m in matches
+            if m is not None
+            }
+
+
+def needs_passphrase(ssid, known_networks, networks):
+    """Check if a passphrase has to be entered to connect to ssid.
+
+    Args:
+        ssid (str): The network to connect to
+        known_networks (dict): As parsed by parse_known_networks()
+        networks (list[dict]): As parsed by parse_networks() (or None)
+
+    Returns:
+        True if a passphrase is needed, False if not and None if it
+        can't be told (unknown network or security type).
+    """
+    if ssid in known_networks:
+        return False
+    for nw in networks or []:
+        if nw["ssid"] == ssid:
+            return SECURITY_NEEDS_PASSPHRASE.get(nw["security"])
+    return None
+
+
+def freeze(value):
+    """Return an immutable version of value (dicts and lists, nested)"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item)
+                                 for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def disconnected_state(state):
+    """Return the state (as parsed by parse_table()) a station would have
+    after disconnecting from state (None if state is None)."""
+    if state is None:
+        return None
+    state = {name: value for name, value in state.items()
+             if name in ("Scanning",)}
+    state["State"] = "disconnected"
+    return state
+
+
+# what has to match for an assumed result to be confirmed by the real one
+VERIFIED_PARTS = {
+    "state": lambda state: state and (state.get("State"),
+                                      state.get("Connected network")),
+    "known_networks": lambda known_networks: sorted(known_networks or {}),
+}
+
+
+PARSERS = {
+    "state": parse_table,
+    "device_info": parse_table,
+    "networks": parse_networks,
+    "known_networks": parse_known_networks,
+}
+"""The parser for the output of each query"""
+
+
+def query_commands(device):
+    """Return the commands used to query information about device, by
+    name (the keys of their results in the cache)."""
+    return {
+        "state": ["iwctl", "station", device, "show"],
+        "networks": ["iwctl", "station", device, "get-networks"],
+        "networks_rssi": ["iwctl", "station", device, "get-networks",
+                          "rssi-dbms"],
+        "known_networks": ["iwctl", "known-networks", "list"],
+        "device_info": ["iwctl", "device", device, "show"],
+    }
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """Everything known about a device at one moment, see IWD.snapshot().
+
+    The sections are read-only versions of the IWD properties with the same
+    names (mappings instead of dicts, tuples instead of lists). Sections that
+    were not asked for or could not be queried are None, except
+    known_networks, which is empty if the query failed (like the property).
+
+    Attributes:
+        device (str): The device
+        time (float): When the snapshot was taken (time.time())
+        generation (int): IWD.generation at that time. If it's still the
+            same, nothing was changed through the IWD object since.
+    """
+    device: str
+    time: float
+    generation: int
+    state: object = None
+    device_info: object = None
+    known_networks: object = None
+    networks: object = None
+
+    def ssid(self):
+        """Get SSID of the connected network or None."""
+        return None if self.state is None\
+            else self.state.get("Connected network")
+
+    def connected(self):
+        """Check if connected (None if the state is unknown)"""
+        return None if self.state is None\
+            else self.state.get("State") == "connected"
+
 
 class IWD:
     """Class to control (parts of) the iwd network manager.
@@ -35,7 +254,7 @@ class IWD:
     Only basic operations for managing wifi connections are supported.
     If an operation fails, None is returnd by most methods and details
     ca be obtained with the self.last_result property which holds
-    the result of the corresponding call of subprocess.run(), with
+    the result of the corresponding call of the backend's run(), with
     which most interactions with iwctl are done.
 
     Examples:
@@ -66,8 +285,11 @@ class IWD:
         NEED_PASSPHRASE = 1
         NOT_SUCCESSFUL = 2
         TIMEOUT = 3
+        NO_ADDRESS = 4
+        NOT_USABLE = 5
 
-    def __init__(self, device="wlan0"):
+    def __init__(self, device="wlan0", cache=None, max_age=0, backend=None,
+                 memo=None):
         """Constructor.
 
         Initialize object's properties, update the connection state
@@ -75,11 +297,28 @@ class IWD:
 
         Args:
             device (str): device as used in iwctl (default: "wlan0")
+            cache (RuntimeCache): If given, the results of queries are
+                stored in it to be shared with other invocations.
+            max_age (float): Age in seconds up to which a query result from
+                cache is used instead of running iwctl (default: 0)
+            backend (Backend): Runs the commands (default: the default
+                backend from the backends module, usually running them as
+                subprocesses)
+            memo (dict): Parsed query results to start with (e.g. handed
+                over from the last invocation, see the handoff module)
         """
         self.device = device
         """Network device that is used"""
+        self.cache = cache
+        """RuntimeCache to share query results with other processes or None"""
+        self.max_age = max_age
+        """Maximum age of cached query results to be used"""
+        self.backend = backend or default_backend()
+        """Backend used to run the commands"""
+        self.queries = query_commands(device)
+        """The commands used to query information, by name"""
         self.last_result = None
-        """The last result of subprocess.run(). It's for finding out why an
+        """The last result of the backend's run(). It's for finding out why an
         operation might have failed. Might be None!"""
         self.state = None
         """A dictionary with information about the currenct connection.
@@ -92,63 +331,272 @@ class IWD:
         """A dictionary holding the information about the network device
         as given by iwctl device <device> show. Need to be updated
         with update_device_info()."""
+        self.networks = None
+        """The list of networks as returned by the last call of
+        get_networks(). None if it was never called or failed."""
+        self.memo = dict(memo or {})
+        """Parsed query results by query name. Every query runs only once
+        until it's invalidated by an operation changing the state of iwd
+        or clear_memo() is called."""
+        self.memo_hits = 0
+        self.memo_misses = 0
+        self.generation = 0
+        """Counts the changes of the memo by invalidate() and clear_memo()"""
+        self.assumed = set()
+        """Names of the memo entries that were not queried, but assumed
+        after an operation (see assume() and verify())"""
+        self.last_connect = None
+        """Report of the last connect() call: a dictionary with the "ssid",
+        the "result", the durations of the "phases" in seconds and the
+        "address" found. None if there was no call yet."""
 
-        self.update_connection_state()
-        self.update_device_info()
+        self.snapshot(("state", "device_info"))
 
-    def get_output_simple(self, cmd, timeout=5):
+    def get_output_simple(self, cmd, timeout=5, cached=False, max_age=None):
         """Run a non-interactice command.
 
-        Call subprocess.run to execute cmd, and store the result in the
+        Let the backend execute cmd, and store the result in the
         last_result property.
 
         Args:
             cmd (list[str]): A list of strings. First entry is the command,
                 followed by it's arguments (e.g ["ls", "-l"])
             timeout (int): Timeout in seconds for the operation
+            cached (bool): If True and a cache is set, the result is taken
+                from the cache if it's not older than max_age and stored in
+                it otherwise.
+            max_age (float): Overrides the max_age property for this call.
 
         Returns:
             The exitcode of the process (as found in last_result.exitcode.
             (0 means finished without errors, different from 0 means some kind
             of problem. Details can be found in last_result in this case)
+            If the timeout was reached, the process is killed and
+            last_result has the exitcode -9 and timed_out set.
         """
-        self.last_result = subprocess.run(cmd,
-                                          capture_output=True,
-                                          timeout=timeout,
-                                          text=True,
-                                          check=False)
+        def run(cmd):
+            return self.backend.run(cmd, timeout)
+        try:
+            if cached and self.cache is not None:
+                self.last_result = self.cache.run(
+                        cmd, run, self.max_age if max_age is None else max_age)
+            else:
+                self.last_result = run(cmd)
+        except subprocess.TimeoutExpired:
+            logging.warning("%s timed out after %.1fs", " ".join(cmd[:2]),
+                            timeout)
+            self.last_result = subprocess.CompletedProcess(cmd, -9, "",
+                                                           "timed out")
+            self.last_result.timed_out = True
         return self.last_result.returncode
 
-    def clean_ouput_line(self, line):
-        """Remove all colorcodes and formatting spaces from line and return it.
+    def query(self, name, max_age=None):
+        """Run the query with the given name (a key of queries).
+
+        Args:
+            name (str): Name of the query
+            max_age (float): Overrides the max_age property for this call.
+
+        Returns:
+            The exit code as returned by get_output_simple()
+        """
+        return self.get_output_simple(self.queries[name], cached=True,
+                                      max_age=max_age)
+
+    def memoized(self, name, fetch, *args):
+        """Return the memoized result of the query name.
+
+        If there is none, call fetch(*args) to run the query and parse the
+        result, and memoize it.
+        """
+        if name in self.memo:
+            self.memo_hits += 1
+            logging.debug("memo hit: %s", name)
+            return self.memo[name]
+        self.memo_misses += 1
+        logging.debug("memo miss: %s", name)
+        self.memo[name] = fetch(*args)
+        return self.memo[name]
+
+    def clear_memo(self):
+        """Forget all memoized query results (e.g. for a new request in long
+        running processes)."""
+        self.memo.clear()
+        self.assumed.clear()
+        self.generation += 1
+
+    def mutex(self):
+        """Return a context manager serializing operations that change the
+        state of iwd (across all processes sharing the cache).
+        """
+        if self.cache is None:
+            return nullcontext()
+        return self.cache.lock("mutation")
+
+    def invalidate(self, *names):
+        """Remove the results of the given queries from the memo and the cache.
+
+        Needs to be called after an operation changed the state of iwd.
+        """
+        self.generation += 1
+        for name in names:
+            self.memo.pop(name, None)
+            self.assumed.discard(name)
+        if self.cache is not None:
+            self.cache.invalidate(*(self.queries[name] for name in names))
+
+    def assume(self, name, value):
+        """Put the known effect of a successful operation in the memo.
+
+        The state after an operation is often known without asking iwd, so
+        the query name doesn't need to be run again in this process. The
+        cache still needs to be invalidated, other processes query it.
+        verify() checks the assumption later.
+        """
+        self.generation += 1
+        self.memo[name] = value
+        self.assumed.add(name)
+        if name == "state":
+            self.state = value
+        elif name == "known_networks":
+            self.known_networks = value or {}
+
+    def assume_forgotten(self, ssids, memo):
+        """Assume the networks ssids were forgotten (see assume()).
+
+        Args:
+            ssids (list[str]): The networks forgotten
+            memo (dict): The memo before forgetting them
+        """
+        if not ssids:
+            return
+        known_networks = memo.get("known_networks")
+        if known_networks is not None:
+            self.assume("known_networks",
+                        {ssid: info for ssid, info in known_networks.items()
+                         if ssid not in ssids})
+        state = memo.get("state")
+        if state is not None:
+            # forgetting the active network disconnects it
+            if state.get("Connected network") in ssids:
+                state = disconnected_state(state)
+            self.assume("state", state)
+
+    def verify(self):
+        """Query the assumed memo entries and compare them with the real
+        results, which replace them.
+
+        Returns:
+            (list[str]) The names of the entries iwd disagreed with.
+        """
+        assumed = {name: self.memo.get(name) for name in self.assumed}
+        self.invalidate(*assumed)
+        disagreed = []
+        for name, result in self.run_queries(list(assumed), 0).items():
+            self.memo[name] = (PARSERS[name](result.stdout)
+                               if result.returncode == 0 else None)
+            parts = VERIFIED_PARTS.get(name, lambda value: value)
+            if parts(self.memo[name]) != parts(assumed[name]):
+                disagreed.append(name)
+        # update the properties from the memo
+        self.snapshot(tuple(assumed))
+        return disagreed
+
+    def run_queries(self, names, max_age=None):
+        """Run several queries at once (see Backend.run_many()).
+
+        Results that are fresh enough are taken from the cache, the others
+        are run together and stored in it. Like RuntimeCache.run(), the
+        locks of the missing queries are held meanwhile, so other processes
+        wait for the results instead of running the same queries (see
+        RuntimeCache.run() for max_age=0 as well).
+
+        Returns:
+            (dict) The results by query name.
+        """
+        max_age = self.max_age if max_age is None else max_age
+        started = time.time()
+        results = {}
+
+        def from_cache(names, max_age):
+            for name in names:
+                entry = self.cache.get(self.queries[name], max_age)
+                if entry is not None:
+                    results[name] = subprocess.CompletedProcess(
+                            self.queries[name], entry["returncode"],
+                            entry["stdout"], entry["stderr"])
+
+        if self.cache is None:
+            missing = list(names)
+        else:
+            if max_age != 0:
+                from_cache(names, max_age)
+            missing = [name for name in names if name not in results]
+        if not missing:
+            return results
+        with ExitStack() as locks:
+            if self.cache is not None:
+                # always locked in the same order, so processes locking
+                # overlapping sets of queries can't deadlock
+                for name in sorted(missing):
+                    locks.enter_context(self.cache.lock(self.queries[name]))
+                # results finished while waiting are as good as new ones
+                from_cache(missing, max(max_age, time.time() - started))
+                missing = [name for name in missing if name not in results]
+            if missing:
+                for name, result in zip(missing, self.backend.run_many(
+                        [self.queries[name] for name in missing])):
+                    results[name] = result
+                    # like RuntimeCache.run(), timeouts are not cached
+                    if self.cache is not None \
+                            and not getattr(result, "timed_out", False):
+                        self.cache.store(self.queries[name], result)
+        return results
+
+    def snapshot(self, sections=tuple(PARSERS), max_age=None):
+        """Return the state, device info, known networks and networks at once.
 
-        The output of iwctl is full of colorcodes and formatting stuff that is
-        not good to parse. This method is meant to clean this mess up, before
-        trying to retrieve information out of it.
+        Sections not in the memo are queried together in a single batch, so
+        they are from (almost) the same moment. The memo and the properties
+        of the object are updated as well.
 
         Args:
-            line (str): A line of text usually read from the iwctl output.
+            sections (tuple[str]): The sections to include (default: all)
+            max_age (float): Overrides the max_age property for this call.
 
         Returns:
-            (str) The string without colorcodes, etc.
+            (Snapshot) The immutable snapshot.
         """
-        line = line.strip() \
-            .replace("[1;30m]", "") \
-            .replace("[0m", "")
-        line = re.sub(r"\*\x1b.*", "*", line)
-        line = line.replace("\x1b", "") \
-            .replace("[1;90m>", " ")
-        return line.strip()
+        missing = [name for name in sections if name not in self.memo]
+        self.memo_hits += len(sections) - len(missing)
+        self.memo_misses += len(missing)
+        logging.debug("snapshot, querying: %s", ", ".join(missing))
+        for name, result in self.run_queries(missing, max_age).items():
+            self.memo[name] = (PARSERS[name](result.stdout)
+                               if result.returncode == 0 else None)
+
+        if "state" in sections:
+            self.state = self.memo["state"]
+        if "device_info" in sections and self.memo["device_info"] is not None:
+            self.device_info = self.memo["device_info"]
+        if "known_networks" in sections:
+            self.known_networks = self.memo["known_networks"] or {}
+        if "networks" in sections:
+            self.networks = self.memo["networks"]
+        values = {name: self.memo[name] for name in sections}
+        if "known_networks" in values:
+            values["known_networks"] = values["known_networks"] or {}
+        return Snapshot(self.device, time.time(), self.generation,
+                        **{name: freeze(value)
+                           for name, value in values.items()})
+
+    def clean_ouput_line(self, line):
+        """See clean_output_line()"""
+        return clean_output_line(line)
 
     def create_dict_from_table(self):
-        """TODO"""
-        regex = re.compile(r"^\s*(\S+(?:\s\S+)?)\s+(.*?)\s*$")
-        lines = map(self.clean_ouput_line,
-                    self.last_result.stdout.split("\n")[4:])
-        table = {m.group(1): m.group(2)
-                 for m in (regex.match(line) for line in lines if line)
-                 if m is not None}
-        return table
+        """Parse the table in last_result (see parse_table())"""
+        return parse_table(self.last_result.stdout)
 
     def get_state(self, property):
         """Get an entry from the state property.
@@ -184,21 +632,37 @@ class IWD:
         """Get SSID of currently connected network or None."""
         return self.get_state("Connected network")
 
+    def rssi(self):
+        """Get the RSSI in dBm of the currently connected network or None."""
+        value = self.get_state("RSSI")
+        if value is None:
+            return None
+        try:
+            return int(value.split()[0])
+        except ValueError:
+            return None
+
+    def quality(self):
+        """Get the quality (1-4) of the connected network or None."""
+        rssi = self.rssi()
+        return None if rssi is None else rssi_to_quality(rssi)
+
     def update_connection_state(self):
         """Update the state property.
 
         Returns:
             The state property itself or None in the case of failure.
         """
-        if self.get_output_simple(["iwctl",
-                                   "station",
-                                   self.device,
-                                   "show"]) != 0:
-            self.state = None
-            return None
-        self.state = self.create_dict_from_table()
+        self.state = self.memoized("state", self.fetch_table, "state")
         return self.state
 
+    def fetch_table(self, name):
+        """Run the query name and return its output as dictionary (or None on
+        failure)."""
+        if self.query(name) != 0:
+            return None
+        return self.create_dict_from_table()
+
     def scan(self):
         """Scan for wifi networks.
 
@@ -207,73 +671,222 @@ class IWD:
             Check last_result for more detailed information. To retrieve the
             network list use network_list().
         """
-        return self.get_output_simple(["iwctl",
-                                       "station",
-                                       self.device,
-                                       "scan"]) == 0
+        # concurrent scans are shared through the cache, but an older
+        # result must not stand in for a new scan
+        returncode = self.get_output_simple(["iwctl",
+                                             "station",
+                                             self.device,
+                                             "scan"], cached=True, max_age=0)
+        self.invalidate("state", "networks", "networks_rssi")
+        if returncode != 0 and "already in progress" in\
+                self.last_result.stdout + self.last_result.stderr:
+            return True  # someone else triggered a scan, that's fine
+        return returncode == 0
+
+    def scanning(self):
+        """Check if iwd is scanning (according to the state property)"""
+        return self.get_state("Scanning") == "yes"
+
+    def wait_for_scan(self, timeout=10, interval=0.1, max_interval=1):
+        """Wait until iwd reports that scanning has finished.
+
+        The state is polled, starting with interval seconds between two
+        queries, doubling up to max_interval.
+
+        Args:
+            timeout (float): Give up after this many seconds
+
+        Returns:
+            True if the scan finished, False if the timeout was reached or
+            the state could not be queried.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            self.invalidate("state")
+            if self.update_connection_state() is None:
+                return False
+            if not self.scanning():
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, max_interval)
 
-    def get_networks(self):
+    def get_networks(self, max_age=None):
         """Return a list of all available wifi networks or None in case of
         failure.
 
         Note that scan() should be called before.
 
+        Args:
+            max_age (float): Overrides the max_age property for this call.
+
         Returns:
             None in the case of failure. On success a list of dictionaries
             is returned. The dictionaries have the form
             {"ssid": "WIFI SSID", "security": "psk", "quality": 3}
             The entry "quality" holds a value between 1 and 5.
         """
-        if self.get_output_simple(["iwctl", "station", self.device,
-                                   "get-networks"]) != 0:
+        self.networks = self.memoized("networks", self.fetch_networks,
+                                      max_age)
+        return self.networks
+
+    def fetch_networks(self, max_age=None):
+        """Run and parse the networks query (see get_networks())."""
+        if self.query("networks", max_age) != 0:
             return None
+        return parse_networks(self.last_result.stdout)
 
-        raw_list = map(self.clean_ouput_line,
-                       self.last_result.stdout.split("\n")[4:-1])
-        regex = re.compile(r'^(?P<ssid>.*?)\s+(?P<security>\w+)\s+(?P<quality>\*+)\s*$')
-        matches = [
-            {"ssid": m.group("ssid"),
-             "security": m.group("security"),
-             "quality": len(m.group("quality"))}
-            for m in (regex.match(line) for line in raw_list)
-            if m is not None
-        ]
+    def get_networks_rssi(self, max_age=None):
+        """Like get_networks(), but with the signal strength in dBm.
 
-        return matches
+        The dictionaries have the additional entry "rssi". None is returned
+        in case of failure (e.g. if iwctl doesn't support it).
+        """
+        return self.memoized("networks_rssi", self.fetch_networks_rssi,
+                             max_age)
 
-    def update_known_networks(self):
+    def fetch_networks_rssi(self, max_age=None):
+        """Run and parse the networks_rssi query (see get_networks_rssi())"""
+        if self.query("networks_rssi", max_age) != 0:
+            return None
+        return parse_networks_rssi(self.last_result.stdout)
+
+    def update_known_networks(self, max_age=None):
         """Update the known_networks property.
 
+        Args:
+            max_age (float): Overrides the max_age property for this call.
+
         Returns:
             known_networks dictionary or None on failure.
         """
-        if self.get_output_simple(["iwctl", "known-networks", "list"]) != 0:
-            self.known_networks = {}
+        known_networks = self.memoized("known_networks",
+                                       self.fetch_known_networks, max_age)
+        self.known_networks = known_networks or {}
+        return known_networks
+
+    def fetch_known_networks(self, max_age=None):
+        """Run and parse the known networks query (see
+        update_known_networks())."""
+        if self.query("known_networks", max_age) != 0:
             return None
-        raw_list = map(self.clean_ouput_line,
-                       self.last_result.stdout.split("\n")[4:-1])
-        regex = re.compile(r"^(.*?)\s+(\S+)\s+("+REGEX_DATE+r")\s*$")
-        matches = [regex.match(line) for line in raw_list if line]
-        self.known_networks = {m.group(1): {"security": m.group(2),
-                                            "last_connected": m.group(3)
-                                            }
-                               for m in matches
-                               if m is not None
-                               }
-        return self.known_networks
+        return parse_known_networks(self.last_result.stdout)
 
     def disconnect(self):
         """Disconnect from current network.
 
+        On success the disconnected state is assumed (see assume()).
+
         Returns:
             Most likely True, if anything goes wrong None.
         """
-        if self.get_output_simple(["iwctl", "station",
-                                   self.device, "disconnect"]) != 0:
+        state = self.memo.get("state")
+        with self.mutex():
+            returncode = self.get_output_simple(["iwctl", "station",
+                                                 self.device, "disconnect"])
+            self.invalidate("state")
+        if returncode != 0:
             return None
+        if state is not None:
+            self.assume("state", disconnected_state(state))
         return True
 
-    def connect(self, ssid, passphrase=None, timeout=5):
+    def connect(self, ssid, passphrase=None, timeout=5, usable_timeout=0):
+        """Connect to a network, see connect_unlocked().
+
+        No other process changes the state of iwd meanwhile. iwctl returns
+        as soon as the network is connected, but it can't be used before
+        the device has an address. With usable_timeout it's waited for that
+        (see wait_until_usable()), the durations of the phases are found in
+        last_connect afterwards. Waiting for another process changing the
+        state is the phase "lock", "connect" is the time iwctl needs.
+
+        Args:
+            usable_timeout (float): Maximum time in seconds to wait for the
+                network to be usable after connecting. 0 doesn't wait.
+
+        Returns:
+            (ConnectionResult) Like connect_unlocked(), NO_ADDRESS or
+            NOT_USABLE if iwctl succeeded, but the network wasn't usable in
+            time (see wait_until_usable()). The result of iwctl alone is
+            found in last_connect["connect_result"].
+        """
+        started = time.monotonic()
+        with self.mutex():
+            locked = time.monotonic()
+            try:
+                result = self.connect_unlocked(ssid, passphrase, timeout)
+            finally:
+                # a new network becomes a known one
+                self.invalidate("state", "known_networks")
+        self.last_connect = {"ssid": ssid,
+                             "result": result.name,
+                             "connect_result": result,
+                             "phases": {"lock": locked - started,
+                                        "connect": time.monotonic() - locked},
+                             "address": None}
+        if result == IWD.ConnectionResult.SUCCESS and usable_timeout > 0:
+            result = self.wait_until_usable(usable_timeout)
+            self.last_connect["result"] = result.name
+        logging.debug("connect: %s", self.last_connect)
+        return result
+
+    def wait_until_usable(self, timeout, interval=0.05, max_interval=0.5):
+        """Wait until the station is connected and the device has an IPv4
+        or a (non link local) IPv6 address.
+
+        The state and the addresses are polled, starting with interval
+        seconds between two checks, doubling up to max_interval. The
+        durations of the phases "state" and "address" are added to
+        last_connect.
+
+        Returns:
+            (ConnectionResult) SUCCESS if the network became usable,
+            NOT_USABLE if iwd didn't report it connected and NO_ADDRESS if
+            there was no address before the timeout.
+        """
+        phases = self.last_connect["phases"]
+        started = time.monotonic()
+        deadline = started + timeout
+        phase = "state"
+        while True:
+            if phase == "state":
+                self.invalidate("state")
+                self.update_connection_state()
+                if self.connected():
+                    phases["state"] = time.monotonic() - started
+                    started = time.monotonic()
+                    phase = "address"
+            if phase == "address":
+                address = interface_address(self.device)
+                if address is not None:
+                    phases["address"] = time.monotonic() - started
+                    self.last_connect["address"] = address
+                    return IWD.ConnectionResult.SUCCESS
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, max_interval)
+        if phase == "state":
+            return IWD.ConnectionResult.NOT_USABLE
+        return IWD.ConnectionResult.NO_ADDRESS
+
+    def needs_passphrase(self, ssid):
+        """Check if a passphrase has to be entered to connect to ssid.
+
+        The decision is made with the known_networks and networks
+        properties, so they need to be up to date.
+
+        Returns:
+            True if a passphrase is needed, False if not and None if it
+            can't be told (unknown network or security type).
+        """
+        return needs_passphrase(ssid, self.known_networks, self.networks)
+
+    def connect_unlocked(self, ssid, passphrase=None, timeout=5):
         """Connect to a network.
 
         Try to conect to the network identified with the given SSID. If
@@ -282,6 +895,14 @@ class IWD:
         aproppriate ConnectionResult is returned.
         So the situation can be handled and retried.
 
+        If no passphrase is given but needs_passphrase() tells one is
+        needed, NEED_PASSPHRASE is returned without running iwctl at all.
+        A given passphrase is sent to the prompt of iwctl through its
+        terminal (see Backend.respond()), not passed with --passphrase,
+        which would show it to every user in the command line of the
+        process. Without a passphrase iwctl is only run interactively to
+        find out if one is needed, when that's unclear.
+
         Args:
             ssid (str): The SSID of the network as returned by get_networks
                 or in known_networks.
@@ -298,53 +919,92 @@ class IWD:
             limit was reached ConnectionResult.TIMEOUT is returned.
         """
         cmd = ["iwctl", "station", self.device, "connect", ssid]
-        proc = pexpect.spawn(cmd[0], cmd[1:])
-        i = proc.expect(["Passphrase:", pexpect.EOF, pexpect.TIMEOUT],
-                        timeout=timeout)
-
-        if i == 0:  # login required
-            if passphrase is None:
-                proc.kill(0)
-                return IWD.ConnectionResult.NEED_PASSPHRASE
-            # it didn't work with proc.sendline(), this is the only workaround
-            # I could figure out
-            for char in passphrase:
-                proc.send(char)
-                proc.flush()
-            proc.send("\n")
-            # proc.interact()
-            j = proc.expect([pexpect.EOF, pexpect.TIMEOUT], timeout=timeout)
-            if j == 0:  # EOF reached
-                proc.close()
-                if proc.exitstatus == 0:  # everything fine
-                    return IWD.ConnectionResult.SUCCESS
+        if passphrase is not None:
+            outcome, exitstatus = self.backend.respond(
+                    cmd, "Passphrase:", passphrase, timeout)
+            if outcome == "timeout":
+                logging.warning("Connecting to %s timed out after %.1fs",
+                                ssid, timeout)
+                return IWD.ConnectionResult.TIMEOUT
+            # asked again, the passphrase was not accepted
+            if outcome == "prompt" or exitstatus != 0:
                 return IWD.ConnectionResult.NOT_SUCCESSFUL
-            proc.kill(0)
-            return IWD.ConnectionResult.TIMEOUT
+            return IWD.ConnectionResult.SUCCESS
 
-        if i == 1:  # EOF reached, no login required
-            proc.close()
-            if proc.exitstatus != 0:
+        if self.needs_passphrase(ssid):
+            return IWD.ConnectionResult.NEED_PASSPHRASE
+
+        outcome, exitstatus = self.backend.probe(cmd, "Passphrase:", timeout)
+
+        if outcome == "prompt":  # login required
+            return IWD.ConnectionResult.NEED_PASSPHRASE
+
+        if outcome == "eof":  # no login required
+            if exitstatus != 0:
                 return IWD.ConnectionResult.NOT_SUCCESSFUL
             return IWD.ConnectionResult.SUCCESS
 
-        proc.kill(0)
         return IWD.ConnectionResult.TIMEOUT
 
     def forget(self, ssid):
         """Forget a known network.
 
         That means no more autoconnect to this network and it might need a
-        a passphrase to connect again.
+        a passphrase to connect again. On success the known networks without
+        ssid are assumed (see assume()).
 
         Returns:
             True on success, None on failure
         """
-        if self.get_output_simple(["iwctl", "known-networks",
-                                   ssid, "forget"]) != 0:
+        memo = dict(self.memo)
+        with self.mutex():
+            returncode = self.get_output_simple(["iwctl", "known-networks",
+                                                 ssid, "forget"])
+            self.invalidate("known_networks", "state")
+        if returncode != 0:
             return None
+        self.assume_forgotten([ssid], memo)
         return True
 
+    def forget_many(self, ssids, workers=4):
+        """Forget several known networks at once.
+
+        The networks are forgotten concurrently, by up to workers iwctl
+        processes at a time.
+
+        Args:
+            ssids (list[str]): The networks to forget
+            workers (int): Maximum number of concurrent iwctl calls
+
+        Returns:
+            (list[str]) The networks that could not be forgotten.
+        """
+        def forget_one(ssid):
+            try:
+                result = self.backend.run(["iwctl", "known-networks",
+                                           ssid, "forget"])
+            except subprocess.TimeoutExpired:
+                return False
+            return result.returncode == 0
+
+        memo = dict(self.memo)
+        with self.mutex():
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(forget_one, ssids))
+            # forgetting the active network disconnects it
+            self.invalidate("known_networks", "state")
+        self.assume_forgotten([ssid for ssid, success in zip(ssids, results)
+                               if success], memo)
+        return [ssid for ssid, success in zip(ssids, results) if not success]
+
+    def known_network_details(self, ssid):
+        """Return the details of a known network as dictionary (or None on
+        failure)."""
+        if self.get_output_simple(["iwctl", "known-networks", ssid, "show"],
+                                  cached=True) != 0:
+            return None
+        return self.create_dict_from_table()
+
     def update_device_info(self):
         """Update the device_info property.
 
@@ -354,12 +1014,11 @@ class IWD:
         Returns:
             The updated version of the device_info property
         """
-        if self.get_output_simple(["iwctl",
-                                   "device",
-                                   self.device,
-                                   "show"]) != 0:
+        device_info = self.memoized("device_info", self.fetch_table,
+                                    "device_info")
+        if device_info is None:
             return None
-        self.device_info = self.create_dict_from_table()
+        self.device_info = device_info
         return self.device_info
 
     def adapter(self):
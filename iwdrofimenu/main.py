@@ -17,16 +17,59 @@
 
 """Main file of the script. Handle userinput and create apropriate dialogs.
 """
+import io
 import os
+import json
 import sys
+import time
+import atexit
+from contextlib import redirect_stdout
 from string import Template
-import subprocess
 import logging
-from settings import TEMPLATES, RFKILL_CMD
+from settings import TEMPLATES, CACHE_TTL, PREFETCH, SCAN_WAIT,\
+        SCAN_WAIT_TIMEOUT, METRICS_FILE, METRICS_TEXTFILE, FORGET_WORKERS,\
+        USABLE_TIMEOUT
 from .iwd_rofi_dialogs import RofiNetworkList, RofiShowActiveConnection,\
                              RofiPasswordInput, RofiConfirmDialog,\
-                             RofiNoWifiDialog
+                             RofiNoWifiDialog, RofiKnownNetworks
+from .rofidialog import RofiDialog
 from .iwdwrapper import IWD
+from .icons import prepare_icons
+from .cache import RuntimeCache
+from .scheduler import ScanScheduler
+from .render import RenderCache
+from .prewarm import take_prewarmed_age
+from .history import ConnectHistory
+from .backends import default_backend, set_default_backend
+from .metrics import Metrics, MeteredBackend
+from . import rfkill
+from . import handoff
+from . import spawn
+
+
+def run_detached(func, *args):
+    """Run func(*args) in a detached child process.
+
+    The child doesn't keep stdout open, so rofi doesn't wait for it. The
+    calling process just continues.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+        if os.fork() != 0:
+            return
+    except OSError as error:
+        logging.warning("Could not start background worker: %s", error)
+        return
+    # child process
+    try:
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDWR)
+        for fd in range(3):
+            os.dup2(devnull, fd)
+        func(*args)
+    finally:
+        os._exit(0)  # don't run any cleanup of the parent
 
 
 class Main:
@@ -42,15 +85,49 @@ class Main:
         """
         self.args = args
         self.message = ""
-        self.iwd = IWD(device)
-        self.iwd.scan()
+        self.flow = "list"
+        """Name of the action taken in this invocation (for metrics)"""
+        self.started = time.monotonic()
+        self.blocked = None
+        """rfkill state set by the last action (None if unchanged)"""
+        self.metrics = None
+        if METRICS_FILE:
+            self.metrics = Metrics(METRICS_FILE, METRICS_TEXTFILE)
+            set_default_backend(MeteredBackend(default_backend(),
+                                               self.metrics))
+            atexit.register(self.flush_metrics)
+        prepare_icons()
 
         self.arg = self.args.arg
         self.combi_mode = self.args.combi_mode
         # self.evaluate_argv()  # set argv and combi_mode
         self.retv = os.environ.get("ROFI_RETV")
         self.info = os.environ.get("ROFI_INFO")
-        self.data = os.environ.get("ROFI_DATA")
+        # the data might start with a token handing over the query results
+        # of the last invocation
+        token, self.data = handoff.split_token(os.environ.get("ROFI_DATA"))
+
+        # the main list is always built from fresh information, but
+        # selecting an entry happens right after the list was shown and the
+        # data needed for it was prefetched
+        max_age = 0
+        if self.info and self.info != "cmd#refresh":
+            max_age = CACHE_TTL
+        self.cache = RuntimeCache()
+        if not self.info and not self.data and self.retv in (None, "0"):
+            # the first list after --prewarm is built from its results
+            prewarmed = take_prewarmed_age(self.cache, device)
+            if prewarmed is not None:
+                max_age = prewarmed
+        memo = None
+        if token is not None and self.info != "cmd#refresh":
+            memo = handoff.restore(self.cache, device, token)
+        self.iwd = IWD(device, cache=self.cache, max_age=max_age, memo=memo)
+        self.scheduler = ScanScheduler(self.iwd, self.cache)
+        # the scan action requests a scan itself
+        if self.info != "cmd#iwd#scan":
+            self.scheduler.request()
+        self.history = ConnectHistory()
 
         commands = {
             "cmd#iwd#scan": self.scan,
@@ -58,6 +135,7 @@ class Main:
             "cmd#iwd#disconnect": self.disconnect,
             "cmd#iwd#connect": self.connect,
             "cmd#iwd#forget": self.forget,
+            "cmd#iwd#knownnetworks": self.manage_known_networks,
             "cmd#blockwifi": self.block_wifi,
             "cmd#unblockwifi": self.unblock_wifi,
         }
@@ -72,14 +150,89 @@ class Main:
         # check if wifi is disabled
         if self.wifi_is_blocked():
             RofiNoWifiDialog(TEMPLATES["prompt_ssid"])
-            sys.exit(0)
+            self.exit()
 
         # default dialog
-        RofiNetworkList(self.iwd,
-                        message=self.message,
-                        data=self.data,
-                        combi_mode=self.combi_mode
-                        )
+        self.show_network_list()
+        self.scheduler.observe(self.iwd.networks)
+        self.log_stats()
+        self.verify_in_background()
+        missing = [name for name in ("state", "known_networks")
+                   if self.iwd.memo.get(name) is None]
+        if PREFETCH and missing:
+            run_detached(self.prefetch, missing)
+
+    def prefetch(self, names):
+        """Warm the cache for the dialogs most likely opened next.
+
+        That's the connection details (which need the station state) and
+        the known networks for connecting. The next invocation usually
+        gets them with the handoff token of the list, so only the queries
+        the list couldn't hand over (names) are run.
+        """
+        for name in names:
+            self.iwd.query(name, max_age=0)
+
+    def verify_in_background(self):
+        """Run verify() in a detached process if anything was assumed"""
+        if self.iwd.assumed or self.blocked is not None:
+            run_detached(self.verify)
+
+    def verify(self):
+        """Check the effects of the action, that were assumed instead of
+        queried, against iwd and rfkill.
+
+        The real results are cached for the next invocation. If they differ,
+        the handoff snapshot with the assumptions is discarded, so the next
+        dialog is built from the real ones.
+        """
+        disagreed = self.iwd.verify()
+        if self.blocked is not None and self.iwd.adapter() is not None:
+            if rfkill.is_blocked(self.iwd.adapter(), self.cache,
+                                 max_age=0) != self.blocked:
+                disagreed.append("rfkill")
+        if disagreed:
+            logging.info("Assumed state was wrong: %s", ", ".join(disagreed))
+            handoff.discard(self.cache, self.iwd.device)
+
+    def show_network_list(self):
+        """Show the list of networks.
+
+        The output is taken from the render cache if the list would look
+        exactly like the last time.
+        """
+        # query everything the list shows at once, it's needed for the
+        # handoff token and the render key as well
+        snapshot = self.iwd.snapshot()
+        # the data is different every time, so it's not part of the cached
+        # output
+        RofiDialog(data=self.with_token(self.data))
+        # networks that could be connected to the last time come first in
+        # combi mode
+        preferred = {ssid for ssid in snapshot.known_networks
+                     if self.history.known_good(ssid)}
+        renders = RenderCache(self.cache,
+                              "combi" if self.combi_mode else "list",
+                              self.metrics)
+        key = renders.key(snapshot.networks,
+                          snapshot.ssid(),
+                          sorted(snapshot.known_networks),
+                          sorted(preferred),
+                          self.message,
+                          self.combi_mode)
+        payload = renders.get(key)
+        if payload is None:
+            with redirect_stdout(io.StringIO()) as buffer:
+                RofiNetworkList(snapshot,
+                                message=self.message,
+                                combi_mode=self.combi_mode,
+                                preferred=preferred
+                                )
+            payload = buffer.getvalue()
+            renders.store(key, payload)
+        sys.stdout.flush()
+        sys.stdout.buffer.write(payload.encode("utf-8"))
+        sys.stdout.buffer.flush()
 
     def evaluate_argv(self):
         """Evaluate sys.argv and set arg and combi_mode
@@ -98,9 +251,40 @@ class Main:
             else:
                 self.arg = sys.argv[1]
 
+    def flush_metrics(self):
+        """Record the duration of this invocation and write the metrics"""
+        self.metrics.observe("iwdrofimenu_flow_seconds",
+                             time.monotonic() - self.started,
+                             flow=self.flow,
+                             combi_mode=str(bool(self.combi_mode)).lower())
+        self.metrics.flush()
+
+    def with_token(self, data=""):
+        """Return data with a token in front, that hands the current query
+        results over to the next invocation (see the handoff module)."""
+        return handoff.save(self.cache, self.iwd.device, self.iwd.memo)\
+            + (data or "")
+
+    def log_stats(self):
+        """Log how often queries could be answered from the memo and what
+        spawning the commands cost"""
+        logging.info("Query memo: %d hits, %d misses",
+                     self.iwd.memo_hits, self.iwd.memo_misses)
+        logging.info("Spawned %d processes, %.1fms to start them, "
+                     "%.1fms until they finished",
+                     spawn.stats["spawns"],
+                     1000 * spawn.stats["spawn_seconds"],
+                     1000 * spawn.stats["run_seconds"])
+
+    def exit(self, status=0):
+        """Log statistics, verify assumptions and exit"""
+        self.log_stats()
+        self.verify_in_background()
+        sys.exit(status)
+
     def exit_if_combi_mode(self):
         if self.combi_mode:
-            sys.exit(0)
+            self.exit()
 
     def apply_actions(self, commands):
         """Main logic of the program.
@@ -118,6 +302,7 @@ class Main:
         if self.data:
             for prefix, action in commands.items():
                 if self.data.startswith(prefix):
+                    self.flow = prefix.split("#")[-1]
                     action(self.data[len(prefix):])
                     done = True
 
@@ -126,6 +311,7 @@ class Main:
             return
         for prefix, action in commands.items():
             if self.info.startswith(prefix):
+                self.flow = prefix.split("#")[-1]
                 action(self.info[len(prefix):])
 
     def wifi_is_blocked(self):
@@ -134,59 +320,69 @@ class Main:
         Returns:
             true if wifi is disabled, false if it's enabled.
         """
-        result = subprocess.run([RFKILL_CMD, "-n", "-r"],
-                                capture_output=True,
-                                text=True,
-                                check=True,  # throw an exception on errors
-                                env={"LANGUAGE": "en"}
-                                )
         adapter = self.iwd.adapter()
         if adapter is None:
             raise IOError(f"Something went wrong while querying {self.iwd.device}. "
                         f"Try to run 'iwctl device {self.iwd.device} show' manually to see what's going on.")
-        for line in result.stdout.split("\n"):
-            if line.find(adapter) != -1:
-                if line.find(" blocked") != -1:
-                    return True
-                return False
-        raise IOError(f"{self.iwd.device} not found in rfkill list.")
+        if self.blocked is not None:
+            # the action just changed it
+            return self.blocked
+        blocked = rfkill.is_blocked(adapter, self.cache, self.iwd.max_age)
+        if blocked is None:
+            # show the list anyway, like without results of iwctl
+            logging.warning("rfkill state of %s unknown", adapter)
+            return False
+        return blocked
 
     def block_wifi(self, dummy):
         """Deactivate wifi entirely with rfkill"""
-        result = subprocess.run(["rfkill", "block", "wlan"],
-                                capture_output=True,
-                                text=True,
-                                check=False)
+        result = rfkill.set_blocked(True, self.cache)
+        self.iwd.invalidate("state", "networks")
         if result.returncode != 0:
             self.message = "An error occured: " + result.stderr
+        else:
+            self.blocked = True
 
         self.exit_if_combi_mode()
 
     def unblock_wifi(self, dummy):
         """Activate wifi with rfkill"""
-        result = subprocess.run(["rfkill", "unblock", "wlan"],
-                                capture_output=True,
-                                text=True,
-                                check=False)
+        result = rfkill.set_blocked(False, self.cache)
+        self.iwd.invalidate("state", "networks")
         if result.returncode != 0:
             self.message = "An error occured: " + result.stderr
+        else:
+            self.blocked = False
 
         self.exit_if_combi_mode()
 
     def scan(self, dummy):
-        """Scan for wifi networks"""
-        self.iwd.scan()
+        """Scan for wifi networks, if the last scan is not too recent.
+
+        If scan_wait is set or a scan is running already (which can't be
+        restarted), wait for the scan to finish, so the list shown
+        afterwards is up to date.
+        """
+        if not self.scheduler.request(force=True):
+            self.message = TEMPLATES["msg_scan_skipped"]
+            return
+        if (SCAN_WAIT or self.scheduler.already_running) \
+                and self.iwd.wait_for_scan(SCAN_WAIT_TIMEOUT):
+            self.iwd.invalidate("networks")
+            self.message = TEMPLATES["msg_scan_finished"]
+            return
         self.message = TEMPLATES["msg_scanning"]
 
     def show_active_connection(self, dummy):
         """Show the dialog for connection details"""
-        RofiShowActiveConnection(self.iwd, data="")
-        sys.exit(0)
+        RofiShowActiveConnection(self.iwd.snapshot(("state",)),
+                                 data=self.with_token())
+        self.exit()
 
     def disconnect(self, dummy):
-        """Disconnect and update connection state."""
+        """Disconnect, the disconnected state is assumed (see verify())."""
         self.iwd.disconnect()
-        self.iwd.update_connection_state()
+        self.scheduler.reset()
 
         self.exit_if_combi_mode()
 
@@ -198,19 +394,99 @@ class Main:
         """
         if arg == "#confirm":
             self.iwd.forget(self.iwd.ssid())
-            self.iwd.update_connection_state()
         else:
             msg = Template(TEMPLATES["msg_really_discard"])\
                     .substitute(ssid=self.iwd.ssid())
             RofiConfirmDialog(TEMPLATES["prompt_confirm"],
                               message=msg,
-                              data="",
+                              data=self.with_token(),
                               confirm_caption=TEMPLATES["confirm_discard"],
                               confirm_info="cmd#iwd#forget#confirm",
                               abort_caption=TEMPLATES["back"],
                               abort_info="cmd#iwd#showactiveconnection"
                               )
-            sys.exit(0)
+            self.exit()
+
+    def manage_known_networks(self, arg):
+        """Show the dialog to manage known networks and handle its input.
+
+        The marked networks are passed from one iteration to the next as JSON
+        list in ROFI_DATA (arg), the selected entry is found in ROFI_INFO.
+        """
+        marked = []
+        details_for = None
+        if self.data:
+            try:
+                marked = json.loads(arg)
+            except ValueError:
+                marked = []
+            info = self.info or ""
+            if info == "cmd#known#back":
+                self.data = ""
+                return
+            if info == "cmd#known#forget":
+                self.data = ""
+                self.forget_many(marked)
+                return
+            if info.startswith("cmd#known#toggle"):
+                ssid = info[len("cmd#known#toggle"):]
+                if self.retv == "10":  # kb-custom-1
+                    details_for = ssid
+                elif ssid in marked:
+                    marked.remove(ssid)
+                else:
+                    marked.append(ssid)
+
+        snapshot = self.iwd.snapshot(("known_networks", "networks"))
+        marked = [ssid for ssid in marked if ssid in snapshot.known_networks]
+        # the details are only queried when they are asked for
+        details = None
+        if details_for is not None:
+            details = self.iwd.known_network_details(details_for)
+        RofiKnownNetworks(snapshot, marked, details_for, details,
+                          data=self.with_token("cmd#iwd#knownnetworks"
+                                               + json.dumps(marked)))
+        self.exit()
+
+    def forget_many(self, ssids):
+        """Forget the networks in ssids and set a message summing it up."""
+        failed = self.iwd.forget_many(ssids, FORGET_WORKERS)
+        if failed:
+            self.message = Template(TEMPLATES["msg_forget_failed"])\
+                    .substitute(count=len(ssids) - len(failed),
+                                failed=", ".join(failed))
+        else:
+            self.message = Template(TEMPLATES["msg_forgot"])\
+                    .substitute(count=len(ssids))
+
+    def try_connect(self, ssid, passphrase=None):
+        """Call IWD.connect() with the timeout learned for ssid and record
+        the result in the history and the metrics.
+
+        The timeout is learned from the time iwctl needs, so the history
+        gets the result of iwctl. The time until the network is usable is
+        only measured.
+        """
+        started = time.monotonic()
+        result = self.iwd.connect(ssid, passphrase,
+                                  timeout=self.history.timeout(ssid),
+                                  usable_timeout=USABLE_TIMEOUT)
+        phases = self.iwd.last_connect["phases"]
+        self.history.record(ssid, phases["connect"],
+                            self.iwd.last_connect["connect_result"])
+        logging.info("Phases of connecting to %s (%s): %s", ssid, result.name,
+                     ", ".join(f"{phase} {seconds:.2f}s"
+                               for phase, seconds in phases.items()))
+        if self.metrics is not None:
+            self.metrics.count("iwdrofimenu_connect_results_total",
+                               result=result.name.lower())
+            self.metrics.observe("iwdrofimenu_connect_seconds",
+                                 time.monotonic() - started,
+                                 result=result.name.lower())
+            for phase, seconds in phases.items():
+                self.metrics.observe("iwdrofimenu_connect_phase_seconds",
+                                     seconds, phase=phase)
+        return result
 
     def connect(self, ssid):
         """Connect to a wifi network.
@@ -224,23 +500,32 @@ class Main:
             if self.info == "cmd#abort":
                 self.data = ""
                 return
-            result = self.iwd.connect(ssid, self.arg)
-            if result == IWD.ConnectionResult.SUCCESS:
+            result = self.try_connect(ssid, self.arg)
+            if result in (IWD.ConnectionResult.SUCCESS,
+                          IWD.ConnectionResult.NO_ADDRESS,
+                          IWD.ConnectionResult.NOT_USABLE):
                 self.data = ""  # reset data to get back to main dialog
             else:
                 msg = Template(
                         TEMPLATES["msg_connection_not_successful_after_pass"])\
                                 .substitute(ssid=ssid)
-                RofiPasswordInput(ssid, message=msg)
-                sys.exit()
+                RofiPasswordInput(
+                        ssid, message=msg,
+                        data=self.with_token(f"cmd#iwd#connect{ssid}"))
+                self.exit()
         else:
-            result = self.iwd.connect(ssid)
+            # the list was most likely just shown, so the cached information
+            # tells if a passphrase is needed without asking iwctl
+            self.iwd.snapshot(("known_networks", "networks"),
+                              max_age=CACHE_TTL)
+            result = self.try_connect(ssid)
 
         self.iwd.update_connection_state()
 
         if result == IWD.ConnectionResult.NEED_PASSPHRASE:
-            RofiPasswordInput(ssid)
-            sys.exit(0)
+            RofiPasswordInput(
+                    ssid, data=self.with_token(f"cmd#iwd#connect{ssid}"))
+            self.exit()
 
         if result == IWD.ConnectionResult.SUCCESS:
             template_str = TEMPLATES["msg_connection_successful"]
@@ -249,5 +534,9 @@ class Main:
             template_str = TEMPLATES["msg_connection_not_successful"]
         if result == IWD.ConnectionResult.TIMEOUT:
             template_str = TEMPLATES["msg_connection_timeout"]
+        if result == IWD.ConnectionResult.NO_ADDRESS:
+            template_str = TEMPLATES["msg_connection_no_address"]
+        if result == IWD.ConnectionResult.NOT_USABLE:
+            template_str = TEMPLATES["msg_connection_not_usable"]
         self.message = Template(template_str).substitute(ssid=ssid)
 
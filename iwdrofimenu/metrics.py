@@ -0,0 +1,249 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Cumulative metrics (counters and latency histograms).
+
+During an invocation the values are only collected in memory. flush() adds
+them to a persistent JSON file and writes a file in the Prometheus text
+format, that can be picked up by the textfile collector of node_exporter.
+Both files are replaced atomically.
+"""
+import os
+import json
+import time
+import fcntl
+import subprocess
+from contextlib import contextmanager
+from .backends import Backend
+
+# upper bounds (in seconds) of the histogram buckets
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+HELP = {
+    "iwdrofimenu_command_seconds": "Duration of iwctl and rfkill calls",
+    "iwdrofimenu_command_failures_total": "Failed iwctl and rfkill calls",
+    "iwdrofimenu_connect_seconds": "Duration of connection attempts",
+    "iwdrofimenu_connect_results_total": "Connection attempts by result",
+    "iwdrofimenu_connect_phase_seconds":
+        "Duration of the phases of connection attempts",
+    "iwdrofimenu_flow_seconds": "Duration of an invocation by action",
+}
+
+
+def series(name, labels):
+    """Return the Prometheus series name for name and labels (a dict)"""
+    if not labels:
+        return name
+    label_str = ",".join(f'{key}="{value}"'
+                         for key, value in sorted(labels.items()))
+    return f"{name}{{{label_str}}}"
+
+
+def write_atomic(path, content):
+    """Write content to path by renaming a temporary file"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        file.write(content)
+    os.replace(tmp_path, path)
+
+
+class Metrics:
+    """Collect metrics and add them to the persistent files on flush().
+
+    Example:
+    ========
+
+        metrics = Metrics("~/.local/state/iwdrofimenu/metrics.json",
+                          "/var/lib/node_exporter/iwdrofimenu.prom")
+        with metrics.timer("iwdrofimenu_flow_seconds", flow="list"):
+            ...
+        metrics.flush()
+    """
+    def __init__(self, path, textfile=""):
+        """Constructor.
+
+        Args:
+            path (str): The JSON file holding the cumulative values
+            textfile (str): The file for the Prometheus textfile collector
+                (not written if empty)
+        """
+        self.path = os.path.expanduser(path)
+        self.textfile = os.path.expanduser(textfile) if textfile else ""
+        self.counters = {}
+        self.histograms = {}
+
+    def count(self, name, value=1, **labels):
+        """Increase a counter"""
+        key = series(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """Add a duration to a histogram"""
+        key = series(name, labels)
+        hist = self.histograms.setdefault(
+                key, {"buckets": [0] * len(BUCKETS), "sum": 0, "count": 0})
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                hist["buckets"][i] += 1
+        hist["sum"] += seconds
+        hist["count"] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observe the duration of the with block"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+
+    def merge(self, stored):
+        """Add the collected values to stored (as loaded from the file)"""
+        counters = stored.setdefault("counters", {})
+        for key, value in self.counters.items():
+            counters[key] = counters.get(key, 0) + value
+        histograms = stored.setdefault("histograms", {})
+        for key, hist in self.histograms.items():
+            if key not in histograms:
+                histograms[key] = hist
+                continue
+            old = histograms[key]
+            old["buckets"] = [a + b for a, b in zip(old["buckets"],
+                                                    hist["buckets"])]
+            old["sum"] += hist["sum"]
+            old["count"] += hist["count"]
+        return stored
+
+    def flush(self):
+        """Add the collected values to the files and reset them."""
+        if not self.counters and not self.histograms:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "w", encoding="utf-8") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.path, encoding="utf-8") as file:
+                    stored = json.load(file)
+            except (OSError, ValueError):
+                stored = {}
+            stored = self.merge(stored)
+            write_atomic(self.path, json.dumps(stored))
+            if self.textfile:
+                write_atomic(self.textfile, self.prometheus(stored))
+        self.counters = {}
+        self.histograms = {}
+
+    @staticmethod
+    def prometheus(stored):
+        """Return the stored values in the Prometheus text format"""
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for key, value in sorted(stored.get("counters", {}).items()):
+            describe(key.split("{")[0], "counter")
+            lines.append(f"{key} {value}")
+        for key, hist in sorted(stored.get("histograms", {}).items()):
+            name, _, labels = key.partition("{")
+            labels = labels.rstrip("}")
+            sep = "," if labels else ""
+            describe(name, "histogram")
+            for bound, value in zip(BUCKETS, hist["buckets"]):
+                lines.append(f'{name}_bucket{{{labels}{sep}le="{bound}"}} '
+                             f'{value}')
+            lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} '
+                         f'{hist["count"]}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{name}_sum{suffix} {hist['sum']}")
+            lines.append(f"{name}_count{suffix} {hist['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def subcommand(cmd):
+    """Return a label for cmd without device names, SSIDs and passphrases.
+
+    E.g. "station show" for ["iwctl", "station", "wlan0", "show"]
+    """
+    args = list(cmd[1:])
+    if "--passphrase" in args:
+        i = args.index("--passphrase")
+        del args[i:i + 2]
+    if not args:
+        return os.path.basename(cmd[0])
+    if args[0] in ("station", "device") and len(args) > 2:
+        return f"{args[0]} {args[2]}"
+    if args[0] == "known-networks":
+        return f"known-networks {args[-1]}"
+    words = [arg for arg in args if not arg.startswith("-")]
+    return f"{os.path.basename(cmd[0])} {words[0] if words else 'list'}"
+
+
+class MeteredBackend(Backend):
+    """Wrap a backend and measure every call"""
+    def __init__(self, backend, metrics):
+        self.backend = backend
+        self.metrics = metrics
+
+    def run(self, cmd, timeout=5, env=None):
+        label = subcommand(cmd)
+        try:
+            with self.metrics.timer("iwdrofimenu_command_seconds",
+                                    command=label):
+                result = self.backend.run(cmd, timeout, env)
+        except subprocess.TimeoutExpired:
+            self.metrics.count("iwdrofimenu_command_failures_total",
+                               command=label, reason="timeout")
+            raise
+        if result.returncode != 0:
+            self.metrics.count("iwdrofimenu_command_failures_total",
+                               command=label, reason="exitcode")
+        return result
+
+    def run_many(self, cmds, timeout=5):
+        # the wrapped backend might run them at the same time, so each
+        # command is observed with its own duration if the result has one
+        started = time.monotonic()
+        results = self.backend.run_many(cmds, timeout)
+        elapsed = time.monotonic() - started
+        for cmd, result in zip(cmds, results):
+            label = subcommand(cmd)
+            duration = getattr(result, "duration", None)
+            self.metrics.observe("iwdrofimenu_command_seconds",
+                                 elapsed if duration is None else duration,
+                                 command=label)
+            if getattr(result, "timed_out", False):
+                self.metrics.count("iwdrofimenu_command_failures_total",
+                                   command=label, reason="timeout")
+            elif result.returncode != 0:
+                self.metrics.count("iwdrofimenu_command_failures_total",
+                                   command=label, reason="exitcode")
+        return results
+
+    def probe(self, cmd, prompt, timeout=5):
+        with self.metrics.timer("iwdrofimenu_command_seconds",
+                                command=subcommand(cmd)):
+            return self.backend.probe(cmd, prompt, timeout)
+
+    def respond(self, cmd, prompt, response, timeout=5):
+        with self.metrics.timer("iwdrofimenu_command_seconds",
+                                command=subcommand(cmd)):
+            return self.backend.respond(cmd, prompt, response, timeout)
@@ -0,0 +1,114 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Warm the runtime cache after a resume or when an adapter shows up.
+
+Afterwards the results of the last scan are stale and the cached device
+information might belong to another adapter, so the first menu opened
+would have to query and scan while the user is waiting. prewarm() does
+that in advance. It's meant to be run from a systemd-sleep hook or a udev
+rule (see contrib/).
+"""
+import time
+import logging
+from settings import SCAN_WAIT_TIMEOUT, CACHE_TTL
+from .iwdwrapper import IWD
+from .cache import RuntimeCache
+from .scheduler import ScanScheduler
+from .icons import prepare_icons
+from . import rfkill
+
+
+def marker_key(device):
+    """Return the cache key of the mark prewarm() leaves for device"""
+    return f"prewarmed-{device}"
+
+
+def take_prewarmed_age(cache, device, max_age=CACHE_TTL):
+    """Return the age in seconds the results of the last prewarm() have now,
+    if it finished less than max_age seconds ago (None otherwise).
+
+    The mark is removed, so only the first menu opened after a prewarm
+    starts with its results, the following ones query again as usual.
+    """
+    mark = cache.load(marker_key(device))
+    if mark is None:
+        return None
+    cache.invalidate(marker_key(device))
+    if time.time() - mark["finished"] > max_age:
+        return None
+    return time.time() - mark["started"]
+
+
+def wait_for_device(iwd, timeout, interval=0.5):
+    """Wait until iwd knows the device (e.g. after it was plugged in).
+
+    Returns:
+        True if the device was found, False if the timeout was reached.
+    """
+    deadline = time.monotonic() + timeout
+    while iwd.adapter() is None:
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(interval)
+        iwd.invalidate("device_info", "state")
+        iwd.snapshot(("state", "device_info"))
+    return True
+
+
+def prewarm(device="wlan0", timeout=SCAN_WAIT_TIMEOUT):
+    """Scan, wait for the results and fill the runtime cache with fresh
+    results of all queries (station, networks, known networks, device and
+    rfkill).
+
+    Args:
+        device (str): The network device
+        timeout (float): Maximum time to wait for the device to show up and
+            for the scan to finish (each)
+
+    The first menu opened shortly afterwards uses these results instead
+    of querying again (see take_prewarmed_age()).
+
+    Returns:
+        True if the cache was filled, False if the device was not found.
+    """
+    started = time.time()
+    prepare_icons()
+    cache = RuntimeCache()
+    # nothing in the cache can be trusted, so query everything again
+    iwd = IWD(device, cache=cache)
+    if not wait_for_device(iwd, timeout):
+        logging.warning("Device %s not found", device)
+        return False
+    if rfkill.is_blocked(iwd.adapter(), cache, max_age=0):
+        logging.info("Wifi is disabled, not scanning")
+        return True
+
+    scheduler = ScanScheduler(iwd, cache)
+    scheduler.reset()
+    if scheduler.request(force=True) \
+            and not iwd.wait_for_scan(timeout):
+        logging.warning("Scan didn't finish in %.1fs", timeout)
+    iwd.clear_memo()
+    snapshot = iwd.snapshot(max_age=0)
+    scheduler.observe(snapshot.networks)
+    cache.save(marker_key(device), {"started": started,
+                                    "finished": time.time()})
+    logging.info("Cache filled, %d networks found",
+                 len(snapshot.networks or ()))
+    return True
@@ -0,0 +1,115 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Reuse the output of the network list if nothing changed.
+
+Most of the time the menu is opened, the same networks are shown as the
+last time. The output of the network list is stored in the runtime
+directory together with a hash of everything it's built from (networks,
+connected network, known networks, configuration, message, combi mode).
+If the hash matches, the stored output is written as it is.
+"""
+import json
+import hashlib
+import logging
+from settings import config, ICONS
+
+STATS_KEY = "render-stats"
+
+
+def config_digest():
+    """Return a hash of the configuration as it is used for rendering"""
+    resolved = {section: dict(config[section])
+                for section in config.sections()}
+    resolved["icons"] = ICONS  # paths resolved by prepare_icons()
+    return hashlib.sha1(json.dumps(resolved, sort_keys=True)
+                        .encode("utf-8")).hexdigest()
+
+
+class RenderCache:
+    """Store rendered output in a RuntimeCache.
+
+    Only the last output is kept per slot (e.g. one for the normal list
+    and one for combi mode).
+
+    Example:
+    ========
+
+        renders = RenderCache(RuntimeCache(), "list")
+        key = renders.key(networks, ssid, message)
+        payload = renders.get(key)
+        if payload is None:
+            payload = render()
+            renders.store(key, payload)
+    """
+    def __init__(self, cache, slot, metrics=None):
+        """Constructor.
+
+        Args:
+            cache (RuntimeCache): Where to store the output
+            slot (str): Name of the slot
+            metrics (Metrics): Where hits and misses are counted (default:
+                not counted)
+        """
+        self.cache = cache
+        self.cache_key = f"render-{slot}"
+        self.metrics = metrics
+
+    @staticmethod
+    def key(*inputs):
+        """Return the hash of the inputs (anything JSON serializable, or
+        read-only mappings) and the configuration."""
+        # default=dict serializes the read-only mappings of snapshots
+        content = json.dumps([config_digest(), inputs], sort_keys=True,
+                             default=dict)
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return the stored output for key or None.
+
+        Hits and misses are counted (see count()).
+        """
+        entry = self.cache.load(self.cache_key)
+        hit = entry is not None and entry.get("key") == key
+        self.count(hit)
+        return entry["payload"] if hit else None
+
+    def store(self, key, payload):
+        """Store payload (str) as output for key."""
+        self.cache.save(self.cache_key, {"key": key, "payload": payload})
+
+    def count(self, hit):
+        """Count a hit or miss in the metrics and log the hit rate.
+
+        The totals for the log are kept in the runtime directory, they are
+        only updated if the log message is shown.
+        """
+        result = "hit" if hit else "miss"
+        if self.metrics is not None:
+            self.metrics.count("iwdrofimenu_render_cache_total",
+                               result=result)
+        if not logging.getLogger().isEnabledFor(logging.INFO):
+            return
+        # other invocations count at the same time
+        with self.cache.lock(STATS_KEY):
+            stats = self.cache.load(STATS_KEY) or {"hits": 0, "misses": 0}
+            stats["hits" if hit else "misses"] += 1
+            self.cache.save(STATS_KEY, stats)
+        total = stats["hits"] + stats["misses"]
+        logging.info("Render cache %s (%d hits, %d misses, %.0f%% hit rate)",
+                     result, stats["hits"],
+                     stats["misses"], 100 * stats["hits"] / total)
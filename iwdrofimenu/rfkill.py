@@ -0,0 +1,92 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Query and change the rfkill state of the wifi adapter"""
+import logging
+import subprocess
+from settings import RFKILL_CMD
+from .backends import default_backend
+
+LIST_CMD = [RFKILL_CMD, "-n", "-r"]
+
+
+def run_list(cmd):
+    """Run the rfkill list command (cmd) and return the result"""
+    result = default_backend().run(cmd, env={"LANGUAGE": "en"})
+    # throw an exception on errors
+    result.check_returncode()
+    return result
+
+
+def is_blocked(adapter, cache=None, max_age=0):
+    """Check if wifi is disabled.
+
+    Args:
+        adapter (str): Name of the adapter as found in IWD.adapter()
+        cache (RuntimeCache): If given, a result of rfkill not older than
+            max_age is taken from it.
+        max_age (float): Maximum age of a cached result in seconds.
+
+    Returns:
+        True if wifi is disabled, False if it's enabled and None if the
+        adapter is not found in rfkill's output or rfkill failed.
+    """
+    try:
+        if cache is not None:
+            result = cache.run(LIST_CMD, run_list, max_age=max_age)
+        else:
+            result = run_list(LIST_CMD)
+    except (subprocess.SubprocessError, OSError) as error:
+        logging.warning("Could not query the rfkill state: %s", error)
+        return None
+    for line in result.stdout.split("\n"):
+        if line.find(adapter) != -1:
+            if line.find(" blocked") != -1:
+                return True
+            return False
+    return None
+
+
+def set_blocked(blocked, cache=None):
+    """Block or unblock wifi.
+
+    Args:
+        blocked (bool): True to deactivate wifi, False to activate it.
+        cache (RuntimeCache): If given, the change is serialized with other
+            processes changing the state and the cached rfkill state is
+            removed.
+
+    Returns:
+        (subprocess.CompletedProcess) The result of the rfkill call.
+    """
+    cmd = [RFKILL_CMD, "block" if blocked else "unblock", "wlan"]
+    if cache is None:
+        return run_change(cmd)
+    with cache.lock("mutation"):
+        result = run_change(cmd)
+        cache.invalidate(LIST_CMD)
+    return result
+
+
+def run_change(cmd):
+    """Run the rfkill command cmd changing the state, a failure to run it
+    is returned as failed result."""
+    try:
+        return default_backend().run(cmd)
+    except (subprocess.SubprocessError, OSError) as error:
+        logging.warning("Could not run %s: %s", cmd[0], error)
+        return subprocess.CompletedProcess(cmd, 1, "", str(error))
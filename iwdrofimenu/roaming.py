@@ -0,0 +1,180 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Switch to a better known network when the connection gets poor.
+
+iwd itself only roams between access points of the same network. The
+assistant watches the signal quality of the connection and, if it stays
+poor, looks for a known network that is clearly better. To avoid switching
+back and forth, the better network has to be seen in several consecutive
+checks (hysteresis) and every network is kept for a minimum time after
+connecting to it (dwell time). Every decision is logged.
+"""
+import time
+import logging
+from settings import ROAM_INTERVAL, ROAM_TRIGGER_QUALITY, ROAM_TARGET_QUALITY,\
+        ROAM_MIN_GAIN, ROAM_CHECKS, ROAM_DWELL
+from .iwdwrapper import IWD
+from .cache import RuntimeCache
+from .scheduler import ScanScheduler
+
+
+class RoamingAssistant:
+    """Keep the device connected to the best known network.
+
+    Example:
+    ========
+
+        RoamingAssistant("wlan0").run()
+    """
+    def __init__(self, device="wlan0", interval=ROAM_INTERVAL,
+                 trigger_quality=ROAM_TRIGGER_QUALITY,
+                 target_quality=ROAM_TARGET_QUALITY, min_gain=ROAM_MIN_GAIN,
+                 checks=ROAM_CHECKS, dwell=ROAM_DWELL):
+        """Constructor.
+
+        Args:
+            device (str): device as used in iwctl
+            interval (float): Seconds between two checks
+            trigger_quality (int): Look for other networks if the quality of
+                the connection is this or lower
+            target_quality (int): Minimum quality of a network to switch to
+            min_gain (int): Minimum difference in quality for a switch
+            checks (int): Number of consecutive checks a network has to be
+                the best candidate before switching to it
+            dwell (float): Seconds to stay with a network after connecting
+        """
+        self.interval = interval
+        self.trigger_quality = trigger_quality
+        self.target_quality = target_quality
+        self.min_gain = min_gain
+        self.checks = checks
+        self.dwell = dwell
+        self.cache = RuntimeCache()
+        self.iwd = IWD(device, cache=self.cache, max_age=interval / 2)
+        self.scheduler = ScanScheduler(self.iwd, self.cache)
+        self.current = None
+        """SSID of the network the device is connected to"""
+        self.connected_since = 0
+        self.candidate = None
+        """SSID of the network that was the best candidate last time"""
+        self.streak = 0
+        """Number of consecutive checks the candidate was the best one"""
+
+    def reset_candidate(self):
+        """Forget about the current candidate"""
+        self.candidate = None
+        self.streak = 0
+
+    def best_candidate(self, quality):
+        """Find the known network that is the best alternative.
+
+        Args:
+            quality (int): The quality of the current connection
+
+        Returns:
+            (dict) The network as in IWD.get_networks() or None if no
+            network is good enough.
+        """
+        networks = self.iwd.get_networks()
+        known = self.iwd.update_known_networks()
+        if networks is None or not known:
+            return None
+        candidates = [nw for nw in networks
+                      if nw["ssid"] in known
+                      and nw["ssid"] != self.current
+                      and nw["quality"] >= self.target_quality
+                      and nw["quality"] - quality >= self.min_gain]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda nw: nw["quality"])
+
+    def check(self):
+        """Check the connection once and switch networks if appropriate.
+
+        Returns:
+            True if the device was connected to another network.
+        """
+        self.iwd.clear_memo()
+        self.iwd.update_connection_state()
+        if not self.iwd.connected():
+            if self.current is not None:
+                logging.info("Not connected, nothing to do")
+            self.current = None
+            self.reset_candidate()
+            return False
+
+        now = time.monotonic()
+        ssid = self.iwd.ssid()
+        quality = self.iwd.quality()
+        if ssid != self.current:
+            logging.info("Connected to %s", ssid)
+            self.current = ssid
+            self.connected_since = now
+            self.reset_candidate()
+
+        if quality is None or quality > self.trigger_quality:
+            if self.candidate is not None:
+                logging.info("Quality of %s recovered (%s), stay",
+                             ssid, quality)
+            self.reset_candidate()
+            return False
+        if now - self.connected_since < self.dwell:
+            logging.info("Quality of %s is %d, but connected only %.0fs ago, "
+                         "stay", ssid, quality, now - self.connected_since)
+            return False
+
+        # the scheduler prevents scanning on every check
+        self.scheduler.request()
+        best = self.best_candidate(quality)
+        if self.iwd.networks is not None:
+            self.scheduler.observe(self.iwd.networks)
+        if best is None:
+            logging.info("Quality of %s is %d, no better known network",
+                         ssid, quality)
+            self.reset_candidate()
+            return False
+        if best["ssid"] == self.candidate:
+            self.streak += 1
+        else:
+            self.candidate = best["ssid"]
+            self.streak = 1
+        if self.streak < self.checks:
+            logging.info("Quality of %s is %d, %s has %d (%d/%d checks)",
+                         ssid, quality, best["ssid"], best["quality"],
+                         self.streak, self.checks)
+            return False
+
+        logging.info("Switching from %s (%d) to %s (%d)",
+                     ssid, quality, best["ssid"], best["quality"])
+        self.reset_candidate()
+        result = self.iwd.connect(best["ssid"])
+        if result != IWD.ConnectionResult.SUCCESS:
+            logging.warning("Connecting to %s failed: %s",
+                            best["ssid"], result.name)
+            # don't try the same network again right away
+            self.connected_since = time.monotonic()
+            return False
+        self.current = best["ssid"]
+        self.connected_since = time.monotonic()
+        return True
+
+    def run(self):
+        """Run until interrupted."""
+        while True:
+            self.check()
+            time.sleep(self.interval)
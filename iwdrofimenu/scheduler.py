@@ -0,0 +1,152 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Decide when it's worth to trigger a scan.
+
+Scanning costs battery and airtime and slows down the active connection.
+The scheduler remembers (in the runtime directory) when the last scan was
+triggered and which networks were found, and only lets a scan happen if the
+last one is long enough ago. The automatic rescan interval grows while the
+same networks are found over and over again and is reset after a
+disconnect or a suspend/resume cycle.
+"""
+import time
+import logging
+import zlib
+from settings import SCAN_MIN_INTERVAL, SCAN_INTERVAL, SCAN_MAX_INTERVAL
+
+STATE_KEY = "scan-scheduler"
+
+
+def boot_offset():
+    """Return the time the system spent suspended (+ a constant offset).
+
+    CLOCK_BOOTTIME keeps running during suspend, CLOCK_MONOTONIC doesn't, so
+    the difference grows with every suspend/resume cycle.
+    """
+    return time.clock_gettime(time.CLOCK_BOOTTIME) - time.monotonic()
+
+
+class ScanScheduler:
+    """Rate limit scans of an IWD object.
+
+    Example:
+    ========
+
+        scheduler = ScanScheduler(iwd, RuntimeCache())
+        scheduler.request()            # scan on startup, if it's due
+        scheduler.request(force=True)  # user wants a scan
+        scheduler.observe(iwd.get_networks())
+    """
+    def __init__(self, iwd, cache, min_interval=SCAN_MIN_INTERVAL,
+                 interval=SCAN_INTERVAL, max_interval=SCAN_MAX_INTERVAL):
+        """Constructor.
+
+        Args:
+            iwd (IWD): The IWD object to scan with
+            cache (RuntimeCache): Where to keep the scheduler's state
+            min_interval (float): Minimum time between two scans (seconds)
+            interval (float): Base interval for automatic scans (seconds)
+            max_interval (float): Upper limit for the automatic interval
+        """
+        self.iwd = iwd
+        self.cache = cache
+        self.min_interval = min_interval
+        self.base_interval = interval
+        self.max_interval = max_interval
+        self.state = cache.load(STATE_KEY) or {}
+        self.state.setdefault("last_scan", 0)
+        self.state.setdefault("interval", interval)
+        self.state.setdefault("ssids", None)
+        self.state.setdefault("observed_scan", 0)
+        self.already_running = False
+        """True if the last request() found a scan running already"""
+
+        offset = boot_offset()
+        if abs(offset - self.state.get("boot_offset", offset)) > 1:
+            logging.info("Resumed from suspend, scan sooner")
+            self.reset()
+        self.state["boot_offset"] = offset
+
+    def save(self):
+        """Write the state to the cache"""
+        self.cache.save(STATE_KEY, self.state)
+
+    def reset(self):
+        """Scan sooner after the environment probably changed.
+
+        Call it after a disconnect, it's also done after resume.
+        """
+        self.state["interval"] = self.base_interval
+        self.state["last_scan"] = min(self.state["last_scan"],
+                                      time.time() - self.base_interval)
+        self.save()
+
+    def request(self, force=False):
+        """Trigger a scan if it makes sense.
+
+        Args:
+            force (bool): If True, scan whenever min_interval has passed,
+                otherwise only if the automatic interval has passed. The
+                state is queried again in this case, a cached one might
+                tell about a scan that has finished long ago.
+
+        Returns:
+            True if a scan was triggered or is already running, False if
+            it was refused.
+        """
+        if force:
+            self.iwd.invalidate("state")
+            self.iwd.update_connection_state()
+        self.already_running = bool(self.iwd.scanning())
+        if self.already_running:
+            logging.debug("iwd is already scanning")
+            return True
+        interval = self.state["interval"]
+        if not self.iwd.connected():
+            interval = self.base_interval
+        since = time.time() - self.state["last_scan"]
+        if since < self.min_interval or (not force and since < interval):
+            logging.debug("Last scan %.1fs ago, not scanning", since)
+            return False
+        self.state["last_scan"] = time.time()
+        self.save()
+        return self.iwd.scan()
+
+    def observe(self, networks):
+        """Adapt the automatic interval to the result of the last scan.
+
+        If the same networks are found as after the scan before, the interval
+        is doubled (up to max_interval), otherwise it's reset. Results are
+        only taken into account once per scan.
+
+        Args:
+            networks (list[dict]): As returned by IWD.get_networks()
+        """
+        if networks is None or self.iwd.scanning()\
+                or self.state["observed_scan"] == self.state["last_scan"]:
+            return
+        ssids = zlib.crc32("\n".join(sorted(nw["ssid"] for nw in networks))
+                           .encode("utf-8"))
+        if ssids == self.state["ssids"]:
+            self.state["interval"] = min(self.state["interval"] * 2,
+                                         self.max_interval)
+        else:
+            self.state["interval"] = self.base_interval
+        self.state["ssids"] = ssids
+        self.state["observed_scan"] = self.state["last_scan"]
+        self.save()
@@ -0,0 +1,627 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Simulate iwd and rfkill to test the menu without wifi hardware.
+
+The simulator answers like iwctl and rfkill would, for a station with a
+configurable set of networks. It's run as a replacement for both programs
+on PATH, the state of the simulated device (connection, known networks,
+rfkill, running scan) is kept in a directory, so it changes over several
+invocations just like the real one.
+
+A profile (JSON) describes the networks and the faults to inject:
+
+    {
+        "networks": [{"ssid": "HomeNet", "security": "psk", "rssi": -55,
+                      "passphrase": "secret"},
+                     {"ssid": "Cafe", "security": "open", "rssi": -72}],
+        "known_networks": [{"ssid": "HomeNet", "security": "psk"}],
+        "connected": "HomeNet",
+        "latency": {"default": {"dist": "lognormal", "median": 0.05,
+                                "sigma": 0.5},
+                    "station scan": 0.3},
+        "scan_duration": 3,
+        "busy_during_scan": ["station scan", "station connect"],
+        "hang": {"known-networks list": 0.1},
+        "failures": {"station get-networks": 0.05},
+        "connect_failures": {"Cafe": 1}
+    }
+
+Latencies are given per command ("station show", "known-networks forget",
+"rfkill list", ...) as fixed number of seconds or as distribution
+("fixed", "uniform", "normal" or "lognormal"). hang, failures and
+connect_failures map commands or SSIDs to probabilities. Every call is
+logged to calls.jsonl in the directory.
+
+Set up a directory and put the simulated programs on PATH:
+
+    python -m iwdrofimenu.simulator --dir /tmp/sim --profile slow.json setup
+    export PATH=/tmp/sim/bin:$PATH
+
+The Simulator class does the same for tests and runs the menu against it.
+Note that this module only uses the standard library and doesn't import
+the rest of the package, so the simulated programs start quickly.
+"""
+import os
+import sys
+import json
+import time
+import fcntl
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+from contextlib import contextmanager
+
+DEFAULT_PROFILE = {
+    "device": "wlan0",
+    "adapter": "phy0",
+    "networks": [
+        {"ssid": "HomeNet", "security": "psk", "rssi": -55,
+         "passphrase": "secret"},
+        {"ssid": "Cafe", "security": "open", "rssi": -72},
+        {"ssid": "Office", "security": "8021x", "rssi": -64},
+    ],
+    "known_networks": [
+        {"ssid": "HomeNet", "security": "psk",
+         "last_connected": "Oct 1, 10:10 AM"},
+    ],
+    "connected": None,
+    "blocked": False,
+    "hard_blocked": False,
+    "seed": None,
+    "latency": {"default": 0},
+    "rssi_jitter": 0,
+    "scan_duration": 2,
+    "busy_during_scan": ["station scan"],
+    "hang": {},
+    "hang_seconds": 3600,
+    "failures": {},
+    "connect_failures": {},
+}
+"""Used for everything missing in a profile"""
+
+# same thresholds as in iwdwrapper, the module is not imported here
+RSSI_STARS = [(-60, 4), (-67, 3), (-75, 2)]
+
+HEADER_LINE = "-" * 80
+
+MENU_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "iwdrofimenu.py")
+
+
+def command_label(program, args):
+    """Return the command without device names, SSIDs and options.
+
+    E.g. "station show" for "iwctl station wlan0 show", like the labels of
+    the metrics module.
+    """
+    words = [arg for arg in args if not arg.startswith("-")]
+    if program == "rfkill":
+        return f"rfkill {words[0] if words else 'list'}"
+    if words and words[0] in ("station", "device") and len(words) > 2:
+        return f"{words[0]} {words[2]}"
+    if words and words[0] == "known-networks":
+        return f"known-networks {words[-1]}"
+    return " ".join(["iwctl"] + words[:1])
+
+
+def sample_latency(spec, rng):
+    """Return a latency in seconds drawn from spec (see module docstring)"""
+    if isinstance(spec, (int, float)):
+        return spec
+    dist = spec.get("dist", "fixed")
+    if dist == "uniform":
+        value = rng.uniform(spec["min"], spec["max"])
+    elif dist == "normal":
+        value = rng.gauss(spec["mean"], spec["stddev"])
+    elif dist == "lognormal":
+        value = spec["median"] * rng.lognormvariate(0, spec["sigma"])
+    else:
+        value = spec["value"]
+    return max(value, 0)
+
+
+def stars(rssi):
+    """Return the number of stars iwctl shows for rssi (in dBm)"""
+    for threshold, count in RSSI_STARS:
+        if rssi >= threshold:
+            return count
+    return 1
+
+
+def table(title, header, rows):
+    """Return a table formatted like iwctl does (header lines included)"""
+    return "\n".join(["", f"{title:^80}".rstrip(), HEADER_LINE, header,
+                      HEADER_LINE] + rows + ["", ""])
+
+
+def property_table(title, properties):
+    """Return a property table like "iwctl station <device> show" prints
+    it. properties is a list of (settable, name, value) tuples."""
+    return table(title, "  Settable  Property              Value",
+                 [f"{'*' if settable else '':>11}  {name:<22}{value}"
+                  for settable, name, value in properties])
+
+
+class SimulatedDevice:
+    """The state of the simulated device and the commands changing it.
+
+    Example:
+    ========
+
+        device = SimulatedDevice("/tmp/sim")
+        returncode, output = device.run("iwctl", ["station", "wlan0",
+                                                  "show"])
+    """
+    def __init__(self, directory):
+        """Constructor.
+
+        Args:
+            directory (str): Holds profile.json, the state and the log.
+        """
+        self.directory = directory
+        self.profile = dict(DEFAULT_PROFILE)
+        try:
+            with open(os.path.join(directory, "profile.json"),
+                      encoding="utf-8") as file:
+                self.profile.update(json.load(file))
+        except FileNotFoundError:
+            pass
+        self.state_path = os.path.join(directory, "state.json")
+        self.rng = random.Random()
+
+    def initial_state(self):
+        """Return the state described by the profile"""
+        return {
+            "calls": 0,
+            "connected": self.profile["connected"],
+            "blocked": self.profile["blocked"],
+            "hard_blocked": self.profile["hard_blocked"],
+            "scan_until": 0,
+            "networks": self.profile["networks"],
+            "known_networks": [dict({"last_connected": "Jan 1, 12:00 AM",
+                                     "hidden": False}, **known)
+                               for known in self.profile["known_networks"]],
+        }
+
+    @contextmanager
+    def locked_state(self):
+        """Lock the state and yield it, changes are saved afterwards"""
+        with open(self.state_path + ".lock", "w", encoding="utf-8") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.state_path, encoding="utf-8") as file:
+                    state = json.load(file)
+            except (OSError, ValueError):
+                state = self.initial_state()
+            yield state
+            tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(state, file)
+            os.replace(tmp_path, self.state_path)
+
+    def log(self, entry):
+        """Append entry to the call log"""
+        with open(os.path.join(self.directory, "calls.jsonl"), "a",
+                  encoding="utf-8") as file:
+            file.write(json.dumps(entry) + "\n")
+
+    def chance(self, probabilities, key):
+        """Return True with the probability given for key"""
+        return self.rng.random() < probabilities.get(key, 0)
+
+    def run(self, program, args, stdin=sys.stdin):
+        """Run a simulated command.
+
+        Args:
+            program (str): "iwctl" or "rfkill"
+            args (list[str]): Its arguments
+            stdin (file): Where a passphrase is read from if iwctl asks for
+                one
+
+        Returns:
+            A tuple (returncode, output).
+        """
+        started = time.time()
+        label = command_label(program, args)
+        with self.locked_state() as state:
+            call = state["calls"]
+            state["calls"] += 1
+        if self.profile["seed"] is not None:
+            self.rng.seed(f"{self.profile['seed']}:{call}")
+        entry = {"time": started, "program": program, "command": label,
+                 "args": redact(args)}
+
+        if self.chance(self.profile["hang"], label):
+            self.log(dict(entry, hung=True))
+            time.sleep(self.profile["hang_seconds"])
+            return 1, ""
+        latency = self.profile["latency"]
+        time.sleep(sample_latency(latency.get(label, latency.get("default",
+                                                                  0)),
+                                  self.rng))
+
+        with self.locked_state() as state:
+            if program == "rfkill":
+                returncode, output = self.rfkill(state, args)
+            else:
+                returncode, output = self.iwctl(state, args, label)
+        if returncode == "prompt":
+            # ask without holding the lock, like iwctl waits for the user
+            sys.stdout.write("Passphrase: ")
+            sys.stdout.flush()
+            passphrase = stdin.readline().rstrip("\n")
+            with self.locked_state() as state:
+                returncode, output = self.connect(state, output, passphrase)
+
+        self.log(dict(entry, returncode=returncode,
+                      duration=time.time() - started))
+        return returncode, output
+
+    def iwctl(self, state, args, label):
+        """Run an iwctl command on state"""
+        passphrase = None
+        if args[:1] == ["--passphrase"]:
+            passphrase = args[1]
+            args = args[2:]
+        args = [arg for arg in args if not arg.startswith("--")]
+        device = self.profile["device"]
+        scanning = time.time() < state["scan_until"]
+
+        if self.chance(self.profile["failures"], label):
+            return 1, "Operation failed\n"
+        if scanning and label in self.profile["busy_during_scan"]:
+            return 1, "Operation already in progress\n"
+        if args[:1] == ["known-networks"]:
+            return self.known_networks(state, args[1:])
+        if len(args) < 3 or args[:2] not in (["station", device],
+                                             ["device", device]):
+            return 1, "Invalid command\n"
+        if args[0] == "device":
+            return 0, property_table(f"Device: {device}", [
+                (False, "Name", device),
+                (False, "Mode", "station"),
+                (True, "Powered", "off" if state["blocked"] else "on"),
+                (False, "Adapter", self.profile["adapter"]),
+            ])
+        if state["blocked"]:
+            return 1, f"No station on device: '{device}'\n"
+
+        command = args[2]
+        if command == "show":
+            properties = [(False, "Scanning", "yes" if scanning else "no"),
+                          (False, "State", "connected" if state["connected"]
+                           else "disconnected")]
+            network = self.network(state, state["connected"])
+            if network is not None:
+                properties += [(False, "Connected network", network["ssid"]),
+                               (False, "RSSI", f"{self.rssi(network)} dBm")]
+            return 0, property_table(f"Station: {device}", properties)
+        if command == "get-networks":
+            return 0, self.network_list(state, "rssi-dbms" in args)
+        if command == "scan":
+            if not scanning:
+                state["scan_until"] = time.time() \
+                    + self.profile["scan_duration"]
+            return 0, ""
+        if command == "disconnect":
+            state["connected"] = None
+            return 0, ""
+        if command == "connect" and len(args) > 3:
+            return self.connect(state, args[3], passphrase)
+        return 1, "Invalid command\n"
+
+    def network(self, state, ssid):
+        """Return the network ssid or None if it's not in range"""
+        for network in state["networks"]:
+            if network["ssid"] == ssid:
+                return network
+        return None
+
+    def known_network(self, state, ssid):
+        """Return the known network ssid or None"""
+        for known in state["known_networks"]:
+            if known["ssid"] == ssid:
+                return known
+        return None
+
+    def rssi(self, network):
+        """Return the RSSI of network, with the jitter of the profile"""
+        jitter = self.profile["rssi_jitter"]
+        return round(network["rssi"] + (self.rng.gauss(0, jitter)
+                                        if jitter else 0))
+
+    def network_list(self, state, dbms=False):
+        """Return the output of get-networks"""
+        rows = []
+        for network in sorted(state["networks"], key=lambda nw: -nw["rssi"]):
+            rssi = self.rssi(network)
+            signal = str(rssi) if dbms else "*" * stars(rssi)
+            marker = "\x1b[1;90m> \x1b[0m" \
+                if network["ssid"] == state["connected"] else "  "
+            rows.append(f"  {marker}{network['ssid']:<34}"
+                        f"{network['security']:<20}{signal}")
+        return table("Available networks",
+                     "      Network name                      Security"
+                     "            Signal", rows)
+
+    def connect(self, state, ssid, passphrase=None):
+        """Connect to ssid.
+
+        Returns ("prompt", ssid) if iwctl would ask for a passphrase.
+        """
+        network = self.network(state, ssid)
+        if network is None:
+            return 1, "Network not found\n"
+        known = self.known_network(state, ssid)
+        if known is None:
+            if network["security"] == "8021x":
+                return 1, "Not configured\n"
+            if network["security"] != "open":
+                if passphrase is None:
+                    return "prompt", ssid
+                if passphrase != network.get("passphrase"):
+                    return 1, "Operation failed\n"
+        if self.chance(self.profile["connect_failures"], ssid):
+            return 1, "Operation failed\n"
+        if known is None:
+            known = {"ssid": ssid, "security": network["security"],
+                     "hidden": False}
+            state["known_networks"].append(known)
+        known["last_connected"] = time.strftime("%b %d, %I:%M %p")
+        state["connected"] = ssid
+        return 0, ""
+
+    def known_networks(self, state, args):
+        """Run a known-networks command"""
+        if args == ["list"]:
+            rows = [f"      {known['ssid']:<34}{known['security']:<13}"
+                    f"{'yes' if known.get('hidden') else '':<9}"
+                    f"{known['last_connected']}"
+                    for known in state["known_networks"]]
+            return 0, table("Known Networks",
+                            "      Name                              "
+                            "Security     Hidden   Last connected", rows)
+        if len(args) != 2:
+            return 1, "Invalid command\n"
+        known = self.known_network(state, args[0])
+        if known is None:
+            return 1, "Invalid network name\n"
+        if args[1] == "show":
+            return 0, property_table(f"Known Network: {known['ssid']}", [
+                (False, "Name", known["ssid"]),
+                (False, "Security", known["security"]),
+                (False, "Hidden", "yes" if known.get("hidden") else "no"),
+                (True, "AutoConnect", "yes"),
+            ])
+        if args[1] == "forget":
+            state["known_networks"].remove(known)
+            if state["connected"] == known["ssid"]:
+                state["connected"] = None
+            return 0, ""
+        return 1, "Invalid command\n"
+
+    def rfkill(self, state, args):
+        """Run an rfkill command on state"""
+        words = [arg for arg in args if not arg.startswith("-")]
+        if not words:
+            soft = "blocked" if state["blocked"] else "unblocked"
+            hard = "blocked" if state["hard_blocked"] else "unblocked"
+            return 0, f"0 wlan {self.profile['adapter']} {soft} {hard}\n"
+        if words[0] in ("block", "unblock"):
+            state["blocked"] = words[0] == "block" or state["hard_blocked"]
+            if state["blocked"]:
+                state["connected"] = None
+                state["scan_until"] = 0
+            return 0, ""
+        return 1, f"rfkill: unknown command '{words[0]}'\n"
+
+
+def redact(args):
+    """Return args with the value of --passphrase replaced"""
+    args = list(args)
+    for i, arg in enumerate(args[:-1]):
+        if arg == "--passphrase":
+            args[i + 1] = "***"
+    return args
+
+
+def setup(directory, profile=None):
+    """Create the simulator directory with the simulated programs.
+
+    Args:
+        directory (str): Where to create it (it may exist)
+        profile (dict): The profile, the existing one (if any) is kept if
+            it's None
+
+    Returns:
+        (str) The directory to put on PATH.
+    """
+    directory = os.path.abspath(directory)
+    bin_dir = os.path.join(directory, "bin")
+    os.makedirs(bin_dir, exist_ok=True)
+    if profile is not None:
+        with open(os.path.join(directory, "profile.json"), "w",
+                  encoding="utf-8") as file:
+            json.dump(profile, file, indent=4)
+    for program in ("iwctl", "rfkill"):
+        path = os.path.join(bin_dir, program)
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(f'#!/bin/sh\nexec "{sys.executable}" '
+                       f'"{os.path.abspath(__file__)}" --dir "{directory}" '
+                       f'{program} "$@"\n')
+        os.chmod(path, 0o755)
+    # start with the state described by the profile
+    for name in ("state.json", "calls.jsonl"):
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+    return bin_dir
+
+
+class Simulator:
+    """Run the menu against the simulated programs (e.g. in tests).
+
+    Each simulator gets its own directory with the programs, the state, a
+    runtime directory and a home directory, so no user configuration is
+    read (only the one passed as config).
+
+    Example:
+    ========
+
+        # iwctl hangs when scanning, the list is shown after its timeout
+        profile = {"latency": {"default": 0.2}, "hang": {"station scan": 1}}
+        with Simulator(profile, config={"usable_timeout": 0}) as sim:
+            result, seconds = sim.run_menu()
+            assert result.returncode == 0 and seconds < 10
+            sim.run_menu(arg="Cafe", info="cmd#iwd#connectCafe", retv="1")
+            assert sim.state()["connected"] == "Cafe"
+            print(sim.calls())
+    """
+    def __init__(self, profile=None, directory=None, config=None):
+        """Constructor.
+
+        Args:
+            profile (dict): The profile (see module docstring)
+            directory (str): Directory to use, a temporary one is created
+                (and removed afterwards) if it's None
+            config (dict): Options of the general section of the menu's
+                configuration (e.g. {"usable_timeout": 0})
+        """
+        self.profile = profile or {}
+        self.config = config or {}
+        self.directory = directory
+        self.temporary = directory is None
+        self.bin_dir = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """Set up the directory"""
+        if self.temporary:
+            self.directory = tempfile.mkdtemp(prefix="iwdrofimenu-sim-")
+        self.bin_dir = setup(self.directory, self.profile)
+        for name in ("home", "runtime", "state"):
+            os.makedirs(os.path.join(self.directory, name), exist_ok=True)
+        config_dir = os.path.join(self.directory, "home", ".config")
+        os.makedirs(config_dir, exist_ok=True)
+        with open(os.path.join(config_dir, "iwdrofimenu.conf"), "w",
+                  encoding="utf-8") as file:
+            file.write("[general]\n" + "".join(
+                f"{name} = {value}\n" for name, value in self.config.items()))
+
+    def stop(self):
+        """Remove the directory if it's a temporary one"""
+        if self.temporary and self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def env(self, base=None):
+        """Return an environment running the menu against the simulator"""
+        env = dict(os.environ if base is None else base)
+        env.update(PATH=self.bin_dir + os.pathsep + env.get("PATH", ""),
+                   HOME=os.path.join(self.directory, "home"),
+                   XDG_RUNTIME_DIR=os.path.join(self.directory, "runtime"),
+                   XDG_STATE_HOME=os.path.join(self.directory, "state"))
+        for name in ("ROFI_RETV", "ROFI_INFO", "ROFI_DATA",
+                     "XDG_CONFIG_HOME", "XDG_CACHE_HOME"):
+            env.pop(name, None)
+        return env
+
+    def run_menu(self, *options, arg="", info=None, data=None, retv=None,
+                 timeout=60):
+        """Run the menu once, like rofi does.
+
+        Args:
+            options (str): Command line options (e.g. "--combi-mode")
+            arg (str): The selected entry (as passed by rofi)
+            info, data, retv (str): ROFI_INFO, ROFI_DATA and ROFI_RETV
+
+        Returns:
+            A tuple (subprocess.CompletedProcess, duration in seconds).
+        """
+        env = self.env()
+        for name, value in (("ROFI_INFO", info), ("ROFI_DATA", data),
+                            ("ROFI_RETV", retv)):
+            if value is not None:
+                env[name] = value
+        cmd = [sys.executable, MENU_SCRIPT, *options]
+        if arg:
+            cmd.append(arg)
+        started = time.monotonic()
+        result = subprocess.run(cmd, env=env, capture_output=True,
+                                text=True, timeout=timeout, check=False)
+        return result, time.monotonic() - started
+
+    def state(self):
+        """Return the current state of the simulated device"""
+        with SimulatedDevice(self.directory).locked_state() as state:
+            return state
+
+    def set_state(self, **changes):
+        """Change the state from outside (e.g. a network out of range)"""
+        with SimulatedDevice(self.directory).locked_state() as state:
+            state.update(changes)
+
+    def calls(self):
+        """Return the logged calls as list of dictionaries"""
+        try:
+            with open(os.path.join(self.directory, "calls.jsonl"),
+                      encoding="utf-8") as file:
+                return [json.loads(line) for line in file if line.strip()]
+        except FileNotFoundError:
+            return []
+
+
+def main(argv=None):
+    """Command line interface (see module docstring)"""
+    parser = argparse.ArgumentParser(
+            prog="python -m iwdrofimenu.simulator",
+            description="Simulate iwctl and rfkill.")
+    parser.add_argument("--dir", default=".",
+                        help="directory holding the state")
+    parser.add_argument("--profile", help="profile to set up with (JSON)")
+    parser.add_argument("program", choices=["setup", "iwctl", "rfkill"])
+    parser.add_argument("args", nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+
+    if args.program == "setup":
+        profile = None
+        if args.profile:
+            with open(args.profile, encoding="utf-8") as file:
+                profile = json.load(file)
+        bin_dir = setup(args.dir, profile)
+        print(f"export PATH={bin_dir}:$PATH")
+        return 0
+
+    returncode, output = SimulatedDevice(args.dir).run(args.program,
+                                                       args.args)
+    sys.stdout.write(output)
+    return returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main())
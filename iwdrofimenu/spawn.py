@@ -0,0 +1,238 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Run short commands like iwctl and rfkill as cheap as possible.
+
+Every invocation of the script runs several commands, so the cost of
+starting them adds up. Compared to subprocess.run() the spawn() function
+
+- starts the process with os.posix_spawn(), which uses vfork-like
+  spawning instead of copying the whole process,
+- looks up the path of an executable only once per process,
+- passes a small prebuilt environment (C locale, no colors) instead of a
+  copy of the whole environment and
+- decodes the output only when it's actually accessed.
+
+The time needed to start the processes and to run them is logged and
+summed up in stats.
+"""
+import os
+import time
+import shutil
+import logging
+import selectors
+import subprocess
+
+# variables passed from the environment of the script
+PASSED_VARIABLES = ("PATH", "DBUS_SYSTEM_BUS_ADDRESS")
+
+BASE_ENV = {name: os.environ[name] for name in PASSED_VARIABLES
+            if name in os.environ}
+BASE_ENV.update({"LC_ALL": "C.UTF-8",  # C locale, but keep UTF-8 SSIDs
+                 "LANG": "C.UTF-8",
+                 "NO_COLOR": "1"})
+
+stats = {"spawns": 0, "spawn_seconds": 0.0, "run_seconds": 0.0}
+"""Number of spawned processes, the time it took to start them and the time
+until they finished (both in seconds)"""
+
+_paths = {}
+
+
+def which(name):
+    """Return the path of the executable name (cached) or None"""
+    if "/" in name:
+        return name
+    if name not in _paths:
+        _paths[name] = shutil.which(name, path=BASE_ENV.get("PATH"))
+    return _paths[name]
+
+
+class LazyResult(subprocess.CompletedProcess):
+    """A CompletedProcess that decodes stdout and stderr on first access."""
+
+    timed_out = False
+    """True if the process was killed because of the timeout"""
+
+    duration = None
+    """Seconds from starting the process until its output was closed"""
+
+    @property
+    def stdout(self):
+        if isinstance(self._stdout, bytes):
+            self._stdout = self._stdout.decode("utf-8", "replace")
+        return self._stdout
+
+    @stdout.setter
+    def stdout(self, value):
+        self._stdout = value
+
+    @property
+    def stderr(self):
+        if isinstance(self._stderr, bytes):
+            self._stderr = self._stderr.decode("utf-8", "replace")
+        return self._stderr
+
+    @stderr.setter
+    def stderr(self, value):
+        self._stderr = value
+
+
+def read_all(fds, deadline):
+    """Read from the file descriptors fds until they are all closed or the
+    deadline (time.monotonic()) is reached.
+
+    Returns:
+        A tuple (output, pending, closed). output is a dictionary with the
+        data read from each file descriptor, pending the set of file
+        descriptors that were still open at the deadline and closed a
+        dictionary with the time each of the others was closed.
+    """
+    output = {fd: [] for fd in fds}
+    closed = {}
+    with selectors.DefaultSelector() as selector:
+        for fd in fds:
+            selector.register(fd, selectors.EVENT_READ)
+        while selector.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for key, _ in selector.select(remaining):
+                chunk = os.read(key.fd, 65536)
+                if chunk:
+                    output[key.fd].append(chunk)
+                else:
+                    selector.unregister(key.fd)
+                    closed[key.fd] = time.monotonic()
+        pending = set(selector.get_map())
+    return ({fd: b"".join(chunks) for fd, chunks in output.items()}, pending,
+            closed)
+
+
+def start(cmd, env):
+    """Start cmd with stdout and stderr connected to pipes.
+
+    Returns:
+        A tuple (pid, stdout fd, stderr fd, time the process was started).
+    """
+    path = which(cmd[0])
+    if path is None:
+        raise FileNotFoundError(f"Command not found: {cmd[0]}")
+
+    # pipes are created non-inheritable, only the dup2'ed ends are passed
+    out_read, out_write = os.pipe()
+    err_read, err_write = os.pipe()
+    try:
+        pid = os.posix_spawn(path, cmd, env, file_actions=[
+            (os.POSIX_SPAWN_OPEN, 0, os.devnull, os.O_RDONLY, 0),
+            (os.POSIX_SPAWN_DUP2, out_write, 1),
+            (os.POSIX_SPAWN_DUP2, err_write, 2),
+            ])
+    except OSError:
+        os.close(out_read)
+        os.close(err_read)
+        raise
+    finally:
+        os.close(out_write)
+        os.close(err_write)
+    return pid, out_read, err_read, time.monotonic()
+
+
+def spawn_many(cmds, timeout=5, env=None):
+    """Run several commands at the same time and return their results.
+
+    All commands are started first, then the output of all of them is read
+    at once.
+
+    Args:
+        cmds (list[list[str]]): The commands
+        timeout (float): Timeout in seconds for all of them together
+        env (dict): Additional environment variables (on top of BASE_ENV)
+
+    Returns:
+        (list[LazyResult]) The results in the order of cmds. Processes still
+        running when the timeout is reached are killed, their results have
+        timed_out set and the return code -9. The others are kept.
+
+    Raises:
+        FileNotFoundError if a command is not found.
+    """
+    started = time.monotonic()
+    env = dict(BASE_ENV, **env) if env else BASE_ENV
+    procs = []
+    try:
+        for cmd in cmds:
+            procs.append(start(cmd, env))
+        output, pending, closed = read_all(
+                [fd for _, out_fd, err_fd, _ in procs
+                 for fd in (out_fd, err_fd)],
+                started + timeout)
+    finally:
+        for _, out_fd, err_fd, _ in procs:
+            os.close(out_fd)
+            os.close(err_fd)
+        if len(procs) < len(cmds):  # starting one of them failed
+            for pid, _, _, _ in procs:
+                os.kill(pid, 9)
+                os.waitpid(pid, 0)
+    results = []
+    spawn_started = started
+    for cmd, (pid, out_fd, err_fd, spawned) in zip(cmds, procs):
+        timed_out = out_fd in pending or err_fd in pending
+        if timed_out:
+            os.kill(pid, 9)
+            logging.debug("spawn %s: timed out after %.1fs", cmd[0], timeout)
+        _, status = os.waitpid(pid, 0)
+        finished = time.monotonic()
+        stats["spawns"] += 1
+        stats["spawn_seconds"] += spawned - spawn_started
+        stats["run_seconds"] += finished - started
+        logging.debug("spawn %s: started in %.2fms, finished after %.2fms",
+                      cmd[0], 1000 * (spawned - spawn_started),
+                      1000 * (finished - started))
+        spawn_started = spawned
+        result = LazyResult(cmd, os.waitstatus_to_exitcode(status),
+                            output[out_fd], output[err_fd])
+        result.timed_out = timed_out
+        result.duration = max(closed.get(out_fd, finished),
+                              closed.get(err_fd, finished)) - spawned
+        results.append(result)
+    return results
+
+
+def spawn(cmd, timeout=5, env=None):
+    """Run cmd and return its result, like subprocess.run() with
+    capture_output=True and text=True.
+
+    Args:
+        cmd (list[str]): The command and its arguments
+        timeout (float): Timeout in seconds
+        env (dict): Additional environment variables (on top of BASE_ENV)
+
+    Returns:
+        (LazyResult) The result.
+
+    Raises:
+        FileNotFoundError if the command is not found.
+        subprocess.TimeoutExpired if the timeout was reached, the process
+        is killed in this case.
+    """
+    result = spawn_many([cmd], timeout, env)[0]
+    if result.timed_out:
+        raise subprocess.TimeoutExpired(cmd, timeout, result.stdout,
+                                        result.stderr)
+    return result
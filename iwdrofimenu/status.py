@@ -0,0 +1,95 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Machine-readable status output for status bars and scripts.
+
+The status is answered from the runtime cache the menu fills, so many
+pollers running at the same time share the same iwctl queries.
+"""
+import json
+from string import Template
+from settings import TEMPLATES, SIGNAL_QUALITY_TEXT, CACHE_TTL
+from .iwdwrapper import IWD
+from .cache import RuntimeCache
+from . import rfkill
+
+
+def get_status(iwd, blocked):
+    """Collect the status information in a dictionary.
+
+    Args:
+        iwd (IWD): IWD object with an up to date state property.
+        blocked (bool): rfkill state of the adapter (None if unknown)
+
+    Returns:
+        A dictionary with the entries "device", "state", "ssid", "quality",
+        "rssi" and "blocked".
+    """
+    if blocked:
+        state = "disabled"
+    elif iwd.state is None:
+        state = "unavailable"
+    else:
+        state = iwd.get_state("State")
+    return {"device": iwd.device,
+            "state": state,
+            "ssid": iwd.ssid(),
+            "quality": iwd.quality(),
+            "rssi": iwd.rssi(),
+            "blocked": blocked,
+            }
+
+
+def format_status(status, fmt="text"):
+    """Format the status dictionary as returned by get_status().
+
+    Args:
+        status (dict): The status
+        fmt (str): "json" or "text". The text is built from the status_*
+            templates.
+
+    Returns:
+        (str) The formatted status.
+    """
+    if fmt == "json":
+        return json.dumps(status)
+    if status["state"] == "connected":
+        quality = status["quality"]
+        return Template(TEMPLATES["status_connected"]).substitute(
+                ssid=status["ssid"],
+                quality=quality or "",
+                quality_str=SIGNAL_QUALITY_TEXT.get(quality, ""))
+    if status["state"] == "disabled":
+        return TEMPLATES["status_disabled"]
+    if status["state"] == "unavailable":
+        return TEMPLATES["status_unavailable"]
+    return TEMPLATES["status_disconnected"]
+
+
+def print_status(device="wlan0", fmt="text", max_age=CACHE_TTL):
+    """Print the status of device to stdout.
+
+    Cached query results not older than max_age seconds are used, only
+    stale results are queried again (and shared through the cache).
+    """
+    cache = RuntimeCache()
+    iwd = IWD(device, cache=cache, max_age=max_age)
+    adapter = iwd.adapter()
+    blocked = None
+    if adapter is not None:
+        blocked = rfkill.is_blocked(adapter, cache, max_age=max_age)
+    print(format_status(get_status(iwd, blocked), fmt))
@@ -0,0 +1,230 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Site survey: scan on a fixed cadence and log what's seen to SQLite.
+
+Every scan is a row in the scans table, every network seen in it a row in
+the samples table (with the RSSI in dBm if iwctl can tell it, otherwise
+only the number of stars). The samples are kept in memory only until the
+next batch is written, a batch is written in a single transaction and the
+database is in WAL mode, so sampling for hours costs neither memory nor
+many disk syncs.
+
+report() sums the samples up per SSID for a time range: in which share of
+the scans the network was seen and how strong.
+"""
+import os
+import time
+import sqlite3
+import logging
+from settings import SURVEY_FILE, SURVEY_INTERVAL, SURVEY_BATCH
+from .iwdwrapper import IWD
+from .cache import RuntimeCache
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    duration REAL NOT NULL,
+    connected TEXT
+);
+CREATE TABLE IF NOT EXISTS samples (
+    scan INTEGER NOT NULL REFERENCES scans(id),
+    time REAL NOT NULL,
+    ssid TEXT NOT NULL,
+    security TEXT NOT NULL,
+    rssi INTEGER,
+    quality INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scans_time ON scans (time);
+CREATE INDEX IF NOT EXISTS samples_ssid_time ON samples (ssid, time);
+CREATE INDEX IF NOT EXISTS samples_time ON samples (time);
+"""
+
+
+def connect_db(path):
+    """Open (and create) the survey database at path"""
+    path = os.path.expanduser(path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    # in WAL mode a crash can only lose the last transactions
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(SCHEMA)
+    return db
+
+
+class Survey:
+    """Scan on a fixed cadence and write the results to the database.
+
+    Example:
+    ========
+
+        Survey("wlan0", "survey.sqlite", interval=5).run()
+        print(format_report(report("survey.sqlite", since=time.time() - 600)))
+    """
+    def __init__(self, device="wlan0", path=SURVEY_FILE,
+                 interval=SURVEY_INTERVAL, batch=SURVEY_BATCH):
+        """Constructor.
+
+        Args:
+            device (str): device as used in iwctl
+            path (str): The SQLite database
+            interval (float): Seconds from the start of one scan to the
+                start of the next one
+            batch (int): Number of scans written in one transaction
+        """
+        self.interval = interval
+        self.batch = batch
+        self.db = connect_db(path)
+        # the results are shared with the menu through the cache
+        self.iwd = IWD(device, cache=RuntimeCache())
+        self.rssi_supported = True
+        """False if iwctl can't show the RSSI in dBm"""
+        self.scans = []
+        """Scans not written yet, a tuple (time, duration, connected, networks)
+        each"""
+
+    def sample(self):
+        """Scan, wait for the result and add it to the pending scans.
+
+        The RSSI is only given up on if iwctl rejects the rssi-dbms
+        argument, if listing the networks fails otherwise the scan is
+        skipped.
+        """
+        started = time.time()
+        self.iwd.scan()
+        self.iwd.wait_for_scan(timeout=max(self.interval, 1))
+        networks = None
+        if self.rssi_supported:
+            networks = self.iwd.get_networks_rssi(max_age=0)
+            if networks is None:
+                result = self.iwd.last_result
+                if "invalid" not in (result.stdout + result.stderr).lower():
+                    # busy, timed out, ... the next scan might work
+                    logging.warning("Could not list the networks, skipping "
+                                    "this scan")
+                    self.iwd.clear_memo()
+                    return
+                logging.info("iwctl can't show the RSSI in dBm, "
+                             "recording the quality only")
+                self.rssi_supported = False
+        if networks is None:
+            networks = self.iwd.get_networks(max_age=0) or []
+        self.scans.append((started, time.time() - started, self.iwd.ssid(),
+                           networks))
+        # the next scan is independent of this one
+        self.iwd.clear_memo()
+
+    def flush(self):
+        """Write the pending scans in a single transaction."""
+        if not self.scans:
+            return
+        with self.db:
+            for started, duration, connected, networks in self.scans:
+                scan_id = self.db.execute(
+                        "INSERT INTO scans (time, duration, connected) "
+                        "VALUES (?, ?, ?)",
+                        (started, duration, connected)).lastrowid
+                self.db.executemany(
+                        "INSERT INTO samples (scan, time, ssid, security, "
+                        "rssi, quality) VALUES (?, ?, ?, ?, ?, ?)",
+                        [(scan_id, started, nw["ssid"], nw["security"],
+                          nw.get("rssi"), nw["quality"])
+                         for nw in networks])
+        logging.info("Wrote %d scans", len(self.scans))
+        self.scans = []
+
+    def run(self, duration=None):
+        """Sample until interrupted (or for duration seconds).
+
+        Scans start every interval seconds. If a scan takes longer, the
+        missed starts are skipped instead of scanning back to back.
+        """
+        started = time.monotonic()
+        next_start = started
+        try:
+            while duration is None or time.monotonic() - started < duration:
+                self.sample()
+                if len(self.scans) >= self.batch:
+                    self.flush()
+                now = time.monotonic()
+                next_start += self.interval
+                if next_start < now:
+                    next_start += (now - next_start) // self.interval \
+                        * self.interval + self.interval
+                time.sleep(next_start - now)
+        finally:
+            self.flush()
+
+
+def report(path=SURVEY_FILE, since=None, until=None):
+    """Compute coverage statistics per SSID.
+
+    Args:
+        path (str): The survey database
+        since, until (float): Time range (as time.time(), default: all)
+
+    Returns:
+        (list[dict]) One dictionary per SSID, strongest first, with the
+        entries "ssid", "scans" (number of scans it was seen in),
+        "coverage" (share of all scans in the time range), "quality" (the
+        average), "rssi_min", "rssi_avg", "rssi_max" (None without RSSI),
+        "first_seen" and "last_seen".
+    """
+    since = 0 if since is None else since
+    until = time.time() if until is None else until
+    db = connect_db(path)
+    try:
+        total = db.execute("SELECT COUNT(*) FROM scans "
+                           "WHERE time BETWEEN ? AND ?",
+                           (since, until)).fetchone()[0]
+        rows = db.execute(
+                "SELECT ssid, COUNT(DISTINCT scan), AVG(quality), MIN(rssi), "
+                "AVG(rssi), MAX(rssi), MIN(time), MAX(time) FROM samples "
+                "WHERE time BETWEEN ? AND ? GROUP BY ssid "
+                "ORDER BY AVG(quality) DESC, AVG(rssi) DESC",
+                (since, until)).fetchall()
+    finally:
+        db.close()
+    return [{"ssid": ssid,
+             "scans": scans,
+             "coverage": scans / total if total else 0,
+             "quality": quality,
+             "rssi_min": rssi_min,
+             "rssi_avg": rssi_avg,
+             "rssi_max": rssi_max,
+             "first_seen": first_seen,
+             "last_seen": last_seen}
+            for ssid, scans, quality, rssi_min, rssi_avg, rssi_max,
+            first_seen, last_seen in rows]
+
+
+def format_report(stats):
+    """Format the result of report() as a text table"""
+    lines = [f"{'SSID':<32} {'Coverage':>8} {'Scans':>6} {'Quality':>7} "
+             f"{'RSSI min/avg/max':>18}"]
+    for entry in stats:
+        rssi = "-"
+        if entry["rssi_avg"] is not None:
+            rssi = (f"{entry['rssi_min']}/{entry['rssi_avg']:.0f}/"
+                    f"{entry['rssi_max']}")
+        lines.append(f"{entry['ssid']:<32} {entry['coverage']:>8.0%} "
+                     f"{entry['scans']:>6} {entry['quality']:>7.1f} "
+                     f"{rssi:>18}")
+    return "\n".join(lines)
@@ -0,0 +1,192 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Long running status stream for status bars.
+
+A status record is printed whenever the connection state, the connected
+network, the signal quality or the rfkill state changes. Changes are
+detected by listening to the signals iwd emits on the system bus (through
+dbus-monitor) or, if that's not possible, by polling with an interval that
+grows as long as nothing changes.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import selectors
+import subprocess
+from settings import (WATCH_MIN_INTERVAL, WATCH_MAX_INTERVAL,
+                      WATCH_QUALITY_INTERVAL)
+from .iwdwrapper import IWD
+from .cache import RuntimeCache
+from .status import get_status, format_status
+from . import rfkill
+
+DBUS_MONITOR_CMD = ["dbus-monitor", "--system",
+                    "type='signal',sender='net.connman.iwd'"]
+
+# signals often come in bursts (e.g. one per network during a scan), the
+# burst is over once no signal arrived for DEBOUNCE seconds, but the status
+# is queried after at most MAX_DEBOUNCE seconds of continuous signals
+DEBOUNCE = 1
+MAX_DEBOUNCE = 5
+
+
+class Watcher:
+    """Print the status of a device whenever it changes.
+
+    Only the last emitted record is kept, so memory usage doesn't grow no
+    matter how long it runs.
+
+    Example:
+    ========
+
+        Watcher("wlan0", fmt="i3bar").run()
+    """
+    def __init__(self, device="wlan0", fmt="json", out=sys.stdout,
+                 min_interval=WATCH_MIN_INTERVAL,
+                 max_interval=WATCH_MAX_INTERVAL,
+                 quality_interval=WATCH_QUALITY_INTERVAL):
+        """Constructor.
+
+        Args:
+            device (str): device as used in iwctl
+            fmt (str): "json" (one JSON object per line), "text" or "i3bar"
+                (i3bar protocol)
+            out (file): Where to write the records to
+            min_interval (float): Polling interval after a change (seconds)
+            max_interval (float): Upper limit for the polling interval and
+                the time between checks when driven by iwd signals.
+            quality_interval (float): Upper limit for both while connected,
+                as iwd sends no signal when the signal quality changes.
+        """
+        self.fmt = fmt
+        self.out = out
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.quality_interval = quality_interval
+        self.interval = min_interval
+        self.cache = RuntimeCache()
+        self.iwd = IWD(device, cache=self.cache, max_age=min_interval)
+        self.last_key = None
+
+    def refresh(self):
+        """Query the current status.
+
+        Returns:
+            (dict) The status as returned by get_status()
+        """
+        self.iwd.clear_memo()
+        self.iwd.update_connection_state()
+        adapter = self.iwd.adapter()
+        if adapter is None:
+            self.iwd.update_device_info()
+            adapter = self.iwd.adapter()
+        blocked = None
+        if adapter is not None:
+            blocked = rfkill.is_blocked(adapter, self.cache,
+                                        max_age=self.iwd.max_age)
+        return get_status(self.iwd, blocked)
+
+    def emit(self, status):
+        """Write the status record, if it differs from the last one.
+
+        Returns:
+            True if something has been written.
+        """
+        key = (status["state"], status["ssid"], status["quality"],
+               status["blocked"])
+        if key == self.last_key:
+            return False
+        self.last_key = key
+        if self.fmt == "i3bar":
+            block = {"name": "iwdrofimenu",
+                     "instance": status["device"],
+                     "full_text": format_status(status, "text")}
+            self.out.write(json.dumps([block]) + ",\n")
+        else:
+            self.out.write(format_status(status, self.fmt) + "\n")
+        self.out.flush()
+        return True
+
+    def longest_interval(self):
+        """Return the upper limit for the time between two checks."""
+        if self.last_key is not None and self.last_key[0] == "connected":
+            return min(self.quality_interval, self.max_interval)
+        return self.max_interval
+
+    def update(self):
+        """Refresh and emit the status and adapt the polling interval."""
+        if self.emit(self.refresh()):
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.longest_interval())
+
+    def run(self):
+        """Run until interrupted."""
+        if self.fmt == "i3bar":
+            self.out.write(json.dumps({"version": 1}) + "\n[\n")
+        self.update()
+        try:
+            monitor = subprocess.Popen(DBUS_MONITOR_CMD,
+                                       stdout=subprocess.PIPE,
+                                       stderr=subprocess.DEVNULL)
+        except OSError as error:
+            logging.info("No iwd signals (%s), polling instead", error)
+            self.poll()
+            return
+        try:
+            self.listen(monitor)
+        finally:
+            monitor.kill()
+            monitor.wait()
+
+    def poll(self):
+        """Poll the status with an adaptive interval."""
+        while True:
+            time.sleep(self.interval)
+            self.update()
+
+    def listen(self, monitor):
+        """Update the status whenever iwd sends a signal.
+
+        Fall back to polling if the monitor process ends (e.g. if the
+        system bus is not accessible).
+        """
+        fd = monitor.stdout.fileno()
+        selector = selectors.DefaultSelector()
+        selector.register(fd, selectors.EVENT_READ)
+        while True:
+            if not selector.select(timeout=self.longest_interval()):
+                self.update()
+                continue
+            # the content of the signals is not needed, just drop it
+            if not os.read(fd, 65536):
+                logging.info("dbus-monitor exited, polling instead")
+                self.poll()
+                return
+            # drain the rest of the burst before querying
+            deadline = time.monotonic() + MAX_DEBOUNCE
+            while time.monotonic() < deadline and selector.select(
+                    timeout=min(DEBOUNCE, deadline - time.monotonic())):
+                if not os.read(fd, 65536):
+                    break
+            # the cached results are outdated after a signal
+            self.iwd.invalidate("state")
+            self.cache.invalidate(rfkill.LIST_CMD)
+            self.update()
@@ -22,6 +22,7 @@ if no user configuration is found.
 Also the user configuration is loaded at the end of file.
 """
 
+from os import environ, getuid
 from os.path import realpath, dirname, expanduser
 from configparser import ConfigParser
 import sys
@@ -39,6 +40,92 @@ defaults = {
         "rofi_theme_file": root_dir + "res/style.rasi",
         "show_separator": True,
         "rfkill_cmd": "rfkill",
+        # "png" uses the icons in img_dir, "svg" renders the icons in
+        # res/icons/svg once to icon_size and "theme" passes the names from
+        # the icon_names section to rofi to be looked up in the icon theme
+        "icon_mode": "png",
+        "icon_size": 32,
+        "icon_color": "",  # defaults to the color of the img_subdir variant
+        "icon_cache_dir": environ.get("XDG_CACHE_HOME",
+                                      expanduser("~/.cache"))
+                          + "/iwdrofimenu/icons",
+        "svg_render_cmd": "rsvg-convert",
+        # query results are shared between invocations through this directory
+        "runtime_dir": (environ["XDG_RUNTIME_DIR"] + "/iwdrofimenu"
+                        if "XDG_RUNTIME_DIR" in environ
+                        else f"/tmp/iwdrofimenu-{getuid()}"),
+        # seconds a cached query result is considered fresh
+        "cache_ttl": 10,
+        # polling interval of --watch in seconds, it grows from min to max
+        # as long as nothing changes
+        "watch_min_interval": 2,
+        "watch_max_interval": 30,
+        # signal quality changes aren't announced by iwd, so while connected
+        # --watch checks at least every watch_quality_interval seconds
+        "watch_quality_interval": 10,
+        # scans are never triggered more often than scan_min_interval
+        # seconds, the list is rescanned automatically after scan_interval
+        # seconds, growing up to scan_max_interval while the same networks
+        # are found
+        "scan_min_interval": 5,
+        "scan_interval": 15,
+        "scan_max_interval": 300,
+        # query the data for the next dialog in the background after the
+        # menu is shown
+        "prefetch": True,
+        # wait for a scan triggered with the "Scan" entry to finish (up to
+        # scan_wait_timeout seconds) and show the new list right away
+        "scan_wait": False,
+        "scan_wait_timeout": 10,
+        # cumulative metrics are kept in metrics_file (disabled if empty)
+        # and exported in the Prometheus text format to metrics_textfile
+        "metrics_file": "",
+        "metrics_textfile": "",
+        # --roam checks the signal every roam_interval seconds. If the
+        # quality of the connection is roam_trigger_quality (stars) or
+        # lower, it switches to a known network with at least
+        # roam_target_quality stars, if that one is roam_min_gain stars
+        # better in roam_checks consecutive checks. After connecting it
+        # stays at least roam_dwell seconds with a network.
+        "roam_interval": 10,
+        "roam_trigger_quality": 2,
+        "roam_target_quality": 4,
+        "roam_min_gain": 2,
+        "roam_checks": 3,
+        "roam_dwell": 60,
+        # number of networks forgotten at the same time in the known
+        # networks dialog
+        "forget_workers": 4,
+        # durations and results of connection attempts are kept per network
+        # in history_file, the timeout for a network is the 95th percentile
+        # of its last history_size connection times times
+        # connect_timeout_margin, limited to connect_timeout_min and
+        # connect_timeout_max. Networks without history get connect_timeout.
+        "history_file": environ.get("XDG_STATE_HOME",
+                                    expanduser("~/.local/state"))
+                        + "/iwdrofimenu/history.json",
+        "history_size": 20,
+        "connect_timeout": 5,
+        "connect_timeout_min": 2,
+        "connect_timeout_max": 30,
+        "connect_timeout_margin": 1.5,
+        # after connecting wait up to usable_timeout seconds until the
+        # device has an address, so "connected" means traffic can flow
+        # (0 doesn't wait, e.g. 10 does)
+        "usable_timeout": 0,
+        # --survey scans every survey_interval seconds and writes the
+        # networks seen to the SQLite database survey_file, survey_batch
+        # scans at a time
+        "survey_file": environ.get("XDG_STATE_HOME",
+                                   expanduser("~/.local/state"))
+                       + "/iwdrofimenu/survey.sqlite",
+        "survey_interval": 5,
+        "survey_batch": 12,
+        # launcher used by --dmenu, it has to read the entries as they come
+        # in and understand rofi's -format, -p, -mesg, -a, -u, -no-custom
+        # and -password options
+        "dmenu_cmd": "rofi -dmenu -i -async-pre-read 0 -show-icons "
+                     "-markup-rows",
         },
     "templates": {
         "signal_quality_str_1": "█░░░░",
@@ -50,6 +137,8 @@ defaults = {
         "network_list_entry_active": "",
         "network_list_entry_known": "",
         "connection-details-entry": "$property\t<b>$value</b>",
+        "known_network_entry": "<b>$ssid</b> ($security) $last_connected",
+        "known_network_entry_marked": "",
         "prompt_ssid": "SSID", # this is also the default prompt
         "prompt_pass": "Passphrase",
         "prompt_confirm": "Are you sure",
@@ -61,14 +150,23 @@ defaults = {
         "confirm_discard": "Yes, discard",
         "disconnect": "Disconnect",
         "refresh": "Refresh",
+        "known_networks": "Known networks",
+        "forget_selected": "Forget selected ($count)",
         "enable_wifi": "Activate WiFi",
         "disable_wifi": "Disable WiFi",
         "msg_scanning": "Scanning... Click refresh to update the list",
+        "msg_scan_skipped": "The list has just been updated",
+        "msg_scan_finished": "",
         "msg_really_discard": "Do you really want to remove $ssid from known networks?",
         "msg_connection_not_successful": "Could not connect to $ssid",
         "msg_connection_not_successful_after_pass": "Could not connect to $ssid, maybe the entered passphrase is not correct.",
         "msg_connection_timeout": "Connection attempt to $ssid timed out",
         "msg_connection_successful": "Connection to $ssid established",
+        "msg_connection_no_address": "Connected to $ssid, but no address yet",
+        "msg_connection_not_usable": "Connecting to $ssid, but iwd doesn't report it connected yet",
+        "msg_known_networks": "Enter marks a network, Alt+1 shows its details",
+        "msg_forgot": "Forgot $count known networks",
+        "msg_forget_failed": "Could not forget $failed",
         "msg_wifi_disabled": "WiFi is currently disabled. Do you want to activate it?",
         "meta_disable": "disable block wifi wlan",
         "meta_enable": "enable unblock wifi wlan",
@@ -77,6 +175,11 @@ defaults = {
         "meta_scan": "scan update wifi wlan",
         "meta_refresh": "reload refresh update wifi wlan",
         "meta_showactive": "active connection details wifi wlan",
+        "meta_known_networks": "known saved forget remove wifi wlan",
+        "status_connected": "$ssid $quality_str",
+        "status_disconnected": "disconnected",
+        "status_disabled": "disabled",
+        "status_unavailable": "unavailable",
         },
     "icons": {
         "back":         "arrow-left.png",
@@ -98,6 +201,26 @@ defaults = {
         "wifi-encrypted-signal-4":    "network-wireless-signal-good.png",
         "wifi-encrypted-signal-5":    "network-wireless-signal-excellent.png",
         },
+    "icon_names": {
+        "back":         "go-previous",
+        "confirm":      "dialog-ok",
+        "disconnect":   "network-wireless-disconnected",
+        "trash":        "user-trash",
+        "scan":         "system-search",
+        "refresh":      "view-refresh",
+        "enable":       "network-wireless-signal-excellent",
+        "disable":      "network-wireless-disabled",
+        "wifi-signal-1":    "network-wireless-signal-weak",
+        "wifi-signal-2":    "network-wireless-signal-weak",
+        "wifi-signal-3":    "network-wireless-signal-ok",
+        "wifi-signal-4":    "network-wireless-signal-good",
+        "wifi-signal-5":    "network-wireless-signal-excellent",
+        "wifi-encrypted-signal-1":    "network-wireless-signal-weak-secure",
+        "wifi-encrypted-signal-2":    "network-wireless-signal-weak-secure",
+        "wifi-encrypted-signal-3":    "network-wireless-signal-ok-secure",
+        "wifi-encrypted-signal-4":    "network-wireless-signal-good-secure",
+        "wifi-encrypted-signal-5":    "network-wireless-signal-excellent-secure",
+        },
     }
 
 # possible locations where to find the config
@@ -131,6 +254,46 @@ else:
 ICONS = {key: config["general"]["img_dir"] + img_subdir + filename
          for key, filename in config["icons"].items()
          }
+ICON_MODE = config["general"]["icon_mode"]
+ICON_SIZE = config["general"].getint("icon_size")
+ICON_VARIANT = config["general"]["img_subdir"]
+ICON_COLOR = config["general"]["icon_color"]
+ICON_CACHE_DIR = config["general"]["icon_cache_dir"]
+ICON_NAMES = config["icon_names"]
+SVG_DIR = root_dir + "res/icons/svg"
+SVG_RENDER_CMD = config["general"]["svg_render_cmd"]
+RUNTIME_DIR = config["general"]["runtime_dir"]
+CACHE_TTL = config["general"].getfloat("cache_ttl")
+WATCH_MIN_INTERVAL = config["general"].getfloat("watch_min_interval")
+WATCH_MAX_INTERVAL = config["general"].getfloat("watch_max_interval")
+WATCH_QUALITY_INTERVAL = config["general"].getfloat(
+    "watch_quality_interval")
+SCAN_MIN_INTERVAL = config["general"].getfloat("scan_min_interval")
+SCAN_INTERVAL = config["general"].getfloat("scan_interval")
+SCAN_MAX_INTERVAL = config["general"].getfloat("scan_max_interval")
+PREFETCH = config["general"].getboolean("prefetch")
+SCAN_WAIT = config["general"].getboolean("scan_wait")
+SCAN_WAIT_TIMEOUT = config["general"].getfloat("scan_wait_timeout")
+METRICS_FILE = config["general"]["metrics_file"]
+METRICS_TEXTFILE = config["general"]["metrics_textfile"]
+ROAM_INTERVAL = config["general"].getfloat("roam_interval")
+ROAM_TRIGGER_QUALITY = config["general"].getint("roam_trigger_quality")
+ROAM_TARGET_QUALITY = config["general"].getint("roam_target_quality")
+ROAM_MIN_GAIN = config["general"].getint("roam_min_gain")
+ROAM_CHECKS = config["general"].getint("roam_checks")
+ROAM_DWELL = config["general"].getfloat("roam_dwell")
+FORGET_WORKERS = config["general"].getint("forget_workers")
+HISTORY_FILE = config["general"]["history_file"]
+HISTORY_SIZE = config["general"].getint("history_size")
+CONNECT_TIMEOUT = config["general"].getfloat("connect_timeout")
+CONNECT_TIMEOUT_MIN = config["general"].getfloat("connect_timeout_min")
+CONNECT_TIMEOUT_MAX = config["general"].getfloat("connect_timeout_max")
+CONNECT_TIMEOUT_MARGIN = config["general"].getfloat("connect_timeout_margin")
+USABLE_TIMEOUT = config["general"].getfloat("usable_timeout")
+SURVEY_FILE = config["general"]["survey_file"]
+SURVEY_INTERVAL = config["general"].getfloat("survey_interval")
+SURVEY_BATCH = config["general"].getint("survey_batch")
+DMENU_CMD = config["general"]["dmenu_cmd"]
 
 
 def print_full_config():
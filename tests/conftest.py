@@ -0,0 +1,47 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Shared helpers of the tests.
+
+The tests run the menu end to end against iwdrofimenu.simulator. The
+repository root is put on the path, so the package and the settings module
+are found no matter where pytest is started.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# usable_timeout=0, the simulated device has no address
+DEFAULT_CONFIG = {"usable_timeout": 0, "prefetch": False}
+
+
+def rows(result):
+    """Return the rofi rows of the output of a menu run (without options)"""
+    return [line.split("\0")[0] for line in result.stdout.split("\n")
+            if line and not line.startswith("\0")]
+
+
+def option(result, name):
+    """Return the value of the rofi option name (e.g. "message") or None"""
+    prefix = f"\0{name}\x1f"
+    for line in result.stdout.split("\n"):
+        if line.startswith(prefix):
+            return line[len(prefix):]
+    return None
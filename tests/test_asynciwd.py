@@ -0,0 +1,78 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+"""AsyncIWD against the simulator (run in a child process, which finds the
+simulated iwctl in its PATH)."""
+import os
+import sys
+import time
+import subprocess
+from conftest import ROOT
+from iwdrofimenu.simulator import Simulator
+from iwdrofimenu.cache import RuntimeCache
+
+PSK = {"networks": [{"ssid": "HomeNet", "security": "psk", "rssi": -55,
+                     "passphrase": "secret"}],
+       "known_networks": []}
+
+SCRIPT = f"""
+import sys, asyncio
+sys.path.insert(0, {ROOT!r})
+from iwdrofimenu import AsyncIWD
+
+async def main():
+    iwd = AsyncIWD("wlan0")
+    for arg in sys.argv[1:]:
+        if arg == "disconnect":
+            print((await iwd.disconnect()).value)
+        else:
+            result = await iwd.connect("HomeNet", arg or None)
+            print(result.value.name)
+
+asyncio.run(main())
+"""
+
+
+def run_async(sim, *args):
+    """Start the AsyncIWD calls given by args in a child process"""
+    return subprocess.Popen([sys.executable, "-c", SCRIPT, *args],
+                            env=sim.env(), stdout=subprocess.PIPE, text=True)
+
+
+def test_passphrase_prompt():
+    with Simulator(PSK) as sim:
+        out, _ = run_async(sim, "", "wrong", "secret").communicate(timeout=30)
+        assert out.split() == ["NEED_PASSPHRASE", "NOT_SUCCESSFUL",
+                               "SUCCESS"]
+        assert sim.state()["connected"] == "HomeNet"
+        # the passphrase went to the prompt, not to the command line
+        assert not any("--passphrase" in call["args"] for call in sim.calls())
+
+
+def test_mutation_lock():
+    with Simulator({"connected": "HomeNet"}) as sim:
+        cache = RuntimeCache(os.path.join(sim.env()["XDG_RUNTIME_DIR"],
+                                          "iwdrofimenu"))
+        with cache.lock("mutation"):
+            proc = run_async(sim, "disconnect")
+            time.sleep(1)
+            # waits for the lock
+            assert proc.poll() is None
+            assert sim.state()["connected"] == "HomeNet"
+        out, _ = proc.communicate(timeout=30)
+        assert out.split() == ["True"]
+        assert sim.state()["connected"] is None
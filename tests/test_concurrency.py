@@ -0,0 +1,66 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Concurrent invocations share the queries instead of running them each."""
+import sys
+import subprocess
+from collections import Counter
+from conftest import DEFAULT_CONFIG
+from iwdrofimenu.simulator import Simulator, MENU_SCRIPT
+
+INVOCATIONS = 20
+
+# with single-flight every query runs about once while the others wait
+# for it, without it each invocation runs its own
+MAX_CALLS = {
+    "station show": 5,
+    "device show": 3,
+    "station get-networks": 3,
+    "known-networks list": 5,
+    "station scan": 1,
+}
+
+
+def run_parallel(sim, count, *options):
+    """Run count menus at the same time and return their exit codes"""
+    env = sim.env()
+    procs = [subprocess.Popen([sys.executable, MENU_SCRIPT, *options],
+                              env=env, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+             for _ in range(count)]
+    return [proc.wait(timeout=60) for proc in procs]
+
+
+def test_parallel_menus_share_queries():
+    profile = {"connected": "HomeNet", "latency": {"default": 0.3}}
+    with Simulator(profile, config=DEFAULT_CONFIG) as sim:
+        assert run_parallel(sim, INVOCATIONS) == [0] * INVOCATIONS
+        calls = Counter(call["command"] for call in sim.calls())
+        for command, limit in MAX_CALLS.items():
+            assert calls[command] <= limit, calls
+
+
+def test_parallel_status_share_queries():
+    profile = {"connected": "HomeNet", "latency": {"default": 0.3}}
+    with Simulator(profile, config=DEFAULT_CONFIG) as sim:
+        assert run_parallel(sim, INVOCATIONS, "--status") \
+            == [0] * INVOCATIONS
+        calls = Counter(call["command"] for call in sim.calls())
+        assert calls["station show"] == 1, calls
+        assert calls["device show"] == 1, calls
+        assert calls["rfkill list"] == 1, calls
@@ -0,0 +1,282 @@
+# Copyright, 2023, Bodo Akdeniz
+#
+# This file is part of iwdrofimenu.
+#
+# iwdrofimenu is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# iwdrofimenu is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with iwdrofimenu.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Behavior of the menu under the fault profiles of the simulator."""
+import os
+import sys
+import json
+import time
+import signal
+import subprocess
+import threading
+from conftest import DEFAULT_CONFIG, rows, option
+from iwdrofimenu.simulator import Simulator, MENU_SCRIPT
+from iwdrofimenu.cache import RuntimeCache
+
+OPEN_AND_PSK = {"networks": [{"ssid": "HomeNet", "security": "psk",
+                              "rssi": -55, "passphrase": "secret"},
+                             {"ssid": "Cafe", "security": "open",
+                              "rssi": -72}],
+                "known_networks": []}
+
+
+def commands(sim):
+    """Return the commands run so far"""
+    return [call["command"] for call in sim.calls()]
+
+
+def test_list():
+    with Simulator({"connected": "HomeNet"}, config=DEFAULT_CONFIG) as sim:
+        result, _ = sim.run_menu()
+        assert result.returncode == 0, result.stderr
+        assert any("<b>HomeNet</b>" in row for row in rows(result))
+        assert any("<b>Office</b>" in row for row in rows(result))
+
+
+def test_theme_icons():
+    config = dict(DEFAULT_CONFIG, icon_mode="theme")
+    with Simulator(OPEN_AND_PSK, config=config) as sim:
+        result, _ = sim.run_menu()
+        icons = {row.split("\0")[0]: row.split("icon\x1f")[1].split("\x1f")[0]
+                 for row in result.stdout.split("\n") if "icon\x1f" in row}
+        # the lock is shown for encrypted networks only
+        assert any("HomeNet" in text and icon.endswith("-secure")
+                   for text, icon in icons.items())
+        assert any("Cafe" in text and not icon.endswith("-secure")
+                   for text, icon in icons.items())
+
+
+def test_failed_icon_rendering():
+    config = dict(DEFAULT_CONFIG, icon_mode="svg",
+                  svg_render_cmd="/nonexistent/rsvg-convert")
+    with Simulator({}, config=config) as sim:
+        result, _ = sim.run_menu("--verbose")
+        assert "Rendering icons" in result.stderr
+        # the PNG icons are used without trying again
+        result, _ = sim.run_menu("--verbose")
+        assert result.returncode == 0, result.stderr
+        assert "Rendering icons" not in result.stderr
+        assert ".png" in result.stdout
+
+
+def test_prewarm():
+    with Simulator({}, config=DEFAULT_CONFIG) as sim:
+        result, _ = sim.run_menu("--prewarm")
+        assert result.returncode == 0, result.stderr
+        before = len(sim.calls())
+        # the first menu after the prewarm doesn't query anything
+        result, _ = sim.run_menu(retv="0")
+        assert any("<b>HomeNet</b>" in row for row in rows(result))
+        assert len(sim.calls()) == before
+        # the next one does as usual
+        sim.run_menu(retv="0")
+        assert "station get-networks" in commands(sim)[before:]
+
+
+def test_prefetch_skips_handed_over_queries():
+    def calls(prefetch):
+        config = dict(DEFAULT_CONFIG, prefetch=prefetch)
+        with Simulator({}, config=config) as sim:
+            sim.run_menu()
+            time.sleep(1)  # the prefetch runs detached
+            return sorted(commands(sim))
+
+    # the list hands the state and the known networks over already
+    assert calls(True) == calls(False)
+
+
+def test_latency():
+    profile = {"latency": {"default": 0, "station get-networks":
+                           {"dist": "uniform", "min": 0.4, "max": 0.5}}}
+    with Simulator(profile, config=DEFAULT_CONFIG) as sim:
+        result, seconds = sim.run_menu()
+        assert result.returncode == 0, result.stderr
+        assert seconds >= 0.4
+        durations = [call["duration"] for call in sim.calls()
+                     if call["command"] == "station get-networks"]
+        assert durations and min(durations) >= 0.4
+
+
+def test_metrics_keep_queries_parallel():
+    slow = {"dist": "uniform", "min": 0.5, "max": 0.5}
+    profile = {"latency": {"default": 0, "station get-networks": slow,
+                           "known-networks list": slow}}
+    config = dict(DEFAULT_CONFIG, metrics_file="~/metrics.json")
+    with Simulator(profile, config=config) as sim:
+        metrics = os.path.join(sim.directory, "home", "metrics.json")
+        result, _ = sim.run_menu()
+        assert result.returncode == 0, result.stderr
+        # both slow queries at once, not one after the other
+        first, second = sorted(call["time"] for call in sim.calls()
+                               if call["command"] in profile["latency"])
+        assert second - first < 0.5
+        with open(metrics, encoding="utf-8") as file:
+            histograms = json.load(file)["histograms"]
+        assert any("get-networks" in key for key in histograms)
+
+
+def test_busy_while_scanning():
+    profile = {"scan_duration": 2, "busy_during_scan": ["station scan"]}
+    with Simulator(profile, config=DEFAULT_CONFIG) as sim:
+        sim.run_menu()
+        result, _ = sim.run_menu(arg="Scan", info="cmd#iwd#scan", retv="1")
+        assert result.returncode == 0, result.stderr
+        # the running scan is waited for instead of starting another one
+        assert commands(sim).count("station scan") == 1
+
+
+def test_hung_scan():
+    with Simulator({"hang": {"station scan": 1}, "hang_seconds": 30},
+                   config=DEFAULT_CONFIG) as sim:
+        result, seconds = sim.run_menu()
+        assert result.returncode == 0, result.stderr
+        assert seconds < 10
+        assert any("<b>Cafe</b>" in row for row in rows(result))
+
+
+def test_failing_query():
+    with Simulator({"failures": {"station get-networks": 1}},
+                   config=DEFAULT_CONFIG) as sim:
+        result, _ = sim.run_menu()
+        assert result.returncode == 0, result.stderr
+        assert not any("<b>" in row for row in rows(result))
+
+
+def test_connect_failure():
+    profile = dict(OPEN_AND_PSK, connect_failures={"Cafe": 1})
+    with Simulator(profile, config=DEFAULT_CONFIG) as sim:
+        result, _ = sim.run_menu(arg="Cafe", info="cmd#iwd#connectCafe",
+                                 retv="1")
+        assert option(result, "message") == "Could not connect to Cafe"
+        assert sim.state()["connected"] is None
+
+
+def test_connect_open():
+    with Simulator(OPEN_AND_PSK, config=DEFAULT_CONFIG) as sim:
+        result, _ = sim.run_menu(arg="Cafe", info="cmd#iwd#connectCafe",
+                                 retv="1")
+        assert option(result, "message") == "Connection to Cafe established"
+        assert sim.state()["connected"] == "Cafe"
+
+
+def test_lock_wait_not_learned():
+    with Simulator(OPEN_AND_PSK, config=DEFAULT_CONFIG) as sim:
+        cache = RuntimeCache(os.path.join(sim.env()["XDG_RUNTIME_DIR"],
+                                          "iwdrofimenu"))
+        # another process changes the state for a second
+        with cache.lock("mutation"):
+            menu = threading.Thread(target=sim.run_menu, kwargs={
+                    "arg": "Cafe", "info": "cmd#iwd#connectCafe",
+                    "retv": "1"})
+            menu.start()
+            time.sleep(1)
+        menu.join()
+        assert sim.state()["connected"] == "Cafe"
+        path = os.path.join(sim.directory, "state", "iwdrofimenu",
+                            "history.json")
+        with open(path, encoding="utf-8") as file:
+            durations = json.load(file)["Cafe"]["durations"]
+        # only the time iwctl needs goes into the history
+        assert durations and max(durations) < 0.5
+
+
+def test_passphrase():
+    with Simulator(OPEN_AND_PSK, config=DEFAULT_CONFIG) as sim:
+        result, _ = sim.run_menu(arg="HomeNet",
+                                 info="cmd#iwd#connectHomeNet", retv="1")
+        # asks for the passphrase
+        assert option(result, "prompt") is not None
+        data = option(result, "data")
+        assert data.endswith("cmd#iwd#connectHomeNet")
+
+        result, _ = sim.run_menu(arg="wrong", data=data, retv="2")
+        assert "passphrase is not correct" in option(result, "message")
+        assert sim.state()["connected"] is None
+
+        result, _ = sim.run_menu(arg="secret", data=data, retv="2")
+        assert sim.state()["connected"] == "HomeNet"
+        # the passphrase went to the prompt, not to the command line
+        assert not any("--passphrase" in call["args"] for call in sim.calls())
+
+
+def test_known_network_details():
+    with Simulator({}, config=DEFAULT_CONFIG) as sim:
+        # kb-custom-1 on a known network shows its details below it
+        result, _ = sim.run_menu(arg="[]", data="cmd#iwd#knownnetworks[]",
+                                 info="cmd#known#toggleHomeNet", retv="10")
+        assert "Hidden\t<b>no</b>" in rows(result)
+        # the settable marker is not taken as the name
+        assert "AutoConnect\t<b>yes</b>" in rows(result)
+
+
+def test_survey_keeps_rssi_after_failures():
+    profile = {"failures": {"station get-networks": 1.0}}
+    config = dict(DEFAULT_CONFIG, survey_interval=0.2)
+    with Simulator(profile, config=config) as sim:
+        proc = subprocess.Popen([sys.executable, MENU_SCRIPT, "--survey"],
+                                env=sim.env(), stderr=subprocess.PIPE,
+                                text=True)
+        time.sleep(2)
+        proc.send_signal(signal.SIGINT)
+        _, stderr = proc.communicate(timeout=10)
+        assert "skipping this scan" in stderr
+        assert "can't show the RSSI" not in stderr
+
+
+def test_watch_checks_quality_while_connected():
+    config = dict(DEFAULT_CONFIG, watch_min_interval=0.2,
+                  watch_quality_interval=0.5)
+    with Simulator({"connected": "HomeNet"}, config=config) as sim:
+        proc = subprocess.Popen([sys.executable, MENU_SCRIPT, "--watch"],
+                                env=sim.env(), stdout=subprocess.DEVNULL,
+                                stderr=subprocess.DEVNULL)
+        time.sleep(4)
+        proc.send_signal(signal.SIGINT)
+        proc.communicate(timeout=10)
+        # without the cap the interval would grow 0.2, 0.4, 0.8, 1.6, ...
+        assert commands(sim).count("station show") >= 6
+
+
+def test_rfkill_missing():
+    config = dict(DEFAULT_CONFIG, rfkill_cmd="/nonexistent/rfkill")
+    with Simulator({}, config=config) as sim:
+        result, _ = sim.run_menu()
+        assert result.returncode == 0, result.stderr
+        assert any("<b>HomeNet</b>" in row for row in rows(result))
+        result, _ = sim.run_menu("--status")
+        assert result.returncode == 0, result.stderr
+        assert "Traceback" not in result.stderr
+
+
+def test_rfkill():
+    with Simulator({"connected": "HomeNet"}, config=DEFAULT_CONFIG) as sim:
+        result, _ = sim.run_menu(arg="x", info="cmd#blockwifi", retv="1")
+        assert sim.state()["blocked"]
+        assert sim.state()["connected"] is None
+        assert any("Activate WiFi" in row for row in rows(result))
+
+        result, _ = sim.run_menu(arg="x", info="cmd#unblockwifi", retv="1")
+        assert not sim.state()["blocked"]
+        assert not any("Activate WiFi" in row for row in rows(result))
+
+
+def test_hard_blocked():
+    with Simulator({"hard_blocked": True, "blocked": True},
+                   config=DEFAULT_CONFIG) as sim:
+        sim.run_menu(arg="x", info="cmd#unblockwifi", retv="1")
+        assert sim.state()["blocked"]